@@ -0,0 +1,251 @@
+from datetime import date, timedelta
+from sqlalchemy import Integer, cast, func
+from models import db, Routine, RoutineLog, DEFAULT_USER_ID
+from archive import log_table
+import rollups
+from streaks import current_streak, longest_streak
+
+# 分析APIの集計エンジン
+# 完了数 (月別・週別・曜日別・日別) はロールアップ (rollups.py)、ストリークは RoutineStreak (streaks.py) から読む
+# 予定日が必要な指標 (達成率・ヒートマップ) だけ、直近の期間の完了ログを「ルーチン x 日」のビット行列として読み込む
+# 行はルーチンごとの整数で、ビット i が end - i 日の完了を表す (ビット0 = 期間の最終日)
+# 実施曜日 (target_days) と作成日から「予定日」のマスクを作り、達成率は予定日に対する割合で出す
+
+# 達成率の集計期間 (日数、今日を含む)
+RATE_DAYS = 30
+# 曜日別傾向の集計期間
+DISTRIBUTION_DAYS = 180
+# ヒートマップの表示期間 (12週間)
+HEATMAP_DAYS = 84
+
+
+# 0=Sun ... 6=Sat
+def sunday_weekday(day):
+    return (day.weekday() + 1) % 7
+
+
+def parse_target_days(value):
+    days = set()
+    for part in (value or '').split(','):
+        part = part.strip()
+        if part.isdigit() and 0 <= int(part) <= 6:
+            days.add(int(part))
+    return days
+
+
+class CompletionMatrix:
+    def __init__(self, start, end, rows, schedules):
+        self.start = start
+        self.end = end
+        self.days = (end - start).days + 1
+        self.rows = rows
+        self.schedules = schedules
+
+    def index(self, day):
+        return (self.end - day).days
+
+    # first から last まで (両端を含む) の日のマスク
+    def range_mask(self, first, last):
+        first = max(first, self.start)
+        last = min(last, self.end)
+        if first > last:
+            return 0
+        low = self.index(last)
+        high = self.index(first)
+        return ((1 << (high + 1)) - 1) ^ ((1 << low) - 1)
+
+    def weekday_mask(self, weekday):
+        first = (sunday_weekday(self.end) - weekday) % 7
+        return sum(1 << i for i in range(first, self.days, 7))
+
+    # 予定日の完了数と予定日数
+    def scheduled(self, mask):
+        done = 0
+        total = 0
+        for routine_id, schedule in self.schedules.items():
+            scheduled_mask = schedule & mask
+            done += (self.rows.get(routine_id, 0) & scheduled_mask).bit_count()
+            total += scheduled_mask.bit_count()
+        return done, total
+
+
+# 予定日のマスク: 実施曜日のうち、作成日以降の日
+def _schedule_mask(matrix, target_days, created_at, weekday_masks):
+    mask = 0
+    for weekday in parse_target_days(target_days):
+        mask |= weekday_masks[weekday]
+    if created_at is not None:
+        mask &= matrix.range_mask(created_at.date(), matrix.end)
+    return mask
+
+
+def _log_rows(start, end, routine_ids):
+    # 完了日は end からの日数 (= ビット位置) に変換し、ルーチンごとに1行にまとめて受け取る
+    table = log_table(RoutineLog, start, end)
+    offset = cast(func.julianday(end) - func.julianday(table.c.log_date), Integer)
+    logs = db.session.query(table.c.routine_id, func.group_concat(offset)).filter(
+        table.c.log_date >= start,
+        table.c.log_date <= end,
+        table.c.completed == True
+    ).group_by(table.c.routine_id)
+    if routine_ids is not None:
+        logs = logs.filter(table.c.routine_id.in_(routine_ids))
+
+    rows = {}
+    for routine_id, offsets in logs:
+        bits = 0
+        for i in offsets.split(','):
+            bits |= 1 << int(i)
+        rows[routine_id] = bits
+    return rows
+
+
+# routine_ids を省略すると user_id のユーザーの全ルーチン
+def load_matrix(start, end, routine_ids=None, user_id=DEFAULT_USER_ID):
+    routines = db.session.query(Routine.id, Routine.target_days, Routine.created_at)
+    if routine_ids is not None:
+        routines = routines.filter(Routine.id.in_(routine_ids))
+    else:
+        routines = routines.filter(Routine.user_id == user_id)
+    routines = routines.all()
+    # ログはルーチンIDで絞り込む (ルーチン単位のインデックスを使い、他のユーザーの行は読まない)
+    routine_ids = [routine_id for routine_id, _, _ in routines]
+
+    loaded = _log_rows(start, end, routine_ids)
+    rows = {routine_id: loaded.get(routine_id, 0) for routine_id, _, _ in routines}
+
+    matrix = CompletionMatrix(start, end, rows, {})
+    weekday_masks = [matrix.weekday_mask(w) for w in range(7)]
+    for routine_id, target_days, created_at in routines:
+        matrix.schedules[routine_id] = _schedule_mask(matrix, target_days, created_at, weekday_masks)
+    return matrix
+
+
+def _rate(done, total):
+    return int(done / total * 100) if total else 0
+
+
+def _month_keys(today):
+    return [(today - timedelta(days=30 * i)).isoformat()[:7] for i in range(5, -1, -1)]
+
+
+# first から last まで (両端を含む) の日のうち、曜日 (0=Sun) が weekdays に含まれる日数
+def _count_weekdays(first, last, weekdays):
+    if first > last or not weekdays:
+        return 0
+    weeks, rest = divmod((last - first).days + 1, 7)
+    start = sunday_weekday(first)
+    return weeks * len(weekdays) + sum(1 for i in range(rest) if (start + i) % 7 in weekdays)
+
+
+# 日別ロールアップ {date_str: (weekday, count)} の first から last までの合計
+def _sum_days(daily, first, last):
+    first = first.isoformat()
+    last = last.isoformat()
+    return sum(count for date_str, (_, count) in daily.items() if first <= date_str <= last)
+
+
+# 全体の分析: 直近の達成率・継続中のルーチン数・月別/週別/曜日別の完了数・ヒートマップ
+# 完了数はロールアップから読み、今日より後の日付の完了は含めない
+def overall_analytics(today=None, user_id=DEFAULT_USER_ID):
+    today = today or date.today()
+    month_keys = _month_keys(today)
+    start_of_week = today - timedelta(days=today.weekday())
+
+    # 達成率 (予定日ごとの完了) と継続中のルーチン数だけ直近 RATE_DAYS 日のログを読む
+    matrix = load_matrix(today - timedelta(days=RATE_DAYS - 1), today, user_id=user_id)
+    done, total = matrix.scheduled(matrix.range_mask(matrix.start, today))
+    # 今日か昨日に完了していればストリーク継続中
+    active_streaks = sum(1 for row in matrix.rows.values() if row & 0b11)
+
+    first = min(today - timedelta(days=DISTRIBUTION_DAYS), today - timedelta(days=HEATMAP_DAYS - 1), start_of_week - timedelta(weeks=3))
+    daily = {
+        date_str: value for date_str, value in rollups.daily_counts_since(first.isoformat(), user_id).items()
+        if date_str <= today.isoformat()
+    }
+
+    # 今月は未来日の完了を除くため日別から数え、それより前の月は月別ロールアップを使う
+    this_month = today.isoformat()[:7]
+    monthly = rollups.monthly_counts([m_key for m_key in month_keys if m_key != this_month], user_id)
+    monthly[this_month] = sum(count for date_str, (_, count) in daily.items() if date_str.startswith(this_month))
+    completion_history = [{'month': m_key, 'count': monthly.get(m_key, 0)} for m_key in month_keys]
+
+    weekly_history = []
+    for i in range(3, -1, -1):
+        w_start = start_of_week - timedelta(weeks=i)
+        weekly_history.append({
+            'week': f"{w_start.strftime('%m/%d')}~",
+            'count': _sum_days(daily, w_start, w_start + timedelta(days=6))
+        })
+
+    day_distribution = [0] * 7
+    distribution_start = (today - timedelta(days=DISTRIBUTION_DAYS)).isoformat()
+    for date_str, (weekday, count) in daily.items():
+        if date_str >= distribution_start:
+            day_distribution[weekday] += count
+
+    heatmap = []
+    for back in range(HEATMAP_DAYS - 1, -1, -1):
+        day = (today - timedelta(days=back)).isoformat()
+        heatmap.append({'date': day, 'count': daily.get(day, (None, 0))[1]})
+
+    return {
+        'total_completion_rate': _rate(done, total),
+        'active_streaks': active_streaks,
+        'completion_history': completion_history,
+        'weekly_history': weekly_history,
+        'day_distribution': day_distribution,
+        'heatmap': heatmap
+    }
+
+
+# 作成日から today までの予定日の完了数と予定日数 (予定日の曜日で絞り込んだ件数だけを数える)
+def _scheduled_since_created(routine, today):
+    weekdays = parse_target_days(routine.target_days)
+    first = routine.created_at.date()
+    total = _count_weekdays(first, today, weekdays)
+    if not total:
+        return 0, 0
+    logs = log_table(RoutineLog, first, today)
+    done = db.session.query(func.count()).select_from(logs).filter(
+        logs.c.routine_id == routine.id,
+        logs.c.completed == True,
+        logs.c.log_date >= first,
+        logs.c.log_date <= today,
+        func.strftime('%w', logs.c.log_date).in_([str(w) for w in sorted(weekdays)])
+    ).scalar()
+    return done, total
+
+
+# ルーチン単体の分析
+# ストリークは RoutineStreak、達成率は件数の集計で求め、行列は週別の推移・ヒートマップの期間だけ読み込む
+# 未来日の完了がある場合も最長記録に含める (ストリーク状態と同じ扱い)
+def routine_analytics(routine, today=None):
+    today = today or date.today()
+    start_of_week = today - timedelta(days=today.weekday())
+    # 今週の推移には今日より後の完了も含める
+    matrix = load_matrix(today - timedelta(days=HEATMAP_DAYS - 1), start_of_week + timedelta(days=6), [routine.id])
+    row = matrix.rows[routine.id]
+    done, total = _scheduled_since_created(routine, today)
+
+    weekly_trend = []
+    for i in range(3, -1, -1):
+        w_start = start_of_week - timedelta(weeks=i)
+        weekly_trend.append((row & matrix.range_mask(w_start, w_start + timedelta(days=6))).bit_count())
+
+    heatmap = []
+    for back in range(HEATMAP_DAYS - 1, -1, -1):
+        i = matrix.index(today - timedelta(days=back))
+        heatmap.append({
+            'date': (today - timedelta(days=back)).isoformat(),
+            'completed': bool((row >> i) & 1),
+            'scheduled': bool((matrix.schedules[routine.id] >> i) & 1)
+        })
+
+    return {
+        'current_streak': current_streak(routine.id, today),
+        'longest_streak': longest_streak(routine.id),
+        'completion_rate': _rate(done, total),
+        'weekly_trend': weekly_trend,
+        'heatmap': heatmap
+    }
@@ -1,17 +1,30 @@
 import os
-from datetime import datetime, timedelta, date
-from flask import Flask, render_template, request, jsonify
-from models import db, Routine, RoutineLog, SubTask, SubTaskLog
+import click
+import time
+from datetime import datetime, timedelta, date, MINYEAR, MAXYEAR
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify, session, stream_with_context
+from models import db, Routine, RoutineLog, RoutineStreak, SubTask, SubTaskLog, DEFAULT_USER_ID
+from analytics import overall_analytics, routine_analytics
+from archive import compact_logs, delete_archived, log_table, restore_archived, unarchive_logs
+from assets import build_assets, init_assets, send_asset
+from negotiation import init_negotiation
+from board import load_range_board, load_week_board, MAX_RANGE_DAYS
+from config import load_config
+from cache import response_cache, cached_response, bump_data_version
+from events import init_events, iter_event_stream, latest_event_id, prune_events, record_event, resume_position
+from instrumentation import init_instrumentation
+from sqlite_profile import engine_options, install_sqlite_profile, sqlite_pragmas, write_transaction
+import rollups
+from history import history_page, iter_history, decode_cursor, MAX_PAGE_SIZE
+from migrations import upgrade_schema
+from toggles import set_routine_log, record_subtask_change, recompute_parent_completion, recompute_all_parent_completions, apply_toggle_batch, find_missing_targets, MAX_BATCH_OPERATIONS
+from streaks import rebuild_streaks, backfill_missing_streaks
+from sync import init_sync, prune_tombstones, sync_payload
+from transfer import FORMATS, IMPORT_MIMETYPES, TABLES, import_lines, iter_export
+from users import init_users, current_user_id, ensure_default_user, issue_token, owned_routine_or_404, owned_subtask_or_404, user_for_token
 
-app = Flask(__name__)
-basedir = os.path.abspath(os.path.dirname(__file__))
-
-# データベース設定
-# スキーマ変更時にテーブルを再作成する可能性があるため、同じファイルを使用
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'todos.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
+# APIのルート定義 (create_app でアプリに登録する)
+bp = Blueprint('main', __name__, cli_group=None)
 
 # 週の開始日と終了日を取得するヘルパー関数 (月曜始まり)
 # offset: 現在の週からの週数オフセット (0=今週, -1=先週, 1=来週)
@@ -26,77 +39,148 @@ def get_week_dates(offset=0):
         dates.append(current.isoformat())
     return dates
 
-with app.app_context():
+# APIで受け取った日付文字列 (YYYY-MM-DD) を date に変換する (不正な値は None)
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+# テーブル作成・スキーマのマイグレーション・派生データの補完 (flask upgrade-db、開発時は起動時にも実行)
+# アプリケーションコンテキスト内で呼ぶ。戻り値: 適用したマイグレーション
+def init_database():
     # 実際のアプリではマイグレーションツールを使用すべきだが、
     # ここでは簡易的にテーブル作成を行う
     db.create_all()
+    # 既存DBのスキーマを最新に更新 (列の型変更・インデックス追加など)
+    applied = upgrade_schema()
+    # 既定のユーザー (シングルユーザーモードと移行前のデータの所有者)
+    if ensure_default_user():
+        db.session.commit()
+    # ストリーク状態が未作成のルーチンがあれば履歴から作成する
+    if backfill_missing_streaks():
+        db.session.commit()
+    # 完了数ロールアップが未作成なら RoutineLog から作成する
+    if rollups.backfill_rollups():
+        db.session.commit()
+    return applied
+
+# アプリケーションを作る (config: プロファイル名か設定の辞書。設定の詳細は config.py)
+# DBには接続しない (スキーマの準備は flask upgrade-db で行う) ので、ワーカーの起動が軽い
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(load_config(config))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    response_cache.max_entries = app.config['RESPONSE_CACHE_SIZE']
+
+    db.init_app(app)
+    with app.app_context():
+        # 接続ごとの PRAGMA 設定 (最初の接続より前に登録する)
+        install_sqlite_profile(db.engine, sqlite_pragmas(app.config['SQLITE_PROFILE'], app.config['SQLITE_PRAGMAS']))
+    init_instrumentation(app, db)
+    init_events(app, db)
+    init_sync(app, db)
+    init_users(app, db)
+    init_assets(app)
+    init_negotiation(app)
+    app.register_blueprint(bp)
+
+    if app.config['INIT_DB_ON_STARTUP']:
+        with app.app_context():
+            init_database()
+    return app
 
 # メインページ
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
+# ビルド済みの静的ファイル (flask build-assets で作る。URL にハッシュが付くので長期間キャッシュさせる)
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    return send_asset(filename)
+
+# ログイン API (複数ユーザーモード用): トークンを確かめてセッション Cookie にユーザーを記録する
+# Body: {"token": "..."}  (API クライアントは Cookie を使わず Authorization: Bearer <トークン> でもよい)
+@bp.route('/api/session', methods=['POST'])
+def create_session():
+    data = request.get_json(silent=True) or {}
+    user = user_for_token(data.get('token'))
+    if user is None:
+        return jsonify({'error': 'Invalid token'}), 401
+    if not current_app.secret_key:
+        return jsonify({'error': 'Sessions require SECRET_KEY'}), 500
+    session.clear()
+    session['user_id'] = user.id
+    return jsonify({'id': user.id, 'name': user.name})
+
+# ログアウト API
+@bp.route('/api/session', methods=['DELETE'])
+def delete_session():
+    if current_app.secret_key:
+        session.clear()
+    return jsonify({'message': 'Logged out'})
+
 # ルーチン一覧取得 API
-@app.route('/api/routines', methods=['GET'])
+# クエリパラメータ:
+#   offset      : 週オフセット (デフォルトは0 = 今週)。offset だけなら1週間分を日ごとの {date, completed} で返す
+#   start, end  : 期間 (YYYY-MM-DD, 両端を含む)
+#   weeks       : offset の週から weeks 週間 (例: weeks=3&offset=-1 で前週〜翌週)
+# start/end か weeks を指定すると、日ごとのオブジェクトの代わりに完了ビット列 ('0'/'1', 1日1文字) で返す
+@bp.route('/api/routines', methods=['GET'])
+@cached_response
 def get_routines():
     # クエリパラメータから週オフセットを取得 (デフォルトは0)
     offset = request.args.get('offset', 0, type=int)
-    
+
+    if 'start' in request.args or 'end' in request.args or 'weeks' in request.args:
+        return get_routines_range(offset)
+
     week_dates = get_week_dates(offset)
-    start_date = week_dates[0]
-    end_date = week_dates[-1]
 
-    # 作成日時の降順でルーチンを取得
-    routines = Routine.query.order_by(Routine.created_at.desc()).all()
-    
-    result = []
-    for routine in routines:
-        title = routine.title
-        routine_id = routine.id
-        target_days = routine.target_days
-        
-        # 指定された週の完了ログを取得
-        week_logs = []
-        for d_str in week_dates:
-            log = RoutineLog.query.filter_by(routine_id=routine_id, date_str=d_str).first()
-            week_logs.append({
-                'date': d_str,
-                'completed': log.completed if log else False
-            })
-            
-        # サブタスク情報の取得
-        subtasks = SubTask.query.filter_by(routine_id=routine_id).all()
-        subtasks_data = []
-        for st in subtasks:
-            st_logs = []
-            for d_str in week_dates:
-                st_log = SubTaskLog.query.filter_by(subtask_id=st.id, date_str=d_str).first()
-                st_logs.append({
-                    'date': d_str,
-                    'completed': st_log.completed if st_log else False
-                })
-            subtasks_data.append({
-                'id': st.id,
-                'title': st.title,
-                'week_logs': st_logs
-            })
-            
-        result.append({
-            'id': routine_id,
-            'title': title,
-            'target_days': target_days,
-            'week_logs': week_logs,
-            'subtasks': subtasks_data,
-            'current_streak': calculate_current_streak(routine_id)
-        })
-        
+    # 変更フィードの再開位置 (ボードより先に読むので、以降の変更は取りこぼさない)
+    last_event_id = latest_event_id()
+    # リクエストのユーザーのルーチン・サブタスク・週のログを一括取得して組み立てる
+    result = load_week_board(week_dates, current_user_id())
+
     return jsonify({
         'week_dates': week_dates,
-        'routines': result
+        'routines': result,
+        'last_event_id': last_event_id,
+        'event_stream': current_app.config['EVENT_STREAM']
+    })
+
+# 期間指定のボード (前後の週の先読み・月表示を1リクエストで)
+def get_routines_range(offset):
+    if 'weeks' in request.args:
+        weeks = request.args.get('weeks', type=int)
+        if weeks is None or weeks < 1:
+            return jsonify({'error': 'Invalid weeks'}), 400
+        start = date.fromisoformat(get_week_dates(offset)[0])
+        end = start + timedelta(weeks=weeks) - timedelta(days=1)
+    else:
+        start = parse_date(request.args.get('start'))
+        end = parse_date(request.args.get('end'))
+        if start is None or end is None:
+            return jsonify({'error': 'start and end must be YYYY-MM-DD'}), 400
+    if end < start:
+        return jsonify({'error': 'end must not be before start'}), 400
+    if (end - start).days + 1 > MAX_RANGE_DAYS:
+        return jsonify({'error': f'Range is limited to {MAX_RANGE_DAYS} days'}), 400
+
+    last_event_id = latest_event_id()
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': (end - start).days + 1,
+        'routines': load_range_board(start, end, current_user_id()),
+        'last_event_id': last_event_id,
+        'event_stream': current_app.config['EVENT_STREAM']
     })
 
 # ルーチン追加 API
-@app.route('/api/routines', methods=['POST'])
+@bp.route('/api/routines', methods=['POST'])
+@write_transaction
 def add_routine():
     data = request.get_json()
     title = data.get('title')
@@ -104,257 +188,330 @@ def add_routine():
     if not title:
         return jsonify({'error': 'Title is required'}), 400
     
-    new_routine = Routine(title=title, target_days=target_days)
+    new_routine = Routine(user_id=current_user_id(), title=title, target_days=target_days, streak=RoutineStreak())
     db.session.add(new_routine)
+    db.session.flush()
+    record_event('routine', 'upsert', new_routine.id, new_routine.to_dict())
     db.session.commit()
+    bump_data_version()
     return jsonify({'id': new_routine.id, 'title': new_routine.title}), 201
 
 # ルーチン更新 API (名前変更)
-@app.route('/api/routines/<int:routine_id>', methods=['PUT'])
+@bp.route('/api/routines/<int:routine_id>', methods=['PUT'])
+@write_transaction
 def update_routine(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
+    routine = owned_routine_or_404(routine_id)
     data = request.get_json()
     title = data.get('title')
     
     if title:
-        routine.title = title
+        # 名前が変わらない場合はイベントを出さない (ボードの ETag も変わらない)
+        if routine.title != title:
+            routine.title = title
+            record_event('routine', 'upsert', routine.id, routine.to_dict())
         db.session.commit()
+        bump_data_version()
         return jsonify(routine.to_dict())
     
     return jsonify({'error': 'No data provided'}), 400
 
 # 全履歴取得 API (グローバルカレンダー用)
-@app.route('/api/history/all', methods=['GET'])
+# クエリパラメータ:
+#   from, to       : 期間 (YYYY-MM-DD, 両端を含む)
+#   routine_id     : 特定ルーチンのみ
+#   completed_only : 0 を指定すると未完了のログも含める (デフォルトは完了のみ)
+#   limit, cursor  : キーセットページング ({items, next_cursor} を返す)
+#   format=ndjson  : 1行1件の NDJSON でストリーミング
+# limit も format も指定しない場合は従来どおり配列を返す (組み立てずにストリーミング)
+@bp.route('/api/history/all', methods=['GET'])
 def get_all_history():
-    # すべてのルーチンログを取得し、ルーチンタイトルと結合
-    logs = db.session.query(RoutineLog, Routine.title).join(Routine).order_by(RoutineLog.date_str.desc()).all()
-    
-    history_data = []
-    for log, title in logs:
-        history_data.append({
-            'date': log.date_str,
-            'routine_id': log.routine_id,
-            'title': title
-        })
-        
-    return jsonify(history_data)
+    filters = {
+        'user_id': current_user_id(),
+        'routine_id': request.args.get('routine_id', type=int),
+        'completed_only': request.args.get('completed_only', '1') != '0'
+    }
+    for key, param in (('start', 'from'), ('end', 'to')):
+        if request.args.get(param):
+            filters[key] = parse_date(request.args.get(param))
+            if filters[key] is None:
+                return jsonify({'error': f'Invalid {param} date'}), 400
+    if request.args.get('cursor'):
+        filters['cursor'] = decode_cursor(request.args.get('cursor'))
+        if filters['cursor'] is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate_ndjson():
+            for item in iter_history(**filters):
+                yield current_app.json.dumps(item) + '\n'
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+    if 'limit' in request.args:
+        limit = request.args.get('limit', type=int)
+        if not limit or limit < 1:
+            return jsonify({'error': 'Invalid limit'}), 400
+        items, next_cursor = history_page(min(limit, MAX_PAGE_SIZE), **filters)
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+
+    def generate_array():
+        yield '['
+        for index, item in enumerate(iter_history(**filters)):
+            yield (',' if index else '') + current_app.json.dumps(item)
+        yield ']'
+    return Response(stream_with_context(generate_array()), mimetype='application/json')
 
 # 日次ステータス切り替え API (完了/未完了)
-@app.route('/api/routines/<int:routine_id>/toggle', methods=['POST'])
+@bp.route('/api/routines/<int:routine_id>/toggle', methods=['POST'])
+@write_transaction
 def toggle_routine_day(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
+    routine = owned_routine_or_404(routine_id)
     data = request.json
     date_str = data.get('date') # 期待形式: YYYY-MM-DD
     
     if not date_str:
          return jsonify({'error': 'Date is required'}), 400
-         
-    log = RoutineLog.query.filter_by(routine_id=routine.id, date_str=date_str).first()
+    log_date = parse_date(date_str)
+    if log_date is None:
+        return jsonify({'error': 'Invalid date'}), 400
+
+    # アーカイブ済みの日付ならその日のログを元のテーブルに戻してから更新する
+    restore_archived([(routine.id, log_date)])
+    log = RoutineLog.query.filter_by(routine_id=routine.id, log_date=log_date).first()
     
-    if log:
-        # 既存ログがあれば反転
-        log.completed = not log.completed
-    else:
-        # 新規ログ作成
-        log = RoutineLog(routine_id=routine.id, date_str=date_str, completed=True)
-        db.session.add(log)
+    # 既存ログがあれば反転、なければ完了として新規作成 (ストリーク・ロールアップも差分更新)
+    completed = not log.completed if log else True
+    set_routine_log(routine.id, log_date, completed, log)
         
     db.session.commit()
+    bump_data_version()
+    return jsonify({'date': log_date.isoformat(), 'completed': completed})
+
+# 一括ステータス設定 API
+# Body: {"operations": [{"kind": "routine" | "subtask", "id": 1, "date": "YYYY-MM-DD", "completed": true}, ...]}
+# 反転ではなく指定した状態に設定し、全操作を1トランザクションで適用する
+@bp.route('/api/toggles/batch', methods=['POST'])
+@write_transaction
+def toggle_batch():
+    data = request.get_json(silent=True) or {}
+    raw_operations = data.get('operations')
+    if not isinstance(raw_operations, list) or not raw_operations:
+        return jsonify({'error': 'Operations are required'}), 400
+    if len(raw_operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'Too many operations (max {MAX_BATCH_OPERATIONS})'}), 400
+
+    # 1件でも不正な操作があれば何も適用しない
+    operations = []
+    for index, op in enumerate(raw_operations):
+        if not isinstance(op, dict):
+            return jsonify({'error': f'Invalid operation at index {index}'}), 400
+        kind = op.get('kind')
+        item_id = op.get('id')
+        log_date = parse_date(op.get('date'))
+        completed = op.get('completed')
+        if kind not in ('routine', 'subtask') or not isinstance(item_id, int) or isinstance(item_id, bool) \
+                or log_date is None or not isinstance(completed, bool):
+            return jsonify({'error': f'Invalid operation at index {index}'}), 400
+        operations.append((kind, item_id, log_date, completed))
+
+    missing = find_missing_targets(operations, current_user_id())
+    if missing:
+        return jsonify({
+            'error': 'Not found',
+            'missing': [{'kind': kind, 'id': item_id} for kind, item_id in missing]
+        }), 404
+
+    results, parents = apply_toggle_batch(operations)
     db.session.commit()
-    return jsonify({'date': date_str, 'completed': log.completed})
+    bump_data_version()
+    return jsonify({'results': results, 'parent_routines': parents})
 
 # サブタスク追加 API
-@app.route('/api/routines/<int:routine_id>/subtasks', methods=['POST'])
+@bp.route('/api/routines/<int:routine_id>/subtasks', methods=['POST'])
+@write_transaction
 def add_subtask(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
+    routine = owned_routine_or_404(routine_id)
     title = request.json.get('title')
     if not title:
         return jsonify({'error': 'Title is required'}), 400
         
     subtask = SubTask(routine_id=routine.id, title=title)
     db.session.add(subtask)
+    db.session.flush()
+    record_event('subtask', 'upsert', subtask.id, subtask.to_dict())
     db.session.commit()
+    bump_data_version()
     return jsonify(subtask.to_dict()), 201
 
 # サブタスク削除 API
-@app.route('/api/subtasks/<int:subtask_id>', methods=['DELETE'])
+@bp.route('/api/subtasks/<int:subtask_id>', methods=['DELETE'])
+@write_transaction
 def delete_subtask(subtask_id):
-    subtask = SubTask.query.get_or_404(subtask_id)
+    subtask = owned_subtask_or_404(subtask_id)
+    record_event('subtask', 'delete', subtask.id, {'id': subtask.id, 'routine_id': subtask.routine_id})
+    delete_archived(subtask_id=subtask.id)
     db.session.delete(subtask)
     db.session.commit()
+    bump_data_version()
     return jsonify({'message': 'Subtask deleted'})
 
 # サブタスク用ステータス切り替え API
-@app.route('/api/subtasks/<int:subtask_id>/toggle', methods=['POST'])
+@bp.route('/api/subtasks/<int:subtask_id>/toggle', methods=['POST'])
+@write_transaction
 def toggle_subtask(subtask_id):
-    subtask = SubTask.query.get_or_404(subtask_id)
+    subtask = owned_subtask_or_404(subtask_id)
     date_str = request.json.get('date')
     
     if not date_str:
         return jsonify({'error': 'Date is required'}), 400
+    log_date = parse_date(date_str)
+    if log_date is None:
+        return jsonify({'error': 'Invalid date'}), 400
         
     # Toggle logic for subtask
-    log = SubTaskLog.query.filter_by(subtask_id=subtask.id, date_str=date_str).first()
+    restore_archived([(subtask.routine_id, log_date)])
+    log = SubTaskLog.query.filter_by(subtask_id=subtask.id, log_date=log_date).first()
     if log:
         log.completed = not log.completed
     else:
-        log = SubTaskLog(subtask_id=subtask.id, date_str=date_str, completed=True)
+        log = SubTaskLog(subtask_id=subtask.id, log_date=log_date, completed=True)
         db.session.add(log)
+    record_subtask_change(subtask.id, subtask.routine_id, log_date, log.completed)
     
-    db.session.commit() # Commit subtask change first
-    
-    # Check parent routine completion
-    # 親ルーチンのステータスを自動判定：その日の全てのサブタスクが完了していればTrue
-    parent_routine = Routine.query.get(subtask.routine_id)
-    all_subtasks = SubTask.query.filter_by(routine_id=parent_routine.id).all()
-    
-    all_complete = True
-    for st in all_subtasks:
-        st_log = SubTaskLog.query.filter_by(subtask_id=st.id, date_str=date_str).first()
-        if not st_log or not st_log.completed:
-            all_complete = False
-            break
-            
-    # Update parent routine log
-    routine_log = RoutineLog.query.filter_by(routine_id=parent_routine.id, date_str=date_str).first()
-    if routine_log:
-        routine_log.completed = all_complete
-    elif all_complete:
-        # Create log if it doesn't exist and it's complete
-        routine_log = RoutineLog(routine_id=parent_routine.id, date_str=date_str, completed=True)
-        db.session.add(routine_log)
+    # Check parent routine completion (same transaction as the subtask change)
+    all_complete = recompute_parent_completion(subtask.routine_id, log_date)
         
     db.session.commit()
+    bump_data_version()
     
     return jsonify({
         'subtask_id': subtask.id, 
-        'date': date_str, 
+        'date': log_date.isoformat(), 
         'completed': log.completed,
         'parent_routine_completed': all_complete
     })
 
 # ルーチン削除 API
-@app.route('/api/routines/<int:routine_id>', methods=['DELETE'])
+@bp.route('/api/routines/<int:routine_id>', methods=['DELETE'])
+@write_transaction
 def delete_routine(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
+    routine = owned_routine_or_404(routine_id)
+    # 削除されるログの完了数をロールアップから差し引く
+    rollups.remove_routine_completions(routine.id)
+    record_event('routine', 'delete', routine.id, {'id': routine.id})
+    delete_archived(routine_id=routine.id)
     db.session.delete(routine)
     db.session.commit()
+    bump_data_version()
     return jsonify({'message': 'Routine deleted'})
 
+# 変更フィード API (Server-Sent Events)
+# 再開位置は Last-Event-ID ヘッダ (EventSource の自動再接続)、なければ after パラメータ
+# どちらも無い場合は現在の最新位置から送る (過去のイベントは再送しない)
+# EVENT_STREAM が無効な構成 (同期ワーカー) では、1本のストリームがワーカーを占有しないよう配信しない
+@bp.route('/api/events', methods=['GET'])
+def stream_events():
+    if not current_app.config['EVENT_STREAM']:
+        return jsonify({'error': 'Event stream is not available'}), 404
+    try:
+        last_id = resume_position(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+
+    stream = iter_event_stream(
+        last_id,
+        current_user_id(),
+        timeout=current_app.config['EVENT_STREAM_TIMEOUT'],
+        heartbeat=current_app.config['EVENT_HEARTBEAT_SECONDS'],
+        poll_interval=current_app.config['EVENT_POLL_SECONDS'],
+        retry_ms=current_app.config['EVENT_RETRY_MS']
+    )
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx などのプロキシでバッファリングさせない
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# 差分同期 API (オフライン対応クライアント用)
+# since: 前回のレスポンスの seq (0 または省略で全件)
+# 各テーブルの変更行を配列で返す。クライアントは deleted を先に適用してから変更行を上書きする
+@bp.route('/api/sync', methods=['GET'])
+def get_sync():
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return jsonify({'error': 'Invalid since'}), 400
+    return jsonify(sync_payload(int(since), current_user_id()))
+
+# 一括エクスポート API
+# format: ndjson (既定、全テーブル) / csv (table の指定が必要)
+# table : routines / subtasks / routine_logs / subtask_logs (ndjson では省略すると全テーブル)
+@bp.route('/api/export', methods=['GET'])
+def export_data():
+    fmt = request.args.get('format', 'ndjson')
+    table = request.args.get('table')
+    if fmt not in FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+    if table is not None and table not in TABLES:
+        return jsonify({'error': 'Invalid table'}), 400
+    if fmt == 'csv' and table is None:
+        return jsonify({'error': 'CSV export requires a table'}), 400
+
+    tables = [table] if table else list(TABLES)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(iter_export(fmt, tables, current_user_id())), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={table or "todos"}.{fmt}'
+    return response
+
+# 一括インポート API
+# Body: NDJSON または CSV のファイルそのもの (format で指定、既定は ndjson)
+# Content-Type は NDJSON なら application/x-ndjson か application/json、CSV なら text/csv (それ以外は 415)
+# 既存の行は上書きする。不正な行があれば 400 を返す (それより前のまとまりは書き込み済み)
+@bp.route('/api/import', methods=['POST'])
+def import_data():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+    if request.mimetype not in IMPORT_MIMETYPES[fmt]:
+        return jsonify({'error': f"Content-Type must be {' or '.join(IMPORT_MIMETYPES[fmt])}"}), 415
+    lines = (line.decode('utf-8') for line in request.stream)
+    counts, error = import_lines(lines, fmt, user_id=current_user_id())
+    if error:
+        return jsonify({'error': error, 'imported': counts}), 400
+    return jsonify({'imported': counts})
+
 # ルーチン履歴取得 API (特定年)
-@app.route('/api/routines/<int:routine_id>/history', methods=['GET'])
+@bp.route('/api/routines/<int:routine_id>/history', methods=['GET'])
 def get_routine_history(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
+    routine = owned_routine_or_404(routine_id)
     year = request.args.get('year', default=datetime.now().year, type=int)
+    # 翌年の1月1日を範囲の終わりに使うので、最後の年 (9999) は指定できない
+    if not MINYEAR <= year < MAXYEAR:
+        return jsonify({'error': 'Invalid year'}), 400
     
-    # 指定年の完了ログを検索
-    logs = RoutineLog.query.filter(
-        RoutineLog.routine_id == routine.id,
-        RoutineLog.date_str.like(f'{year}-%'),
-        RoutineLog.completed == True
-    ).all()
+    # 指定年の完了ログを検索 (日付の範囲検索でインデックスを使う。アーカイブ済みの年はアーカイブも読む)
+    logs = log_table(RoutineLog, date(year, 1, 1), date(year, 12, 31))
+    dates = [log_date for (log_date,) in db.session.query(logs.c.log_date).filter(
+        logs.c.routine_id == routine.id,
+        logs.c.log_date >= date(year, 1, 1),
+        logs.c.log_date < date(year + 1, 1, 1),
+        logs.c.completed == True
+    ).order_by(logs.c.log_date)]
     
     return jsonify({
         'routine_title': routine.title,
         'year': year,
-        'completed_dates': [log.date_str for log in logs]
+        'completed_dates': [log_date.isoformat() for log_date in dates]
     })
 
 # --- Analytics Endpoints ---
+# 集計は analytics.py (完了ログのビット行列) で行う
 
-@app.route('/api/analytics/overall', methods=['GET'])
+@bp.route('/api/analytics/overall', methods=['GET'])
+@cached_response
 def get_overall_analytics():
-    # 0. Set range for "recent history" (e.g. 90 days)
-    today = date.today()
-    start_date = today - timedelta(days=90)
-    
-    # 1. Total Completion Rate (past 30 days)
-    # Get all logs in past 30 days
-    recent_start = today - timedelta(days=30)
-    recent_str = recent_start.isoformat()
-    
-    # Count total routines (approximate target: routines * 30 days) 
-    # NOTE: This is a simplification. Ideally check creation date of each routine.
-    routines = Routine.query.all()
-    # Count *total target days* in the period is complex if routine created mid-period.
-    # For MVP: Count Total Completed Logs / (Active Routines * 30 * (avg target days %))
-    
-    completed_logs_count = RoutineLog.query.filter(
-        RoutineLog.date_str >= recent_str,
-        RoutineLog.completed == True
-    ).count()
-    
-    # Simplified denominator: (Active Routines) * 30
-    total_active_routines = len(routines) if routines else 1
-    total_possible = total_active_routines * 30 
-    
-    completion_rate = 0
-    if total_possible > 0:
-        completion_rate = int((completed_logs_count / total_possible) * 100)
-        
-    # 2. Active Streaks (Count of routines with streak > 0)
-    active_streaks_count = 0
-    for r in routines:
-        # Check if done today or yesterday
-        streak = calculate_current_streak(r.id)
-        if streak > 0:
-            active_streaks_count += 1
-            
-    # 3. Completion History (Monthly for graph)
-    # Group logs by month for last 6 months
-    history_start = today - timedelta(days=180) # 6 months
-    logs = RoutineLog.query.filter(
-        RoutineLog.date_str >= history_start.isoformat(),
-        RoutineLog.completed == True
-    ).all()
-    
-    monthly_counts = {}
-    for log in logs:
-        # YYYY-MM
-        m_key = log.date_str[:7]
-        monthly_counts[m_key] = monthly_counts.get(m_key, 0) + 1
-        
-    # Fill gaps
-    history_graph = []
-    # Generate last 6 month keys
-    for i in range(5, -1, -1):
-        d = today - timedelta(days=30*i)
-        m_key = d.isoformat()[:7]
-        history_graph.append({
-            'month': m_key,
-            'count': monthly_counts.get(m_key, 0)
-        })
-
-    # 4. Weekly History (Last 4 weeks)
-    weekly_history = []
-    # Start from beginning of this week (Monday)
-    start_of_week = today - timedelta(days=today.weekday())
-
-    for i in range(3, -1, -1): # 3 weeks ago to 0 (this week)
-        w_start = start_of_week - timedelta(weeks=i)
-        w_end = w_start + timedelta(days=6)
-        
-        # Count ALL logs done in this week
-        count = RoutineLog.query.filter(
-            RoutineLog.date_str >= w_start.isoformat(),
-            RoutineLog.date_str <= w_end.isoformat(),
-            RoutineLog.completed == True
-        ).count()
-        
-        # Label: "MM/DD~" (Simplified)
-        label = f"{w_start.strftime('%m/%d')}~"
-        weekly_history.append({
-            'week': label,
-            'count': count
-        })
-
-    # 5. Day Distribution
-    day_counts = [0] * 7 # Sun-Sat
-    for log in logs:
-        d = datetime.strptime(log.date_str, '%Y-%m-%d')
-        day_idx = int(d.strftime('%w')) # 0=Sun
-        day_counts[day_idx] += 1
-        
+    data = overall_analytics(user_id=current_user_id())
+    completion_rate = data['total_completion_rate']
+    active_streaks_count = data['active_streaks']
+
     # Advice Logic
     advice = "この調子で続けましょう！"
     if completion_rate > 80:
@@ -366,82 +523,155 @@ def get_overall_analytics():
     else:
         advice = "まずは小さな一歩から。今日一つだけタスクを完了させてみましょう！"
 
-    return jsonify({
-        'total_completion_rate': completion_rate,
-        'active_streaks': active_streaks_count,
-        'completion_history': history_graph,
-        'weekly_history': weekly_history, # Added this line
-        'day_distribution': day_counts,
-        'advice': advice
-    })
+    data['advice'] = advice
+    return jsonify(data)
 
-def calculate_current_streak(routine_id):
-    # Calculate streaks by checking backwards from today
-    streak = 0
-    check_date = date.today()
-    
-    # If today not done, check if yesterday was done to verify if streak is alive?
-    # Actually, usually "Current Streak" includes today if done, or continues from yesterday.
-    # If yesterday is NOT done (and today NOT done), streak is 0.
-    
-    # Check today
-    log = RoutineLog.query.filter_by(routine_id=routine_id, date_str=check_date.isoformat(), completed=True).first()
-    if not log:
-        # If not done today, check yesterday. If yesterday done, streak is maintained (but doesn't increment today yet)
-        check_date = check_date - timedelta(days=1)
-        log = RoutineLog.query.filter_by(routine_id=routine_id, date_str=check_date.isoformat(), completed=True).first()
-        if not log:
-            return 0 # Lost streak
-    
-    # If we are here, we found the start of the streak (either today or yesterday)
+@bp.route('/api/analytics/routine/<int:routine_id>', methods=['GET'])
+@cached_response
+def get_routine_analytics(routine_id):
+    routine = owned_routine_or_404(routine_id)
+    return jsonify(dict(routine_analytics(routine), title=routine.title))
+
+# テーブル作成・スキーマのマイグレーション・派生データの補完を行うコマンド (デプロイ時・初回起動前に実行する)
+# 使い方: flask --app app upgrade-db
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    applied = init_database()
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+# ストリーク状態を RoutineLog の履歴から再構築するコマンド
+# 使い方: flask --app app rebuild-streaks
+@bp.cli.command('rebuild-streaks')
+def rebuild_streaks_command():
+    states = rebuild_streaks()
+    db.session.commit()
+    print(f"Rebuilt streaks for {len(states)} routines.")
+
+# 完了数ロールアップを RoutineLog から作り直すコマンド
+# 使い方: flask --app app rebuild-rollups
+@bp.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    days = rollups.rebuild_rollups()
+    db.session.commit()
+    print(f"Rebuilt rollups for {days} days.")
+
+# ロールアップと RoutineLog の整合性を確認するコマンド (食い違いがあれば終了コード1)
+# 使い方: flask --app app check-rollups
+@bp.cli.command('check-rollups')
+def check_rollups_command():
+    mismatches = rollups.check_rollups()
+    for kind, (user_id, key), stored, actual in mismatches:
+        print(f"{kind} {key} (user {user_id}): rollup={stored} actual={actual}")
+    if mismatches:
+        raise SystemExit(1)
+    print("Rollups are consistent.")
+
+# サブタスクを持つルーチンの達成状態をサブタスクログから再計算するコマンド
+# 使い方: flask --app app recompute-parents
+@bp.cli.command('recompute-parents')
+def recompute_parents_command():
+    count = recompute_all_parent_completions()
+    db.session.commit()
+    print(f"Recomputed parent completion for {count} routine days.")
+
+# 古い変更イベントを削除するコマンド
+# 使い方: flask --app app prune-events --keep-days 7
+@bp.cli.command('prune-events')
+@click.option('--keep-days', default=7, show_default=True, type=int)
+def prune_events_command(keep_days):
+    deleted = prune_events(keep_days)
+    db.session.commit()
+    print(f"Deleted {deleted} change events older than {keep_days} days.")
+
+# 古い削除の墓標を削除するコマンド (それより前からの同期は全件になる)
+# 使い方: flask --app app prune-tombstones --keep-days 30
+@bp.cli.command('prune-tombstones')
+@click.option('--keep-days', default=30, show_default=True, type=int)
+def prune_tombstones_command(keep_days):
+    deleted = prune_tombstones(keep_days)
+    db.session.commit()
+    print(f"Deleted {deleted} tombstones older than {keep_days} days.")
+
+# ユーザーを作り、API トークンを表示するコマンド (同じ名前のユーザーがいればトークンを作り直す)
+# 移行前のデータは "default" ユーザーのものなので、複数ユーザーモードでは flask create-user default でトークンを作る
+# 使い方: flask --app app create-user alice
+@bp.cli.command('create-user')
+@click.argument('name')
+def create_user_command(name):
+    user, token = issue_token(name)
+    db.session.commit()
+    print(f"User {user.name} (id {user.id}) token: {token}")
+
+# ユーザーのデータを NDJSON / CSV に書き出すコマンド (CSV は --table で1テーブルずつ)
+# 使い方: flask --app app export-data --output todos.ndjson
+@bp.cli.command('export-data')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--table', type=click.Choice(list(TABLES)), default=None)
+@click.option('--output', default='-', show_default=True)
+@click.option('--user-id', type=int, default=DEFAULT_USER_ID, show_default=True)
+def export_data_command(fmt, table, output, user_id):
+    if fmt == 'csv' and table is None:
+        raise click.UsageError('CSV export requires --table')
+    with click.open_file(output, 'w', encoding='utf-8') as f:
+        for chunk in iter_export(fmt, [table] if table else list(TABLES), user_id):
+            f.write(chunk)
+
+# NDJSON / CSV ファイルをユーザーのデータとして取り込むコマンド (既存の行は上書き、形式は拡張子から判定)
+# 使い方: flask --app app import-data todos.ndjson
+@bp.cli.command('import-data')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None)
+@click.option('--user-id', type=int, default=DEFAULT_USER_ID, show_default=True)
+def import_data_command(path, fmt, user_id):
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+    with open(path, encoding='utf-8', newline='') as f:
+        counts, error = import_lines(f, fmt, user_id=user_id)
+    print(f"Imported {counts}")
+    if error:
+        print(f"Import stopped at {error}")
+        raise SystemExit(1)
+
+# 古い完了ログを年ごとのアーカイブテーブルに移すコマンド (ARCHIVE_AFTER_DAYS が必要)
+# バッチごとにコミットするので、途中で止めても次の実行で続きから移す。--watch を付けると指定秒ごとに繰り返す
+# 使い方: flask --app app compact-logs --batch-size 5000 --watch 3600
+@bp.cli.command('compact-logs')
+@click.option('--batch-size', default=5000, show_default=True, type=int)
+@click.option('--max-batches', default=None, type=int, help='stop after this many batches')
+@click.option('--pause', default=0.05, show_default=True, type=float, help='seconds to wait between batches')
+@click.option('--watch', default=0, show_default=True, type=float, help='repeat every N seconds (0: run once)')
+def compact_logs_command(batch_size, max_batches, pause, watch):
+    if not current_app.config['ARCHIVE_AFTER_DAYS']:
+        raise click.UsageError('Set ARCHIVE_AFTER_DAYS to enable log archiving')
     while True:
-        log = RoutineLog.query.filter_by(routine_id=routine_id, date_str=check_date.isoformat(), completed=True).first()
-        if log:
-            streak += 1
-            check_date = check_date - timedelta(days=1)
-        else:
+        moved = compact_logs(batch_size, max_batches, pause)
+        print(f"Archived {moved}")
+        if not watch:
             break
-    return streak
+        time.sleep(watch)
 
-@app.route('/api/analytics/routine/<int:routine_id>', methods=['GET'])
-def get_routine_analytics(routine_id):
-    routine = Routine.query.get_or_404(routine_id)
-    
-    # 1. Streaks
-    current_streak = calculate_current_streak(routine.id)
-    
-    # 2. Overall Completion Rate
-    total_logs = RoutineLog.query.filter_by(routine_id=routine.id, completed=True).count()
-    # Determine days since creation
-    days_exist = (datetime.now() - routine.created_at).days + 1
-    rate = int((total_logs / days_exist) * 100) if days_exist > 0 else 0
-    
-    # 3. Weekly Trend (Last 4 weeks)
-    weekly_trend = []
-    today = date.today()
-    # Start from beginning of this week (Monday)
-    start_of_week = today - timedelta(days=today.weekday())
-    
-    for i in range(3, -1, -1): # 3 weeks ago to 0 (this week)
-        w_start = start_of_week - timedelta(weeks=i)
-        w_end = w_start + timedelta(days=6)
-        
-        # Count done in this week
-        count = RoutineLog.query.filter(
-            RoutineLog.routine_id == routine.id,
-            RoutineLog.date_str >= w_start.isoformat(),
-            RoutineLog.date_str <= w_end.isoformat(),
-            RoutineLog.completed == True
-        ).count()
-        weekly_trend.append(count)
+# アーカイブした完了ログを全て元のテーブルに戻すコマンド (ARCHIVE_AFTER_DAYS を増やす・無効にする前に実行する)
+# 使い方: flask --app app unarchive-logs
+@bp.cli.command('unarchive-logs')
+@write_transaction
+def unarchive_logs_command():
+    restored = unarchive_logs()
+    db.session.commit()
+    print(f"Restored {restored}")
 
-    return jsonify({
-        'title': routine.title,
-        'current_streak': current_streak,
-        'completion_rate': rate,
-        'weekly_trend': weekly_trend
-    })
+# 静的ファイルの縮小・フィンガープリント・事前圧縮 (ASSET_DIR に書き出す。反映にはワーカーの再起動が必要)
+# 使い方: flask --app app build-assets
+@bp.cli.command('build-assets')
+def build_assets_command():
+    output_dir = current_app.config['ASSET_DIR']
+    manifest = build_assets(current_app.static_folder, output_dir)
+    for name, output in manifest.items():
+        sizes = [os.path.getsize(os.path.join(output_dir, output + ext)) for ext in ('', '.gz')]
+        print(f"{name} -> {output} ({sizes[0]} bytes, gzip {sizes[1]} bytes)")
+
+# gunicorn app:app・flask --app app・検証スクリプトが使うアプリ (プロファイルは APP_ENV、既定は production)
+app = create_app()
 
 if __name__ == '__main__':
-    # 外部アクセス許可、ポート5001で起動
-    app.run(debug=True, port=5001, host='0.0.0.0')
+    # 開発用サーバー (APP_ENV の既定は development: デバッグ有効、外部アクセス許可、ポート5001)
+    dev_app = create_app(os.environ.get('APP_ENV', 'development'))
+    dev_app.run(debug=dev_app.config['DEBUG'], port=dev_app.config['PORT'], host=dev_app.config['HOST'])
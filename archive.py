@@ -0,0 +1,229 @@
+import time
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import Boolean, Column, Date, Index, Integer, Table, and_, delete, insert, select, text, true, tuple_, union_all
+from models import db, RoutineLog, SubTask, SubTaskLog
+from sqlite_profile import write_transaction
+
+# 古い完了ログのアーカイブ (年ごとのテーブルへの移動)
+# ARCHIVE_AFTER_DAYS 日より前のログを、flask compact-logs で年ごとのアーカイブテーブルに移す
+#   routine_log_archive_2023, sub_task_log_archive_2023, ... (同じDBファイル内、列は元のテーブルと同じ)
+# 週間ボード・トグル・分析 (直近の期間) は元のテーブルだけを読み、インデックスも小さいまま保つ
+# 期間が ARCHIVE_AFTER_DAYS より前にかかる読み取り (年間履歴・全履歴・エクスポート・ストリークの再計算など) は
+# log_table() が元のテーブルと該当する年のアーカイブを UNION ALL でつないで返す
+# アーカイブ済みの日付を更新する場合は、先に restore_archived() でその日のログを元のテーブルに戻す
+# ARCHIVE_AFTER_DAYS を増やす・0 (無効) に戻す場合は、先に flask unarchive-logs で全て戻すこと
+
+LOG_MODELS = (RoutineLog, SubTaskLog)
+# 1回の移動 (1トランザクション) で扱う行数
+COMPACT_BATCH = 5000
+# インポート時にアーカイブから削除するキーを1文で指定する件数 (SQLite の変数の数の上限より小さく)
+DISCARD_CHUNK = 5000
+
+
+def _owner_column(model):
+    return 'routine_id' if model is RoutineLog else 'subtask_id'
+
+
+def _columns(model):
+    return ['id', _owner_column(model), 'user_id', 'log_date', 'completed', 'updated_seq']
+
+
+def _prefix(model):
+    return f'{model.__tablename__}_archive_'
+
+
+# アーカイブの対象になる日付の境界 (これより前の日付を移す)。無効なら None
+def archive_horizon(today=None):
+    days = current_app.config['ARCHIVE_AFTER_DAYS']
+    if not days:
+        return None
+    return (today or date.today()) - timedelta(days=days)
+
+
+# year 年のアーカイブテーブル (テーブルの定義だけを返す。作成は _create_archive_table)
+# ID は元のテーブルの値をそのまま持つ (一意ではない)。(所有者, 日付) を主キーにする
+def archive_table(model, year):
+    name = f'{_prefix(model)}{year}'
+    table = db.metadata.tables.get(name)
+    if table is None:
+        owner = _owner_column(model)
+        table = Table(
+            name, db.metadata,
+            Column('id', Integer, nullable=False),
+            Column(owner, Integer, primary_key=True),
+            Column('user_id', Integer, nullable=False),
+            Column('log_date', Date, primary_key=True),
+            Column('completed', Boolean),
+            Column('updated_seq', Integer, nullable=False, default=0, server_default='0'),
+            # 全履歴・分析 (ユーザー横断の期間検索) と差分同期用
+            Index(f'ix_{name}_user_date_completed', 'user_id', 'log_date', 'completed'),
+            Index(f'ix_{name}_user_seq', 'user_id', 'updated_seq'),
+        )
+    return table
+
+
+def _create_archive_table(model, year):
+    table = archive_table(model, year)
+    table.create(db.session.connection(), checkfirst=True)
+    return table
+
+
+# DBに存在するアーカイブテーブルの年 (昇順)
+def archive_years(model):
+    prefix = _prefix(model)
+    names = db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, :length) = :prefix"),
+        {'length': len(prefix), 'prefix': prefix}
+    ).scalars()
+    return sorted(int(name[len(prefix):]) for name in names if name[len(prefix):].isdigit())
+
+
+# ログを読むためのテーブル (start〜end の期間を読む場合。省略すると全期間)
+# 期間がアーカイブの境界より後だけなら元のテーブルそのもの、そうでなければ元のテーブルと該当する年のアーカイブの UNION ALL
+# どちらも列は .c.<列名> で参照する (id, routine_id/subtask_id, user_id, log_date, completed, updated_seq)
+def log_table(model, start=None, end=None):
+    hot = model.__table__
+    horizon = archive_horizon()
+    if horizon is None or (start is not None and start >= horizon):
+        return hot
+    years = [
+        year for year in archive_years(model)
+        if (start is None or year >= start.year) and (end is None or year <= end.year)
+    ]
+    if not years:
+        return hot
+    columns = _columns(model)
+    parts = [select(*(hot.c[name] for name in columns))]
+    for year in years:
+        table = archive_table(model, year)
+        parts.append(select(*(table.c[name] for name in columns)))
+    return union_all(*parts).subquery(f'{model.__tablename__}_all')
+
+
+# source の condition に合う行を target に移す。戻り値: 移した行数
+# アーカイブから戻す場合は ID を振り直す (元のテーブルで同じ ID が使われている場合があるので)
+# prefix: 'OR REPLACE' / 'OR IGNORE' (移動先に同じ (所有者, 日付) の行がある場合)
+def _move(model, source, target, condition, keep_id, prefix=None):
+    columns = [name for name in _columns(model) if keep_id or name != 'id']
+    statement = insert(target).from_select(columns, select(*(source.c[name] for name in columns)).where(condition))
+    if prefix:
+        statement = statement.prefix_with(prefix)
+    db.session.execute(statement)
+    return db.session.execute(delete(source).where(condition)).rowcount
+
+
+def _year_range(column, year):
+    return and_(column >= date(year, 1, 1), column < date(year + 1, 1, 1))
+
+
+# 境界より前のログを after_id より後ろから batch_size 件だけアーカイブに移す (1トランザクション)
+# 戻り値: (移した行数, 最後に見た ID。これ以上なければ None)
+@write_transaction
+def _compact_batch(model, horizon, after_id, batch_size):
+    hot = model.__table__
+    rows = db.session.execute(
+        select(hot.c.id, hot.c.log_date).where(hot.c.id > after_id, hot.c.log_date < horizon).order_by(hot.c.id).limit(batch_size)
+    ).all()
+    if not rows:
+        db.session.rollback()
+        return 0, None
+    ids = [log_id for log_id, _ in rows]
+    moved = 0
+    for year in sorted({log_date.year for _, log_date in rows}):
+        table = _create_archive_table(model, year)
+        moved += _move(model, hot, table, and_(hot.c.id.in_(ids), _year_range(hot.c.log_date, year)), True, 'OR REPLACE')
+    db.session.commit()
+    return moved, ids[-1]
+
+
+# 境界より前のログをアーカイブに移す。1バッチごとにコミットするので、途中で止めても次の実行で続きから移せる
+# max_batches: 1回の実行で処理するバッチ数の上限 (None で全て)。pause: バッチの間に書き込みロックを譲る秒数
+# 戻り値: {テーブル名: 移した行数}
+def compact_logs(batch_size=COMPACT_BATCH, max_batches=None, pause=0, today=None):
+    horizon = archive_horizon(today)
+    moved = {model.__tablename__: 0 for model in LOG_MODELS}
+    if horizon is None:
+        return moved
+    batches = 0
+    for model in LOG_MODELS:
+        after_id = 0
+        while max_batches is None or batches < max_batches:
+            count, after_id = _compact_batch(model, horizon, after_id, batch_size)
+            if after_id is None:
+                break
+            moved[model.__tablename__] += count
+            batches += 1
+            if pause:
+                time.sleep(pause)
+    return moved
+
+
+# 更新する (ルーチン, 日付) のログがアーカイブにあれば、そのルーチンとサブタスクの同じ日のログを元のテーブルに戻す
+# トグルの前に同じトランザクション内で呼ぶ (直近の日付だけなら何もしない)。戻り値: 戻した行数
+def restore_archived(routine_days):
+    horizon = archive_horizon()
+    if horizon is None:
+        return 0
+    pairs = {(routine_id, log_date) for routine_id, log_date in routine_days if log_date < horizon}
+    if not pairs:
+        return 0
+    routine_ids = {routine_id for routine_id, _ in pairs}
+    dates = {log_date for _, log_date in pairs}
+    restored = 0
+    for model in LOG_MODELS:
+        for year in set(archive_years(model)) & {d.year for d in dates}:
+            table = archive_table(model, year)
+            if model is RoutineLog:
+                owner = table.c.routine_id.in_(routine_ids)
+            else:
+                owner = table.c.subtask_id.in_(select(SubTask.id).where(SubTask.routine_id.in_(routine_ids)))
+            condition = and_(owner, table.c.log_date.in_({d for d in dates if d.year == year}))
+            restored += _move(model, table, model.__table__, condition, False)
+    return restored
+
+
+# 削除するルーチン (とそのサブタスク)・サブタスクのアーカイブ済みログを削除する (元のテーブルの行は ORM のカスケードで消える)
+# ORM の削除より前に呼ぶ (ルーチンのサブタスクを SubTask から探すので)
+def delete_archived(routine_id=None, subtask_id=None):
+    if archive_horizon() is None:
+        return
+    if routine_id is not None:
+        for year in archive_years(RoutineLog):
+            table = archive_table(RoutineLog, year)
+            db.session.execute(delete(table).where(table.c.routine_id == routine_id))
+        subtask_ids = select(SubTask.id).where(SubTask.routine_id == routine_id)
+    else:
+        subtask_ids = [subtask_id]
+    for year in archive_years(SubTaskLog):
+        table = archive_table(SubTaskLog, year)
+        db.session.execute(delete(table).where(table.c.subtask_id.in_(subtask_ids)))
+
+
+# インポートで元のテーブルに書き込む (所有者, 日付) のログがアーカイブにあれば削除する (同じ日のログを二重に持たない)
+def discard_archived(model, keys):
+    if archive_horizon() is None:
+        return
+    keys = list(keys)
+    for year in archive_years(model):
+        table = archive_table(model, year)
+        in_year = [key for key in keys if key[1].year == year]
+        for start in range(0, len(in_year), DISCARD_CHUNK):
+            db.session.execute(delete(table).where(
+                tuple_(table.c[_owner_column(model)], table.c.log_date).in_(in_year[start:start + DISCARD_CHUNK])
+            ))
+
+
+# 全てのアーカイブを元のテーブルに戻し、アーカイブテーブルを削除する (コミットは呼び出し側で行う)
+# 戻り値: {テーブル名: 戻した行数}
+def unarchive_logs():
+    restored = {}
+    for model in LOG_MODELS:
+        restored[model.__tablename__] = 0
+        for year in archive_years(model):
+            table = archive_table(model, year)
+            # 元のテーブルに同じ日のログがあればそちらを残す
+            restored[model.__tablename__] += _move(model, table, model.__table__, true(), False, 'OR IGNORE')
+            table.drop(db.session.connection())
+            db.metadata.remove(table)
+    return restored
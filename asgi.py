@@ -0,0 +1,202 @@
+import asyncio
+import io
+import json
+import time
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from werkzeug.exceptions import ClientDisconnected
+from app import app
+from events import KEEPALIVE, event_notifier, read_event_chunks, resume_position, start_position
+from users import resolve_request_user
+
+# ASGI モード (uvicorn 用のエントリーポイント)
+# 使い方: uvicorn asgi:application --host 0.0.0.0 --port 5001
+# 各APIは既存の Flask アプリを a2wsgi (WSGIMiddleware) でそのまま動かし、スレッドプールを2つに分ける
+#   - 更新系 (GET/HEAD/OPTIONS 以外) は書き込みスレッド1本のプールに順に並べる (プロセス内の書き込みを直列化し、
+#     SQLite のロック待ち・再試行をなくす。ワーカープロセスが複数あれば、ワーカー間は従来どおり write_transaction の再試行で調停する)
+#   - 読み取りは ASGI_READ_THREADS 本のスレッドで並行に処理する
+#   - 変更フィード (/api/events) だけはイベントループ上で待ち、接続中にスレッドを占有しない
+# クエリは同期の SQLAlchemy のまま (非同期エンジン・aiosqlite には書き換えていない)
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Flask のスレッドが先に積んでおけるレスポンスのメッセージ数 (超えるとイベントループ側が送るまで待つ)
+RESPONSE_QUEUE_SIZE = 8
+
+
+# a2wsgi の wsgi.input (Body) を包む生ストリーム
+# Body は Content-Length を確かめずに受け取った分で終わるので、宣言より短く終わった本文は ClientDisconnected にする
+# (途中で切れたインポートの残りを正常な終わりとして書き込まない)
+class RequestBody(io.RawIOBase):
+    def __init__(self, body, content_length):
+        self._body = body
+        self._remaining = int(content_length) if content_length else None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer) if self._remaining is None else min(len(buffer), self._remaining)
+        data = self._body.read(size) if size else b''
+        if self._remaining is not None:
+            if size and not data:
+                raise ClientDisconnected()
+            self._remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+# Flask には上のストリームをバッファつきで渡す (終わりはこちらで判定するので wsgi.input_terminated を立てる)
+# Werkzeug の LimitedStream を通すと、インポートの行の読み取りが1バイトずつになるため
+def buffered_input(flask_app):
+    def wsgi(environ, start_response):
+        environ['wsgi.input'] = io.BufferedReader(RequestBody(environ['wsgi.input'], environ.get('CONTENT_LENGTH')))
+        environ['wsgi.input_terminated'] = True
+        return flask_app(environ, start_response)
+    return wsgi
+
+
+# 本文の受信中にクライアントが切断したら、本文の終わりではなく ClientDisconnected にする
+# (Flask のスレッドの読み取りで送出され、400 として処理が打ち切られる。Content-Length の無い本文も同じ)
+def receive_body(receive):
+    async def wrapped():
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        return message
+    return wrapped
+
+
+# 送信に失敗したあとのメッセージは捨てる (a2wsgi は Flask のスレッドの終了を待ってから送信側の失敗を見るので、
+# キューが詰まったままスレッドが止まらないようにする)。最初の失敗はアプリの処理が終わってから送出する
+class SendGuard:
+    def __init__(self, send):
+        self._send = send
+        self.error = None
+
+    async def __call__(self, message):
+        if self.error is None:
+            try:
+                await self._send(message)
+            except BaseException as error:
+                self.error = error
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.decode('latin1').lower() == name:
+            return value.decode('latin1')
+    return None
+
+
+async def _send_json(send, status, data):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+
+class AsyncApplication:
+    def __init__(self, flask_app, read_threads=None):
+        self.flask_app = flask_app
+        # 変更フィードはイベントループ上で待つので、画面にも接続してよいことを知らせる
+        flask_app.config['EVENT_STREAM'] = True
+        read_threads = read_threads or flask_app.config['ASGI_READ_THREADS']
+        wsgi = buffered_input(flask_app)
+        self.readers = WSGIMiddleware(wsgi, workers=read_threads, send_queue_size=RESPONSE_QUEUE_SIZE)
+        self.writer = WSGIMiddleware(wsgi, workers=1, send_queue_size=RESPONSE_QUEUE_SIZE)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] != 'http':
+            return
+        elif scope['path'] == '/api/events' and scope['method'] == 'GET':
+            await self._stream_events(scope, receive, send)
+        else:
+            guard = SendGuard(send)
+            await self.executor_for(scope)(scope, receive_body(receive), guard)
+            if guard.error is not None:
+                raise guard.error
+
+    def executor_for(self, scope):
+        return self.readers if scope['method'] in READ_METHODS else self.writer
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.readers.executor.shutdown(wait=False)
+                self.writer.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _in_context(self, func, *args):
+        with self.flask_app.app_context():
+            return func(*args)
+
+    # リクエストのユーザー (Flask のリクエストと同じくトークンかセッション Cookie で決める)
+    def _request_user(self, scope):
+        with self.flask_app.request_context(build_environ(scope, io.BytesIO())):
+            return resolve_request_user()
+
+    # /api/events の非同期版 (レスポンスの形式は app.py の stream_events と同じ)
+    async def _stream_events(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        config = self.flask_app.config
+        after = parse_qs(scope['query_string'].decode('latin1')).get('after', [None])[0]
+        user_id = await loop.run_in_executor(self.readers.executor, self._request_user, scope)
+        if user_id is None:
+            await _send_json(send, 401, {'error': 'Authentication required'})
+            return
+        try:
+            last_id = await loop.run_in_executor(self.readers.executor, self._in_context, resume_position, _header(scope, 'last-event-id') or after)
+        except ValueError:
+            await _send_json(send, 400, {'error': 'Invalid event id'})
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        # クライアントの切断を検知したらストリームを終える
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+        watcher = loop.create_task(watch_disconnect())
+
+        async def send_chunks(chunks):
+            for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+        try:
+            deadline = time.monotonic() + config['EVENT_STREAM_TIMEOUT']
+            last_sent = time.monotonic()
+            last_id, chunks = await loop.run_in_executor(self.readers.executor, self._in_context, start_position, last_id, config['EVENT_RETRY_MS'])
+            await send_chunks(chunks)
+            while not disconnected.is_set():
+                generation = event_notifier.generation
+                last_id, chunks, more = await loop.run_in_executor(self.readers.executor, self._in_context, read_event_chunks, last_id, user_id)
+                await send_chunks(chunks)
+                if chunks:
+                    last_sent = time.monotonic()
+                    if more:
+                        continue
+
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if now - last_sent >= config['EVENT_HEARTBEAT_SECONDS']:
+                    await send_chunks([KEEPALIVE])
+                    last_sent = now
+                await event_notifier.wait_async(generation, min(config['EVENT_POLL_SECONDS'], deadline - now))
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+
+
+application = AsyncApplication(app)
@@ -0,0 +1,261 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 静的ファイル (script.js / style.css) のビルドと配信
+# flask --app app build-assets で、縮小・フィンガープリント (内容のハッシュをファイル名に付ける)・事前圧縮したファイルを
+# ASSET_DIR (既定は static/dist) に書き出す。外部のツール・ネットワークは使わない (brotli モジュールがあれば .br も作る)
+#   style.3f2a1c9b04d1.css, style.3f2a1c9b04d1.css.gz, (style.3f2a1c9b04d1.css.br), manifest.json
+# 画面は asset_url() でマニフェストのURL (/assets/<名前>) を使う。ビルドしていなければ従来どおり /static/ から読む
+# /assets/ は内容が変わればURLも変わるので、1年間・immutable でキャッシュさせ、Accept-Encoding に応じて .br / .gz を返す
+
+ASSETS = ('script.js', 'style.css')
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+# (Content-Encoding, 拡張子) 優先順
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# 前後の空白を省いてよい記号 (JS は + と - を除く: a + +b が a++b にならないように)
+JS_TIGHT = set('{}()[];,:=<>*/&|!?.%^~')
+CSS_TIGHT = set('{};,')
+# 直後の改行を省いてよい記号 (文が続くので、) ] } や正規表現の末尾の / の後ろの改行は残す)
+JS_NEWLINE_TIGHT = set('{([;,=:&|!?<>*%^~.')
+# 直前の文字がこれらなら / は除算ではなく正規表現リテラルの始まり
+REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+# 直前の単語がこれらのキーワードの場合も正規表現 (return /a/.test(s) など。obj.return のようなプロパティ名は除く)
+REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new', 'delete', 'void', 'throw', 'yield', 'await', 'of'}
+# ビルドが書き出したファイルの名前 (script.<ハッシュ>.js と、その .gz / .br)
+BUILT_FILE = re.compile(r'[\w-]+\.[0-9a-f]{%d}\.(js|css)(\.gz|\.br)?' % HASH_LENGTH)
+
+
+def _read_quoted(text, i):
+    quote = text[i]
+    j = i + 1
+    while j < len(text) and text[j] != quote:
+        j += 2 if text[j] == '\\' else 1
+    return j + 1
+
+
+def _is_word_char(c):
+    return c.isalnum() or c in '_$'
+
+
+# out (出力済みのトークン) の末尾の単語がキーワードとして / の前にあるか
+# 識別子は1文字ずつ出力しているので、末尾から単語の文字を集める
+def _after_regex_keyword(out):
+    i = len(out)
+    while i > 0 and len(out[i - 1]) == 1 and _is_word_char(out[i - 1]):
+        i -= 1
+    word = ''.join(out[i:])
+    return word in REGEX_KEYWORDS and not (i > 0 and out[i - 1][-1] == '.')
+
+
+def _read_regex(text, i):
+    j = i + 1
+    in_class = False
+    while j < len(text):
+        c = text[j]
+        if c == '\\':
+            j += 2
+            continue
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            break
+        j += 1
+    j += 1
+    while j < len(text) and text[j].isalpha():
+        j += 1
+    return j
+
+
+# 文字列・テンプレートリテラル・正規表現はそのまま残し、コメントと余分な空白だけを取り除く
+# JS の改行は (セミコロンの自動挿入があるので) 空白にせず残し、記号の後ろでだけ省く
+def minify(text, kind):
+    tight = JS_TIGHT if kind == 'js' else CSS_TIGHT
+    out = []
+    pending = ''
+    # テンプレートリテラルの ${...} ごとの { の深さ
+    templates = []
+    i = 0
+    n = len(text)
+
+    def last():
+        return out[-1][-1] if out else ''
+
+    def emit(token):
+        nonlocal pending
+        if pending and out:
+            prev = last()
+            if pending == '\n':
+                if prev not in JS_NEWLINE_TIGHT:
+                    out.append('\n')
+            elif prev not in tight and token[0] not in tight and not (kind == 'css' and prev == ':'):
+                out.append(' ')
+        pending = ''
+        out.append(token)
+
+    def read_template(start):
+        # start はバッククォートの次の文字か、${...} を閉じた } の次の文字
+        j = start
+        while j < n:
+            if text[j] == '\\':
+                j += 2
+            elif text[j] == '`':
+                return j + 1, False
+            elif text.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        return n, False
+
+    while i < n:
+        c = text[i]
+        if c in ' \t\r\n':
+            j = i
+            while j < n and text[j] in ' \t\r\n':
+                j += 1
+            if kind == 'js' and '\n' in text[i:j]:
+                pending = '\n'
+            elif not pending:
+                pending = ' '
+            i = j
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            pending = pending or ' '
+        elif kind == 'js' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif c in '\'"':
+            j = _read_quoted(text, i)
+            emit(text[i:j])
+            i = j
+        elif kind == 'js' and c == '`':
+            j, opened = read_template(i + 1)
+            emit(text[i:j])
+            if opened:
+                templates.append(0)
+            i = j
+        elif kind == 'js' and c == '}' and templates and templates[-1] == 0:
+            templates.pop()
+            j, opened = read_template(i + 1)
+            pending = ''
+            out.append(text[i:j])
+            if opened:
+                templates.append(0)
+            i = j
+        elif kind == 'js' and c == '/' and (not out or last() in REGEX_PREFIX or _after_regex_keyword(out)):
+            j = _read_regex(text, i)
+            emit(text[i:j])
+            i = j
+        else:
+            if kind == 'js' and templates:
+                if c == '{':
+                    templates[-1] += 1
+                elif c == '}':
+                    templates[-1] -= 1
+            emit(c)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def _fingerprinted(name, content):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+# 以前のビルドのファイル (前のマニフェストにあるものと、その圧縮版) を消す
+# output_dir は環境変数で変えられるので、ビルドが書き出した名前のファイル以外は消さない
+def _remove_previous_build(output_dir):
+    for output in load_manifest(output_dir).values():
+        for ext in ('',) + tuple(ext for _, ext in ENCODINGS):
+            name = output + ext
+            path = os.path.join(output_dir, name)
+            if BUILT_FILE.fullmatch(name) and os.path.isfile(path):
+                os.remove(path)
+
+
+# source_dir の ASSETS を縮小・フィンガープリントして output_dir に書き出す。戻り値: マニフェスト ({元の名前: 出力の名前})
+# 以前のビルドのファイルは消す (マニフェストに無いファイルは配信しない)
+def build_assets(source_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    _remove_previous_build(output_dir)
+
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            content = minify(f.read(), 'js' if name.endswith('.js') else 'css').encode('utf-8')
+        output = _fingerprinted(name, content)
+        path = os.path.join(output_dir, output)
+        _write(path, content)
+        # mtime=0: 同じ内容なら同じ .gz になる
+        _write(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(content, quality=11))
+        manifest[name] = output
+    with open(os.path.join(output_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# テンプレートで使うURL (ビルド済みなら /assets/<フィンガープリント付きの名前>)
+def asset_url(name):
+    output = current_app.extensions['assets'].get(name)
+    if output is None:
+        return url_for('static', filename=name)
+    return url_for('main.asset', filename=output)
+
+
+# ビルド済みのファイルを返す (クライアントが受け付ける圧縮形式があればそのファイルを返す)
+def send_asset(filename):
+    output_dir = current_app.config['ASSET_DIR']
+    if filename not in current_app.extensions['assets'].values():
+        abort(404)
+    path = safe_join(output_dir, filename)
+    encoding = None
+    for name, ext in ENCODINGS:
+        if request.accept_encodings[name] and os.path.exists(path + ext):
+            encoding, path = name, path + ext
+            break
+    response = send_file(path, mimetype=None if encoding is None else _mimetype(filename), conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+
+def _mimetype(filename):
+    return 'text/javascript' if filename.endswith('.js') else 'text/css'
+
+
+# BUILT_ASSETS が有効ならマニフェストを1回だけ読み込む (ビルドし直したらワーカーを再起動する)
+def init_assets(app):
+    app.extensions['assets'] = load_manifest(app.config['ASSET_DIR']) if app.config['BUILT_ASSETS'] else {}
+    app.jinja_env.globals['asset_url'] = asset_url
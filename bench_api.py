@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+from cache import response_cache
+import negotiation
+from models import db, Routine, SubTask
+from dataset import add_dataset_arguments, dataset_options, generate_dataset
+
+# API のベンチマーク
+# Flask のテストクライアントでプロセス内から各APIを呼び、レイテンシのパーセンタイル・
+# スループット・1リクエストあたりのSQL件数を JSON で出力する
+# --baseline で以前の結果と比較し、p50 が --max-regression 倍を超えたら終了コード1
+# 使い方: python bench_api.py --routines 50 --years 2 --iterations 50 --output result.json
+# レスポンスキャッシュは既定で無効にして測る (--with-cache で有効)
+# payloads には GET の各シナリオのレスポンスについて、形式・圧縮ごとのサイズとシリアライズ・圧縮の時間を出力する
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _summary(latencies_ms, statement_counts, elapsed):
+    values = sorted(latencies_ms)
+    return {
+        'iterations': len(values),
+        'p50_ms': round(percentile(values, 0.5), 3),
+        'p90_ms': round(percentile(values, 0.9), 3),
+        'p99_ms': round(percentile(values, 0.99), 3),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'max_ms': round(values[-1], 3),
+        'throughput_per_sec': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'statements_per_request': round(sum(statement_counts) / len(statement_counts), 2),
+        'max_statements': max(statement_counts)
+    }
+
+
+# シナリオ: (名前, メソッド, URL, Body) のリストを返す関数
+# 単体トグルは同じ操作を2回ずつ行い、計測後にデータが元に戻るようにする
+def build_scenarios(app, iterations, seed=0):
+    rng = random.Random(seed)
+    with app.app_context():
+        parent_ids = {rid for (rid,) in db.session.query(SubTask.routine_id).distinct()}
+        plain_ids = [rid for (rid,) in db.session.query(Routine.id).order_by(Routine.id) if rid not in parent_ids]
+        subtask_ids = [sid for (sid,) in db.session.query(SubTask.id).order_by(SubTask.id)]
+        routine_id = plain_ids[0] if plain_ids else None
+
+    today = date.today()
+    month_start = today.replace(day=1)
+
+    def recent_date():
+        return (today - timedelta(days=rng.randint(0, 60))).isoformat()
+
+    def paired(requests):
+        return [r for request in requests for r in (request, request)]
+
+    scenarios = {}
+    for offset in (0, -1, -4, -52):
+        scenarios[f'GET /api/routines?offset={offset}'] = [('GET', f'/api/routines?offset={offset}', None)] * iterations
+    # 期間指定のボード (5週間分のビット列を1リクエストで)
+    scenarios['GET /api/routines?weeks=5&offset=-4'] = [('GET', '/api/routines?weeks=5&offset=-4', None)] * iterations
+    if plain_ids:
+        scenarios['POST /api/routines/<id>/toggle'] = paired([
+            ('POST', f'/api/routines/{rng.choice(plain_ids)}/toggle', {'date': recent_date()})
+            for _ in range(iterations // 2 or 1)
+        ])
+        # 一括トグルは1ルーチンの直近1週間を完了・未完了に交互に設定する (毎回状態が変わる)
+        batch_id = rng.choice(plain_ids)
+        scenarios['POST /api/toggles/batch (7 days)'] = [
+            ('POST', '/api/toggles/batch', {'operations': [
+                {'kind': 'routine', 'id': batch_id, 'date': (today - timedelta(days=i)).isoformat(), 'completed': done}
+                for i in range(7)
+            ]})
+            for done in (True, False)
+        ] * (iterations // 2 or 1)
+    if subtask_ids:
+        scenarios['POST /api/subtasks/<id>/toggle'] = paired([
+            ('POST', f'/api/subtasks/{rng.choice(subtask_ids)}/toggle', {'date': recent_date()})
+            for _ in range(iterations // 2 or 1)
+        ])
+    scenarios['GET /api/history/all'] = [('GET', '/api/history/all', None)] * iterations
+    scenarios['GET /api/history/all?from&to (month)'] = [
+        ('GET', f'/api/history/all?from={month_start.isoformat()}&to={today.isoformat()}', None)
+    ] * iterations
+    scenarios['GET /api/history/all?limit=100'] = [('GET', '/api/history/all?limit=100', None)] * iterations
+    scenarios['GET /api/analytics/overall'] = [('GET', '/api/analytics/overall', None)] * iterations
+    if routine_id is not None:
+        scenarios['GET /api/analytics/routine/<id>'] = [('GET', f'/api/analytics/routine/{routine_id}', None)] * iterations
+    return scenarios
+
+
+# headers: 全リクエストに付けるヘッダ (複数ユーザーモードの Authorization など)
+def run_scenario(app, client, requests, warmup=3, headers=None):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+    listener = lambda *args: statements.append(1)
+
+    for method, url, body in requests[:warmup]:
+        client.open(url, method=method, json=body, headers=headers).get_data()
+
+    latencies = []
+    counts = []
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        started = time.perf_counter()
+        for method, url, body in requests:
+            statements.clear()
+            t0 = time.perf_counter()
+            # ストリーミングのレスポンスも本文を読み切るまでを測る
+            response = client.open(url, method=method, json=body, headers=headers)
+            response.get_data()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            counts.append(len(statements))
+            if response.status_code != 200:
+                raise RuntimeError(f'{method} {url} returned {response.status_code}')
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    # ウォームアップのトグルも元に戻す
+    for method, url, body in requests[:warmup]:
+        if method == 'POST':
+            client.open(url, method=method, json=body, headers=headers).get_data()
+    return _summary(latencies, counts, elapsed)
+
+
+def run_benchmarks(app, iterations=50, warmup=3, seed=0, with_cache=False):
+    client = app.test_client()
+    cache_size = response_cache.max_entries
+    if not with_cache:
+        response_cache.max_entries = 0
+    try:
+        return {
+            name: run_scenario(app, client, requests, warmup)
+            for name, requests in build_scenarios(app, iterations, seed).items()
+        }
+    finally:
+        response_cache.max_entries = cache_size
+
+
+def _time_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return round((time.perf_counter() - started) * 1000 / repeat, 3), result
+
+
+# GET シナリオのレスポンス1件を、標準の json・アプリの JSON プロバイダ (orjson)・MessagePack でシリアライズし直し、
+# gzip / zstd で圧縮したときのサイズと時間 (1回あたりのミリ秒) を測る。使えないモジュールの形式は省く
+def measure_payloads(app, repeat=20, seed=0):
+    client = app.test_client()
+    report = {}
+    for name, requests in build_scenarios(app, 1, seed).items():
+        method, url, _ = requests[0]
+        if method != 'GET':
+            continue
+        data = client.get(url).get_json()
+        entry = {}
+        with app.app_context():
+            stdlib_ms, _ = _time_ms(lambda: json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8'), repeat)
+            provider_ms, body = _time_ms(lambda: app.json.dumps(data).encode('utf-8'), repeat)
+        entry['json'] = {'bytes': len(body), 'stdlib_ms': stdlib_ms, 'provider_ms': provider_ms}
+        for encoding in negotiation.available_encodings():
+            encode_ms, compressed = _time_ms(lambda: negotiation.compress(body, encoding), repeat)
+            entry[f'json+{encoding}'] = {'bytes': len(compressed), 'encode_ms': encode_ms}
+        if negotiation.msgpack is not None:
+            encode_ms, packed = _time_ms(lambda: negotiation.msgpack.packb(data), repeat)
+            entry['msgpack'] = {'bytes': len(packed), 'encode_ms': encode_ms}
+        report[name] = entry
+    return report
+
+
+# 基準の結果と比べて、p50 が max_regression 倍を超えたシナリオを返す
+def compare_results(current, baseline, max_regression=1.2):
+    rows = []
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        row = {
+            'scenario': name,
+            'p50_ms': result['p50_ms'],
+            'baseline_p50_ms': base['p50_ms'],
+            'ratio': round(ratio, 2),
+            'statements': result['statements_per_request'],
+            'baseline_statements': base['statements_per_request']
+        }
+        rows.append(row)
+        if ratio > max_regression or result['statements_per_request'] > base['statements_per_request']:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API in-process with a synthetic dataset')
+    parser.add_argument('--db', help='existing SQLite file to benchmark (default: generate a temporary one)')
+    add_dataset_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--with-cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--baseline', help='JSON result of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=1.2)
+    args = parser.parse_args()
+
+    tmp = None
+    database_path = args.db
+    if database_path is None:
+        tmp = tempfile.TemporaryDirectory()
+        database_path = os.path.join(tmp.name, 'bench.db')
+
+    from app import create_app
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(database_path), 'INIT_DB_ON_STARTUP': True})
+
+    dataset = None
+    with app.app_context():
+        if args.db is None:
+            started = time.perf_counter()
+            dataset = generate_dataset(**dataset_options(args))
+            db.session.commit()
+            dataset['generate_seconds'] = round(time.perf_counter() - started, 2)
+        else:
+            dataset = {'db': args.db, 'routines': Routine.query.count()}
+
+    result = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'response_cache': args.with_cache,
+            'sqlite_profile': app.config['SQLITE_PROFILE'],
+            'json_provider': type(app.json).__name__,
+            'dataset': dict(dataset, **({} if args.db else dataset_options(args)))
+        },
+        'results': run_benchmarks(app, args.iterations, args.warmup, args.seed, args.with_cache),
+        'payloads': measure_payloads(app, seed=args.seed)
+    }
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if tmp is not None:
+        tmp.cleanup()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare_results(result, baseline, args.max_regression)
+        for row in rows:
+            print(f"{row['scenario']:45} p50 {row['baseline_p50_ms']:>9} -> {row['p50_ms']:>9} ms (x{row['ratio']}), "
+                  f"statements {row['baseline_statements']} -> {row['statements']}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} scenario(s) regressed", file=sys.stderr)
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from bench_api import percentile
+from dataset import add_dataset_arguments, dataset_options, generate_dataset
+
+# 同時リクエストのベンチマーク (gunicorn の同期ワーカー と uvicorn の ASGI モードの比較)
+# 合成データの一時DBを作り、それぞれのサーバーを別プロセスで起動して、
+# 複数の接続から「ボードの読み込み」と「トグル」を同時に送り、レイテンシのパーセンタイルとスループットを JSON で出力する
+# --sse-clients で変更フィード (/api/events) に接続したままのクライアントを加えられる
+# (同期ワーカーでは EVENT_STREAM が無効なので 404 になる。EVENT_STREAM=1 で起動すると1接続が1ワーカーを占有し、その分だけ処理できる数が減る)
+# 使い方: python bench_concurrency.py --clients 32 --seconds 10 --workers 4 --sse-clients 2
+
+SERVERS = {
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--worker-class', 'sync'
+    ],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers), '--log-level', 'warning'
+    ]
+}
+
+
+def _request(connection, method, url, body=None):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def _wait_ready(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            if _request(connection, 'GET', '/api/routines?offset=0') == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def start_server(kind, database_path, port, workers):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database_path)
+    process = subprocess.Popen(
+        SERVERS[kind](port, workers), env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_ready(port, process)
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+# 変更フィードに接続したまま読み続けるクライアント (stop が立つか接続が切れるまで)
+def _sse_client(port, stop, opened):
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        connection.request('GET', '/api/events')
+        response = connection.getresponse()
+        opened.append(response.status)
+        while not stop.is_set():
+            try:
+                if not response.fp.readline():
+                    break
+            except OSError:
+                continue
+        connection.close()
+    except OSError:
+        opened.append(None)
+
+
+def run_load(port, routine_ids, clients, seconds, write_ratio, seed=0):
+    results = {'read': [], 'write': []}
+    errors = []
+    lock = threading.Lock()
+    start_at = time.monotonic() + 0.5
+    today = date.today()
+
+    def run(index):
+        rng = random.Random(seed * 1000 + index)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies = {'read': [], 'write': []}
+        failed = 0
+        while time.monotonic() < start_at:
+            time.sleep(0.001)
+        deadline = start_at + seconds
+        while time.monotonic() < deadline:
+            if rng.random() < write_ratio:
+                kind = 'write'
+                day = (today - timedelta(days=rng.randint(0, 30))).isoformat()
+                request = ('POST', f'/api/routines/{rng.choice(routine_ids)}/toggle', {'date': day})
+            else:
+                kind = 'read'
+                request = ('GET', f'/api/routines?offset={-rng.randint(0, 3)}', None)
+            t0 = time.perf_counter()
+            try:
+                status = _request(connection, *request)
+            except OSError:
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = None
+            if status == 200:
+                latencies[kind].append((time.perf_counter() - t0) * 1000)
+            else:
+                failed += 1
+        connection.close()
+        with lock:
+            for kind in latencies:
+                results[kind] += latencies[kind]
+            errors.append(failed)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = {'requests_failed': sum(errors)}
+    for kind, values in results.items():
+        values.sort()
+        summary[kind] = {
+            'requests': len(values),
+            'p50_ms': round(percentile(values, 0.5), 3),
+            'p90_ms': round(percentile(values, 0.9), 3),
+            'p99_ms': round(percentile(values, 0.99), 3),
+            'throughput_per_sec': round(len(values) / seconds, 1)
+        }
+    summary['throughput_per_sec'] = round(sum(len(v) for v in results.values()) / seconds, 1)
+    return summary
+
+
+def run_server_benchmark(kind, database_path, port, workers, routine_ids, args):
+    process = start_server(kind, database_path, port, workers)
+    stop = threading.Event()
+    opened = []
+    sse_threads = [threading.Thread(target=_sse_client, args=(port, stop, opened)) for _ in range(args.sse_clients)]
+    try:
+        for thread in sse_threads:
+            thread.start()
+        result = run_load(port, routine_ids, args.clients, args.seconds, args.write_ratio, args.seed)
+        result['sse_clients_connected'] = sum(1 for status in opened if status == 200)
+        return result
+    finally:
+        stop.set()
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for thread in sse_threads:
+            thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare concurrent-request latency of gunicorn (sync) and uvicorn (ASGI)')
+    add_dataset_arguments(parser)
+    parser.add_argument('--servers', default='gunicorn,uvicorn')
+    parser.add_argument('--workers', type=int, default=2, help='processes per server')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP connections')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='share of requests that are toggles')
+    parser.add_argument('--sse-clients', type=int, default=0, help='idle /api/events connections kept open')
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--output', help='write the JSON result to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, 'bench.db')
+        from app import create_app
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database_path, 'INIT_DB_ON_STARTUP': True})
+        from models import db, Routine, SubTask
+        with app.app_context():
+            dataset = generate_dataset(**dataset_options(args))
+            db.session.commit()
+            parent_ids = {rid for (rid,) in db.session.query(SubTask.routine_id).distinct()}
+            routine_ids = [rid for (rid,) in db.session.query(Routine.id) if rid not in parent_ids]
+            db.engine.dispose()
+
+        result = {
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'workers': args.workers,
+                'clients': args.clients,
+                'seconds': args.seconds,
+                'write_ratio': args.write_ratio,
+                'sse_clients': args.sse_clients,
+                'dataset': dict(dataset, **dataset_options(args))
+            },
+            'results': {
+                kind: run_server_benchmark(kind, database_path, args.port + i, args.workers, routine_ids, args)
+                for i, kind in enumerate(args.servers.split(','))
+            }
+        }
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+# 起動時間の計測
+# 1. 新しいプロセスでの各段階 (コールドスタート): app モジュールの import (create_app を含む)、
+#    create_app の単体、init_database (空のDB / 準備済みのDB)。以前は準備済みDBへの init_database 相当を全ワーカーが起動時に行っていた
+# 2. gunicorn (gunicorn.conf.py) の preload 有り・無しで、起動から最初の応答までの時間と、
+#    ワーカー1つの起動時間 (fork から post_worker_init まで) を比較する
+# 使い方: python bench_startup.py --repeat 5 --workers 4
+# このスクリプトは計測対象に含まれないよう、標準ライブラリだけを読み込む
+
+BOOT_LINE = re.compile(r'Worker (\d+) booted in ([\d.]+) ms')
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+# 子プロセスで実行する計測 (import 前の状態から測る)
+def probe(database_path):
+    started = time.perf_counter()
+    import app as app_module
+    result = {'import_ms': _ms(started)}
+
+    started = time.perf_counter()
+    app = app_module.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database_path})
+    result['create_app_ms'] = _ms(started)
+
+    with app.app_context():
+        started = time.perf_counter()
+        app_module.init_database()
+        result['init_db_fresh_ms'] = _ms(started)
+        app_module.db.session.remove()
+        started = time.perf_counter()
+        app_module.init_database()
+        result['init_db_noop_ms'] = _ms(started)
+    print(json.dumps(result))
+
+
+def run_probes(repeat):
+    samples = []
+    for index in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_path = os.path.join(tmp, 'startup.db')
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--probe', database_path],
+                check=True, capture_output=True, text=True, env=dict(os.environ, DATABASE_URL='sqlite:///' + database_path),
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            sample = json.loads(output.strip().splitlines()[-1])
+            sample['process_ms'] = _ms(started)
+            samples.append(sample)
+    return {key: round(statistics.median(s[key] for s in samples), 2) for key in samples[0]}
+
+
+def run_gunicorn(database_path, port, workers, preload, timeout=60):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database_path, PRELOAD_APP='1' if preload else '0')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'info'],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        first_response_ms = None
+        deadline = time.monotonic() + timeout
+        while first_response_ms is None and time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/routines?offset=0', timeout=2) as response:
+                    if response.status == 200:
+                        first_response_ms = _ms(started)
+            except OSError:
+                time.sleep(0.02)
+        # 全ワーカーの起動ログが出るまで待つ
+        time.sleep(1)
+    finally:
+        process.terminate()
+        log = process.communicate(timeout=15)[1]
+    boots = [float(ms) for _, ms in BOOT_LINE.findall(log)]
+    return {
+        'preload': preload,
+        'workers': workers,
+        'first_response_ms': first_response_ms,
+        'worker_boot_ms': {
+            'count': len(boots),
+            'median': round(statistics.median(boots), 2) if boots else None,
+            'max': round(max(boots), 2) if boots else None
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start and per-worker boot cost')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5201)
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--probe', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        probe(args.probe)
+        return
+
+    result = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat
+        },
+        'cold_start': run_probes(args.repeat)
+    }
+    if not args.skip_gunicorn:
+        with tempfile.TemporaryDirectory() as tmp:
+            database_path = os.path.join(tmp, 'startup.db')
+            # サーバーはスキーマを作らないので、先に準備する (flask upgrade-db と同じ)
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'upgrade-db'], check=True, capture_output=True,
+                           env=dict(os.environ, DATABASE_URL='sqlite:///' + database_path),
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            result['gunicorn'] = [
+                run_gunicorn(database_path, args.port + index, args.workers, preload)
+                for index, preload in enumerate((False, True))
+            ]
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from bench_api import run_scenario
+from cache import response_cache
+from dataset import generate_dataset
+from models import db, Routine, RoutineLog, SubTaskLog
+from users import issue_token
+
+# ユーザー数に対する負荷試験 (複数ユーザーモード)
+# 1つのDBにユーザーを段階的に追加し (各ユーザーに同じ規模の合成データ)、各段階で数人のユーザーとして
+# ボード・分析・履歴のAPIを呼び、レイテンシと1リクエストあたりのSQL件数を JSON で出力する
+# ユーザー単位のインデックスで読むので、ユーザー数・総行数が増えても1ユーザーあたりのコストは変わらないはず
+# 最初の段階に対する p50 の比が --max-growth を超えたら終了コード1
+# 使い方: python bench_users.py --steps 1,10,100,1000 --routines 5 --years 1 --iterations 30
+
+SCENARIOS = [
+    ('GET /api/routines?offset=0', '/api/routines?offset=0'),
+    ('GET /api/routines?offset=-4', '/api/routines?offset=-4'),
+    ('GET /api/analytics/overall', '/api/analytics/overall'),
+    ('GET /api/analytics/routine/<id>', '/api/analytics/routine/{routine_id}'),
+    ('GET /api/history/all?limit=100', '/api/history/all?limit=100'),
+]
+
+
+# ユーザーを count 人になるまで追加する。戻り値: 追加したユーザーの [(user_id, トークン)]
+def add_users(count, existing, args):
+    added = []
+    for index in range(existing, count):
+        user, token = issue_token(f'user{index}')
+        db.session.flush()
+        generate_dataset(routines=args.routines, subtasks_per_routine=args.subtasks, years=args.years,
+                         parent_ratio=args.parent_ratio, seed=index, user_id=user.id)
+        db.session.commit()
+        added.append((user.id, token))
+    return added
+
+
+# 各段階で sample_users 人 (最初のユーザーと無作為に選んだユーザー) として各APIを呼ぶ
+# 結果は最も遅かったユーザーの値を取る
+def measure_step(app, client, users, args, rng):
+    sample = [users[0]] + rng.sample(users[1:], min(args.sample_users - 1, len(users) - 1))
+    per_user = {name: [] for name, _ in SCENARIOS}
+    for user_id, token in sample:
+        with app.app_context():
+            routine_id = db.session.query(Routine.id).filter(Routine.user_id == user_id).order_by(Routine.id).first()[0]
+        headers = {'Authorization': f'Bearer {token}'}
+        for name, url in SCENARIOS:
+            requests = [('GET', url.format(routine_id=routine_id), None)] * args.iterations
+            per_user[name].append(run_scenario(app, client, requests, args.warmup, headers))
+    return {
+        name: {
+            'p50_ms': max(r['p50_ms'] for r in results),
+            'p99_ms': max(r['p99_ms'] for r in results),
+            'statements_per_request': max(r['statements_per_request'] for r in results)
+        }
+        for name, results in per_user.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that per-user API latency stays flat as users and rows grow')
+    parser.add_argument('--steps', default='1,10,100,1000', help='user counts to measure at')
+    parser.add_argument('--routines', type=int, default=5, help='routines per user')
+    parser.add_argument('--subtasks', type=int, default=2)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--parent-ratio', type=float, default=0.3)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--sample-users', type=int, default=3, help='users to measure as at each step')
+    parser.add_argument('--max-growth', type=float, default=2.0, help='allowed p50 ratio of the last step to the first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON result to this file')
+    args = parser.parse_args()
+    steps = [int(step) for step in args.steps.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import create_app
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'users.db'),
+            'INIT_DB_ON_STARTUP': True,
+            'MULTI_USER': True
+        })
+        response_cache.max_entries = 0
+        client = app.test_client()
+        rng = random.Random(args.seed)
+
+        users = []
+        results = []
+        for count in steps:
+            started = time.perf_counter()
+            with app.app_context():
+                users += add_users(count, len(users), args)
+                rows = RoutineLog.query.count() + SubTaskLog.query.count()
+            generate_seconds = round(time.perf_counter() - started, 2)
+            results.append({
+                'users': count,
+                'log_rows': rows,
+                'generate_seconds': generate_seconds,
+                'scenarios': measure_step(app, client, users, args, rng)
+            })
+            print(f'{count} users, {rows} log rows measured', file=sys.stderr)
+        with app.app_context():
+            db.engine.dispose()
+
+    first, last = results[0]['scenarios'], results[-1]['scenarios']
+    growth = {
+        name: round(last[name]['p50_ms'] / first[name]['p50_ms'], 2) if first[name]['p50_ms'] else 1.0
+        for name in first
+    }
+    result = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'sample_users': args.sample_users,
+            'per_user': {'routines': args.routines, 'subtasks': args.subtasks, 'years': args.years, 'parent_ratio': args.parent_ratio}
+        },
+        'steps': results,
+        'p50_growth': growth
+    }
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+    grown = [name for name, ratio in growth.items() if ratio > args.max_growth]
+    if grown:
+        print(f"{len(grown)} scenario(s) grew more than x{args.max_growth}: {', '.join(grown)}", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
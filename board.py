@@ -0,0 +1,122 @@
+from collections import defaultdict
+from datetime import date
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog, DEFAULT_USER_ID
+from archive import log_table
+from streaks import current_streaks
+
+# 週間ボード (GET /api/routines) の一括ローダー
+# ルーチン数・サブタスク数に関係なく、固定回数のクエリでレスポンスを組み立てる
+# 期間指定 (load_range_board) は日ごとのオブジェクトの代わりに、1日1文字の完了ビット列 ('0'/'1') を返す
+
+
+# ?start&end・?weeks で指定できる期間の上限 (1年 + 端の週)
+MAX_RANGE_DAYS = 371
+
+
+# start_date〜end_date (両端を含む) のボードに必要な行を読む
+# user_id のユーザーのルーチンだけを読む (以降のクエリはそのルーチンIDで絞り込む)
+# 戻り値: (ルーチン, ルーチンごとのサブタスク, ルーチンログ, サブタスクログ, ストリーク)。ログは (ID, 日付, 完了) の行
+def _load_board_rows(start_date, end_date, user_id):
+    # 1. ルーチン一覧 (作成日時の降順、(user_id, created_at) のインデックスで読む)
+    routines = Routine.query.filter(Routine.user_id == user_id).order_by(Routine.created_at.desc()).all()
+    routine_ids = [r.id for r in routines]
+    if not routine_ids:
+        return [], {}, [], [], {}
+
+    # 2. サブタスク一覧 (ルーチンごとにまとめる)
+    subtasks_by_routine = defaultdict(list)
+    subtasks = SubTask.query.filter(SubTask.routine_id.in_(routine_ids)).order_by(SubTask.id).all()
+    for st in subtasks:
+        subtasks_by_routine[st.routine_id].append(st)
+
+    # 3. 期間内のルーチンログ (期間がアーカイブにかかる場合のみアーカイブも読む)
+    logs = log_table(RoutineLog, start_date, end_date)
+    routine_rows = db.session.query(logs.c.routine_id, logs.c.log_date, logs.c.completed).filter(
+        logs.c.routine_id.in_(routine_ids),
+        logs.c.log_date >= start_date,
+        logs.c.log_date <= end_date
+    ).all()
+
+    # 4. 期間内のサブタスクログ
+    subtask_rows = []
+    if subtasks:
+        logs = log_table(SubTaskLog, start_date, end_date)
+        subtask_rows = db.session.query(logs.c.subtask_id, logs.c.log_date, logs.c.completed).join(
+            SubTask, SubTask.id == logs.c.subtask_id
+        ).filter(
+            SubTask.routine_id.in_(routine_ids),
+            logs.c.log_date >= start_date,
+            logs.c.log_date <= end_date
+        ).all()
+
+    # 5. 現在のストリーク (永続化された状態から取得)
+    streaks = current_streaks(routine_ids)
+    return routines, subtasks_by_routine, routine_rows, subtask_rows, streaks
+
+
+# 1週間 (week_dates: 日付文字列のリスト) のボード。日ごとに {date, completed} を返す
+def load_week_board(week_dates, user_id=DEFAULT_USER_ID):
+    start_date = date.fromisoformat(week_dates[0])
+    end_date = date.fromisoformat(week_dates[-1])
+    routines, subtasks_by_routine, routine_rows, subtask_rows, streaks = _load_board_rows(start_date, end_date, user_id)
+    routine_done = {(routine_id, log_date.isoformat()): completed for routine_id, log_date, completed in routine_rows}
+    subtask_done = {(subtask_id, log_date.isoformat()): completed for subtask_id, log_date, completed in subtask_rows}
+
+    result = []
+    for routine in routines:
+        subtasks_data = []
+        for st in subtasks_by_routine[routine.id]:
+            subtasks_data.append({
+                'id': st.id,
+                'title': st.title,
+                'week_logs': [
+                    {'date': d_str, 'completed': subtask_done.get((st.id, d_str), False)}
+                    for d_str in week_dates
+                ]
+            })
+
+        result.append({
+            'id': routine.id,
+            'title': routine.title,
+            'target_days': routine.target_days,
+            'week_logs': [
+                {'date': d_str, 'completed': routine_done.get((routine.id, d_str), False)}
+                for d_str in week_dates
+            ],
+            'subtasks': subtasks_data,
+            'current_streak': streaks.get(routine.id, 0)
+        })
+    return result
+
+
+# ID ごとの完了ビット列 (i 文字目が start_date + i 日の完了状態)
+def _done_bits(rows, start_date, days):
+    bits = {}
+    for entity_id, log_date, completed in rows:
+        if completed:
+            line = bits.setdefault(entity_id, bytearray(b'0' * days))
+            line[(log_date - start_date).days] = ord('1')
+    empty = '0' * days
+    return lambda entity_id: bits[entity_id].decode('ascii') if entity_id in bits else empty
+
+
+# start_date〜end_date (両端を含む) のボード。週間ボードと同じクエリを期間だけ広げて1回ずつ実行する
+def load_range_board(start_date, end_date, user_id=DEFAULT_USER_ID):
+    days = (end_date - start_date).days + 1
+    routines, subtasks_by_routine, routine_rows, subtask_rows, streaks = _load_board_rows(start_date, end_date, user_id)
+    routine_done = _done_bits(routine_rows, start_date, days)
+    subtask_done = _done_bits(subtask_rows, start_date, days)
+    return [
+        {
+            'id': routine.id,
+            'title': routine.title,
+            'target_days': routine.target_days,
+            'done': routine_done(routine.id),
+            'subtasks': [
+                {'id': st.id, 'title': st.title, 'done': subtask_done(st.id)}
+                for st in subtasks_by_routine[routine.id]
+            ],
+            'current_streak': streaks.get(routine.id, 0)
+        }
+        for routine in routines
+    ]
@@ -0,0 +1,132 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from flask import Response, g, request, make_response
+from models import db
+from negotiation import encode_body, negotiate, vary
+
+# 読み取りAPIのレスポンスキャッシュ (プロセス内)
+# キーは (データバージョン, 今日の日付, ユーザー, パス, クエリパラメータ, 形式, 圧縮)
+# 形式 (JSON / MessagePack)・圧縮ごとに変換後の本文を保存するので、ヒット時は変換もしない
+# 更新系APIがデータバージョンを上げると、それ以前のエントリは使われなくなる
+# 日付が変わると今週・ストリークなどの結果も変わるため、今日の日付もキーに含める
+# キャッシュはプロセスごとに持つので、他のワーカー・CLI コマンドのコミットは SQLite の PRAGMA data_version で検出する
+# (接続ごとの値で、前回読んだ後に他の接続がコミットしていれば変わる)。変わっていればデータバージョンを上げる
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.data_version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # 計算中にデータが更新されていたら古い結果なので保存しない
+            if key[0] != self.data_version:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            # 上限を超えたら最も長く使われていないエントリから捨てる
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self):
+        with self._lock:
+            self.data_version += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'data_version': self.data_version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+response_cache = ResponseCache()
+
+
+# 更新系APIでコミット後に呼ぶ
+def bump_data_version():
+    response_cache.bump()
+
+
+# 他の接続 (他のワーカー・CLI コマンド) がコミットしていればキャッシュを捨てる
+# 接続ごとに前回の値を覚えておき、初めて使う接続では (それまでの変更が分からないので) 捨てる
+# SQLAlchemy のトランザクションを開始しないよう、プールの接続で直接読む
+def check_external_writes():
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA data_version')
+        version = cursor.fetchone()[0]
+        cursor.close()
+        seen = connection.info.get('data_version')
+        connection.info['data_version'] = version
+    finally:
+        connection.close()
+    if seen != version:
+        response_cache.bump()
+        return True
+    return False
+
+
+# GET API 用のデコレータ: 200 のレスポンスだけをキャッシュし、弱い ETag を付ける
+# If-None-Match が一致すれば本文なしの 304 を返す
+def cached_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        check_external_writes()
+        fmt, encoding = negotiate()
+        key = (
+            response_cache.data_version,
+            date.today().isoformat(),
+            g.get('user_id'),
+            request.path,
+            tuple(sorted(request.args.items(multi=True))),
+            fmt,
+            encoding
+        )
+        entry = response_cache.get(key)
+        cache_status = 'HIT'
+        if entry is None:
+            cache_status = 'MISS'
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body, mimetype, content_encoding = encode_body(response.get_data(), fmt, encoding)
+            entry = (body, mimetype or response.mimetype, content_encoding, hashlib.blake2b(body, digest_size=8).hexdigest())
+            response_cache.put(key, entry)
+
+        body, mimetype, content_encoding, etag = entry
+        response = Response(body, mimetype=mimetype)
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+        vary(response)
+        response.set_etag(etag, weak=True)
+        # ブラウザにも毎回 ETag で再検証させる
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Cache'] = cache_status
+        return response.make_conditional(request)
+    return wrapper
@@ -0,0 +1,89 @@
+import os
+
+# アプリケーション設定 (create_app が読み込む)
+# プロファイルは APP_ENV で選ぶ: production (既定) / development / testing
+# 優先順: create_app に渡した設定 > 環境変数 > プロファイルの既定値 > 共通の既定値
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+def _flag(value):
+    return value == '1'
+
+
+# (設定キー, 環境変数, 変換, 既定値)
+SETTINGS = [
+    # データベース (DATABASE_URL が指定されていればそちらを使う)
+    ('SQLALCHEMY_DATABASE_URI', 'DATABASE_URL', str, 'sqlite:///' + os.path.join(basedir, 'todos.db')),
+    # 開発用サーバー (python app.py) の設定
+    ('DEBUG', 'FLASK_DEBUG', _flag, False),
+    ('HOST', 'HOST', str, '127.0.0.1'),
+    ('PORT', 'PORT', int, 5001),
+    # 起動時にテーブル作成・マイグレーション・派生データの補完を行う (1 で有効、本番では flask upgrade-db で行う)
+    ('INIT_DB_ON_STARTUP', 'INIT_DB_ON_STARTUP', _flag, False),
+    # 読み取りAPIのレスポンスキャッシュの最大件数 (0 でキャッシュしない)
+    ('RESPONSE_CACHE_SIZE', 'RESPONSE_CACHE_SIZE', int, 256),
+    # SQLite の接続設定プロファイル ('production': WAL など / 'default': SQLite の既定値)
+    ('SQLITE_PROFILE', 'SQLITE_PROFILE', str, 'production'),
+    # リクエストごとのSQL計測 (1 で有効: Server-Timing ヘッダと /api/_debug/metrics)
+    ('SQL_INSTRUMENTATION', 'SQL_INSTRUMENTATION', _flag, False),
+    # 1リクエストのSQL件数・処理時間 (ミリ秒) の予算。超えたリクエストを警告ログに出す (0 で無効)
+    ('SQL_QUERY_BUDGET', 'SQL_QUERY_BUDGET', int, 20),
+    ('REQUEST_TIME_BUDGET_MS', 'REQUEST_TIME_BUDGET_MS', float, 250),
+    # 変更フィード (/api/events) を配信する (1 で有効)。ストリーム中もワーカーを占有しない構成 (ASGI モード・開発用サーバー) でだけ有効にする
+    # 同期ワーカーの gunicorn では無効のまま (画面は更新操作のあとにボードを取り直す)。asgi.py は自動で有効にする
+    ('EVENT_STREAM', 'EVENT_STREAM', _flag, False),
+    # 変更フィード (/api/events): 1本のストリームを続ける秒数 (過ぎたら終了し、クライアントは Last-Event-ID で再接続する)
+    ('EVENT_STREAM_TIMEOUT', 'EVENT_STREAM_TIMEOUT', float, 300),
+    # 変更が無いときにコメント行を送る間隔 (秒) と、他プロセスの変更を確認する間隔 (秒)
+    ('EVENT_HEARTBEAT_SECONDS', 'EVENT_HEARTBEAT_SECONDS', float, 15),
+    ('EVENT_POLL_SECONDS', 'EVENT_POLL_SECONDS', float, 1),
+    # 切断後にクライアントが再接続するまでの待ち時間 (ミリ秒)
+    ('EVENT_RETRY_MS', 'EVENT_RETRY_MS', int, 3000),
+    # ASGI モード (asgi.py) で読み取りAPIを並行に処理するスレッド数 (更新系は常に1本で直列に処理する)
+    ('ASGI_READ_THREADS', 'ASGI_READ_THREADS', int, 8),
+    # 複数ユーザーモード (1 で有効: API はトークンかセッションで認証し、ユーザーごとのデータだけを返す)
+    # 無効の場合は認証せず、全データを既定のユーザーのものとして扱う
+    ('MULTI_USER', 'MULTI_USER', _flag, False),
+    # セッション Cookie の署名キー (複数ユーザーモードで画面からログインする場合に必要)
+    ('SECRET_KEY', 'SECRET_KEY', str, None),
+    # 静的ファイルのビルド (flask build-assets) の出力先と、画面でビルド済みのファイルを使うか (0 なら static/ の元のファイル)
+    ('ASSET_DIR', 'ASSET_DIR', str, os.path.join(basedir, 'static', 'dist')),
+    ('BUILT_ASSETS', 'BUILT_ASSETS', _flag, True),
+    # API のレスポンスを Accept-Encoding に応じて圧縮する (gzip、zstandard モジュールがあれば zstd。前段のプロキシで圧縮するなら 0)
+    ('API_COMPRESSION', 'API_COMPRESSION', _flag, True),
+    # この日数より前の完了ログを flask compact-logs で年ごとのアーカイブテーブルに移す (0 で無効、例: 730)
+    # 増やす・0 に戻す場合は、先に flask unarchive-logs でアーカイブを元のテーブルに戻すこと
+    ('ARCHIVE_AFTER_DAYS', 'ARCHIVE_AFTER_DAYS', int, 0),
+]
+
+# プロファイルごとの既定値
+PROFILES = {
+    'production': {},
+    # 開発用: デバッグ有効、外部アクセス許可、起動時にDBを準備する、編集中の静的ファイルをそのまま使う
+    'development': {'DEBUG': True, 'HOST': '0.0.0.0', 'INIT_DB_ON_STARTUP': True, 'BUILT_ASSETS': False, 'EVENT_STREAM': True},
+    # 検証用: メモリ上のDB
+    'testing': {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'INIT_DB_ON_STARTUP': True, 'SECRET_KEY': 'testing'},
+}
+
+
+# 設定の辞書を作る。overrides はプロファイル名 (文字列) か設定の辞書 (APP_ENV でプロファイルも指定できる)
+def load_config(overrides=None):
+    if isinstance(overrides, str):
+        overrides = {'APP_ENV': overrides}
+    overrides = dict(overrides or {})
+    profile = overrides.pop('APP_ENV', None) or os.environ.get('APP_ENV', 'production')
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown APP_ENV: {profile}')
+
+    config = {key: default for key, _, _, default in SETTINGS}
+    config.update(PROFILES[profile])
+    for key, env_name, convert, _ in SETTINGS:
+        if env_name in os.environ:
+            config[key] = convert(os.environ[env_name])
+    config.update(overrides)
+    config['APP_ENV'] = profile
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # 個別の PRAGMA は SQLITE_PRAGMAS で上書きできる (例: {'synchronous': 'FULL'})
+    config.setdefault('SQLITE_PRAGMAS', {})
+    return config
@@ -0,0 +1,135 @@
+import argparse
+import os
+import random
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import insert
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog, DEFAULT_USER_ID
+from streaks import rebuild_streaks
+import rollups
+
+# ベンチマーク用の合成データ生成
+# ルーチン・サブタスクと、years 年分の RoutineLog / SubTaskLog を seed から再現可能に作る
+# 達成状況は「前日に達成していれば今日も達成しやすい」ように作り、現実的な長さのストリークを含める
+# 使い方: python dataset.py --out bench.db --routines 50 --subtasks 3 --years 2
+
+# 実施曜日のパターン (0=Sun)
+TARGET_DAY_PATTERNS = ['0,1,2,3,4,5,6', '0,1,2,3,4,5,6', '1,2,3,4,5', '0,6', '1,3,5']
+# バルク INSERT の1回あたりの行数
+INSERT_CHUNK = 5000
+
+
+def _insert_rows(model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(insert(model), rows[start:start + INSERT_CHUNK])
+
+
+# 達成した日の集合を作る (一部の日は「一度チェックして外した」未完了ログも残す)
+def _completion_days(rng, days, completion_rate):
+    completed = set()
+    unchecked = set()
+    previous = False
+    for day in days:
+        rate = min(completion_rate + 0.2, 0.98) if previous else max(completion_rate - 0.2, 0.02)
+        previous = rng.random() < rate
+        if previous:
+            completed.add(day)
+        elif rng.random() < 0.05:
+            unchecked.add(day)
+    return completed, unchecked
+
+
+# 現在のDBにデータを追加する (アプリケーションコンテキスト内で呼ぶ)
+# parent_ratio の割合のルーチンにだけ subtasks_per_routine 件のサブタスクを付ける
+# データは user_id のユーザーのものとして作り、そのユーザーの派生データ (ストリーク・ロールアップ) も作り直す。戻り値: 作成件数
+def generate_dataset(routines=20, subtasks_per_routine=3, years=1, parent_ratio=0.3,
+                     completion_rate=0.7, seed=0, end=None, user_id=DEFAULT_USER_ID):
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=int(365 * years) - 1)
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    routine_objs = []
+    for i in range(routines):
+        routine_objs.append(Routine(
+            user_id=user_id,
+            title=f'Routine {i}',
+            target_days=rng.choice(TARGET_DAY_PATTERNS),
+            created_at=datetime.combine(start, time())
+        ))
+    db.session.add_all(routine_objs)
+    db.session.flush()
+
+    routine_logs = []
+    subtask_logs = []
+    subtask_count = 0
+    for routine in routine_objs:
+        if subtasks_per_routine and rng.random() < parent_ratio:
+            subtasks = [SubTask(routine_id=routine.id, user_id=user_id, title=f'{routine.title} - Sub {j}') for j in range(subtasks_per_routine)]
+            db.session.add_all(subtasks)
+            db.session.flush()
+            subtask_count += len(subtasks)
+
+            # 親ルーチンはその日の全サブタスクが完了した日だけ完了ログを持つ (toggles.py と同じ規則)
+            all_done = set(days)
+            for subtask in subtasks:
+                completed, unchecked = _completion_days(rng, days, min(completion_rate + 0.15, 0.95))
+                all_done &= completed
+                subtask_logs += [{'subtask_id': subtask.id, 'user_id': user_id, 'log_date': d, 'completed': True} for d in completed]
+                subtask_logs += [{'subtask_id': subtask.id, 'user_id': user_id, 'log_date': d, 'completed': False} for d in unchecked]
+            routine_logs += [{'routine_id': routine.id, 'user_id': user_id, 'log_date': d, 'completed': True} for d in sorted(all_done)]
+        else:
+            completed, unchecked = _completion_days(rng, days, completion_rate)
+            routine_logs += [{'routine_id': routine.id, 'user_id': user_id, 'log_date': d, 'completed': True} for d in completed]
+            routine_logs += [{'routine_id': routine.id, 'user_id': user_id, 'log_date': d, 'completed': False} for d in unchecked]
+
+    _insert_rows(RoutineLog, routine_logs)
+    _insert_rows(SubTaskLog, subtask_logs)
+    rebuild_streaks([routine.id for routine in routine_objs])
+    rollups.rebuild_rollups(user_id)
+    return {
+        'routines': routines,
+        'subtasks': subtask_count,
+        'routine_logs': len(routine_logs),
+        'subtask_logs': len(subtask_logs),
+        'days': len(days)
+    }
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument('--routines', type=int, default=50)
+    parser.add_argument('--subtasks', type=int, default=3, help='subtasks per parent routine')
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--parent-ratio', type=float, default=0.3)
+    parser.add_argument('--completion-rate', type=float, default=0.7)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def dataset_options(args):
+    return {
+        'routines': args.routines,
+        'subtasks_per_routine': args.subtasks,
+        'years': args.years,
+        'parent_ratio': args.parent_ratio,
+        'completion_rate': args.completion_rate,
+        'seed': args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic todos database')
+    parser.add_argument('--out', required=True, help='path of the SQLite file to create')
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+    if os.path.exists(args.out):
+        parser.error(f'{args.out} already exists')
+
+    from app import create_app
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(args.out), 'INIT_DB_ON_STARTUP': True})
+    with app.app_context():
+        counts = generate_dataset(**dataset_options(args))
+        db.session.commit()
+    print(f"Generated {args.out}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, or_
+from models import db, ChangeEvent
+from users import request_user_id
+
+# 変更フィード (GET /api/events の Server-Sent Events)
+# 更新系APIはデータの変更と同じトランザクションで ChangeEvent を追記し、
+# クライアントは連番 (id) の続きから差分を受け取って手元の状態を書き換える
+# 他のプロセス (別ワーカー) の変更もDBをポーリングして拾う。同じプロセスの変更はコミット直後に通知する
+
+# イベントの種類
+# routine      : ルーチンの追加・変更 (upsert) / 削除 (delete)
+# subtask      : サブタスクの追加 (upsert) / 削除 (delete)
+# routine_log  : ルーチンの完了状態 (current_streak を含む)
+# subtask_log  : サブタスクの完了状態
+# reset        : インポートなどで差分を送れない変更があった (クライアントは全体を取り直す)
+
+# 1回の読み出しで送るイベント数
+EVENT_BATCH_SIZE = 500
+# 変更が無い間に送るコメント行
+KEEPALIVE = ': keepalive\n\n'
+
+
+class EventNotifier:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._callbacks = set()
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    # 通知があるか timeout 秒経つまで待つ
+    def wait(self, generation, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation != generation, timeout)
+            return self._generation
+
+    # wait の asyncio 版 (ASGI モードのストリーム用、スレッドを使わずに待つ)
+    async def wait_async(self, generation, timeout):
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        callback = lambda: loop.call_soon_threadsafe(woken.set)
+        with self._condition:
+            if self._generation != generation:
+                return self._generation
+            self._callbacks.add(callback)
+        try:
+            await asyncio.wait_for(woken.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._callbacks.discard(callback)
+        return self._generation
+
+    @property
+    def generation(self):
+        return self._generation
+
+
+event_notifier = EventNotifier()
+
+
+# 変更イベントをセッションに追加する (コミットは呼び出し側で行う)
+# 送信先はリクエストのユーザー。リクエスト外 (CLI) で記録したイベントは全ユーザーに送る
+def record_event(kind, action, entity_id, data=None):
+    db.session.add(ChangeEvent(
+        kind=kind,
+        action=action,
+        entity_id=entity_id,
+        payload=json.dumps(data or {}, ensure_ascii=False, separators=(',', ':')),
+        user_id=request_user_id()
+    ))
+    db.session.info['change_events'] = True
+
+
+# イベントを含むトランザクションがコミットされたら、待機中のストリームを起こす
+def _notify_after_commit(session):
+    if session.info.pop('change_events', False):
+        event_notifier.notify()
+
+
+def _discard_after_rollback(session):
+    session.info.pop('change_events', None)
+
+
+# セッションのイベントは全アプリ共通なので、create_app を何度呼んでも1回だけ登録する
+def init_events(app, db):
+    for name, listener in (('after_commit', _notify_after_commit), ('after_rollback', _discard_after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+
+
+def latest_event_id():
+    return db.session.query(func.max(ChangeEvent.id)).scalar() or 0
+
+
+# 連番は全ユーザー共通で、user_id のユーザーに送るイベント (全ユーザー向けを含む) だけを返す
+def events_after(last_id, user_id, limit=EVENT_BATCH_SIZE):
+    return ChangeEvent.query.filter(
+        ChangeEvent.id > last_id,
+        or_(ChangeEvent.user_id == user_id, ChangeEvent.user_id.is_(None))
+    ).order_by(ChangeEvent.id).limit(limit).all()
+
+
+# last_id の続きを送れないかどうか (古いイベントの整理で欠けている、または別のDBの連番)
+def has_gap(last_id):
+    oldest, latest = db.session.query(func.min(ChangeEvent.id), func.max(ChangeEvent.id)).one()
+    if latest is None:
+        return last_id > 0
+    return last_id + 1 < oldest or last_id > latest
+
+
+def event_item(change):
+    return {
+        'id': change.id,
+        'kind': change.kind,
+        'action': change.action,
+        'entity_id': change.entity_id,
+        'data': json.loads(change.payload),
+        'created_at': change.created_at.isoformat()
+    }
+
+
+def format_sse(event_id, name, data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {event_id}\nevent: {name}\ndata: {body}\n\n'
+
+
+# 再開位置 (Last-Event-ID ヘッダまたは after パラメータ) を解釈する。無ければ最新の位置、不正な値は ValueError
+def resume_position(raw):
+    if raw is None:
+        return latest_event_id()
+    if not raw.isdigit():
+        raise ValueError(raw)
+    return int(raw)
+
+
+# ストリーム開始時の位置を確認する。戻り値: (送信を始める位置, 先頭で送るチャンクのリスト)
+def start_position(last_id, retry_ms):
+    chunks = [f'retry: {retry_ms}\n\n']
+    if has_gap(last_id):
+        last_id = latest_event_id()
+        chunks.append(format_sse(last_id, 'reset', {'reason': 'events expired'}))
+    db.session.close()
+    return last_id, chunks
+
+
+# last_id の続きのイベントを読む。戻り値: (最後に送った位置, チャンクのリスト, まだ続きがあるか)
+# 接続を持ち続けないよう、読み出しのたびにセッションを閉じる
+def read_event_chunks(last_id, user_id):
+    items = [event_item(change) for change in events_after(last_id, user_id)]
+    db.session.close()
+    chunks = []
+    for item in items:
+        last_id = item['id']
+        chunks.append(format_sse(last_id, 'change', item))
+    return last_id, chunks, len(items) == EVENT_BATCH_SIZE
+
+
+# last_id の続きからイベントを送り続けるジェネレータ
+# timeout 秒経つと終了する (EventSource は Last-Event-ID を付けて自動で再接続する)
+def iter_event_stream(last_id, user_id, timeout, heartbeat, poll_interval, retry_ms):
+    deadline = time.monotonic() + timeout
+    last_sent = time.monotonic()
+    last_id, chunks = start_position(last_id, retry_ms)
+    yield from chunks
+
+    while True:
+        generation = event_notifier.generation
+        last_id, chunks, more = read_event_chunks(last_id, user_id)
+        yield from chunks
+        if chunks:
+            last_sent = time.monotonic()
+            if more:
+                continue
+
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_sent >= heartbeat:
+            # プロキシに接続を切られないようにコメント行を送る
+            yield KEEPALIVE
+            last_sent = now
+        event_notifier.wait(generation, min(poll_interval, deadline - now))
+
+
+# keep_days 日より古いイベントを削除する (欠けを検出できるよう最新の1件は残す)。戻り値: 削除件数
+def prune_events(keep_days):
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    return ChangeEvent.query.filter(
+        ChangeEvent.created_at < cutoff,
+        ChangeEvent.id < latest_event_id()
+    ).delete()
@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import time
+
+# gunicorn の設定 (カレントディレクトリの gunicorn.conf.py は自動で読み込まれる)
+# 使い方: flask --app app upgrade-db && gunicorn
+#         ASGI モード: WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn asgi:application
+# 同期ワーカーでは変更フィード (/api/events) を配信しない (EVENT_STREAM は無効のまま)。ASGI モードでは asgi.py が有効にする
+# ASGI モードの書き込みスレッド1本はワーカーごと (ワーカー間の書き込みは write_transaction の再試行で調停する)
+# 各値は環境変数で上書きできる
+
+_started = time.monotonic()
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '127.0.0.1:5001')
+# SQLite の書き込みは直列なので、ワーカーを増やしすぎない
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+# マスターでアプリを1回だけ読み込み、ワーカーは fork で引き継ぐ (ワーカーごとの import と create_app を省く)
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 10
+keepalive = 5
+
+
+# マスターが作った接続をワーカーで使い回さないよう、fork 直後に接続プールを捨てる
+# (close=False: 親プロセスの接続は閉じずに手放すだけ)
+def post_fork(server, worker):
+    from app import app
+    from models import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+# 起動時間の計測 (bench_startup.py がログから読む)
+def when_ready(server):
+    server.log.info('Master ready in %.1f ms (preload=%s)', (time.monotonic() - _started) * 1000, preload_app)
+
+
+def pre_fork(server, worker):
+    worker.boot_started = time.monotonic()
+
+
+def post_worker_init(worker):
+    worker.log.info('Worker %s booted in %.1f ms', worker.pid, (time.monotonic() - worker.boot_started) * 1000)
@@ -0,0 +1,69 @@
+from datetime import date
+from sqlalchemy import tuple_
+from models import db, Routine, RoutineLog, DEFAULT_USER_ID
+from archive import log_table
+
+# 履歴 (RoutineLog + ルーチン名) の読み取り
+# ユーザー・期間・ルーチン・完了のみで絞り込み、(日付, ID) の降順でキーセットページングする
+
+# 1ページの最大件数
+MAX_PAGE_SIZE = 1000
+
+
+# カーソル文字列 "YYYY-MM-DD:<id>" を (date, id) に変換する (不正な値は None)
+def decode_cursor(value):
+    try:
+        date_part, id_part = value.split(':')
+        return date.fromisoformat(date_part), int(id_part)
+    except (AttributeError, ValueError):
+        return None
+
+
+def encode_cursor(log_date, log_id):
+    return f'{log_date.isoformat()}:{log_id}'
+
+
+# (user_id, log_date, completed) のインデックスで、そのユーザーの行だけを読む
+# 期間がアーカイブ (archive.py) にかかる場合は、アーカイブ済みの年のログも合わせて読む
+def history_query(start=None, end=None, routine_id=None, completed_only=True, cursor=None, user_id=DEFAULT_USER_ID):
+    logs = log_table(RoutineLog, start, end)
+    query = db.session.query(
+        logs.c.id, logs.c.log_date, logs.c.routine_id, logs.c.completed, Routine.title
+    ).join(Routine, Routine.id == logs.c.routine_id).filter(logs.c.user_id == user_id)
+    if start is not None:
+        query = query.filter(logs.c.log_date >= start)
+    if end is not None:
+        query = query.filter(logs.c.log_date <= end)
+    if routine_id is not None:
+        query = query.filter(logs.c.routine_id == routine_id)
+    if completed_only:
+        query = query.filter(logs.c.completed == True)
+    if cursor is not None:
+        # 前ページの最後の行より後ろ (日付, ID の降順) から続ける
+        query = query.filter(tuple_(logs.c.log_date, logs.c.id) < tuple_(*cursor))
+    return query.order_by(logs.c.log_date.desc(), logs.c.id.desc())
+
+
+def history_item(row):
+    return {
+        'date': row.log_date.isoformat(),
+        'routine_id': row.routine_id,
+        'title': row.title,
+        'completed': row.completed
+    }
+
+
+# 1ページ分の履歴と次ページのカーソル (最後のページなら None)
+def history_page(limit, **filters):
+    rows = history_query(**filters).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].log_date, rows[-1].id)
+    return [history_item(row) for row in rows], next_cursor
+
+
+# 全件をリストにせず、少しずつ読み出しながら返す
+def iter_history(chunk_size=500, **filters):
+    for row in history_query(**filters).yield_per(chunk_size):
+        yield history_item(row)
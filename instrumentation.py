@@ -0,0 +1,155 @@
+import threading
+import time
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from cache import response_cache
+
+# リクエストごとのSQL計測 (SQL_INSTRUMENTATION が有効なときだけ記録する)
+# SQL件数・DB時間・遅いSQLを集計し、Server-Timing ヘッダと /api/_debug/metrics で確認できる
+# SQL_QUERY_BUDGET / REQUEST_TIME_BUDGET_MS を超えたリクエストは警告ログに出す
+# ストリーミングで返すレスポンスは、本文の生成中に実行されたSQLを含まない
+
+# ヒストグラムの区切り (各値以下の件数を数え、最後は上限なし)
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+QUERY_COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+# リクエストごと・全体で保持する遅いSQLの件数
+SLOW_STATEMENTS_PER_REQUEST = 3
+SLOW_STATEMENTS_TOTAL = 20
+
+
+def _bucket_index(buckets, value):
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            return index
+    return len(buckets)
+
+
+def _bucket_labels(buckets):
+    return [f'<={bound}' for bound in buckets] + [f'>{buckets[-1]}']
+
+
+class RouteMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._slowest = []
+
+    def record(self, route, elapsed_ms, stats):
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    'requests': 0,
+                    'total_ms': 0.0,
+                    'db_ms': 0.0,
+                    'statements': 0,
+                    'max_statements': 0,
+                    'latency_histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    'statement_histogram': [0] * (len(QUERY_COUNT_BUCKETS) + 1)
+                }
+            entry['requests'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['db_ms'] += stats['db_ms']
+            entry['statements'] += stats['count']
+            entry['max_statements'] = max(entry['max_statements'], stats['count'])
+            entry['latency_histogram'][_bucket_index(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            entry['statement_histogram'][_bucket_index(QUERY_COUNT_BUCKETS, stats['count'])] += 1
+
+            self._slowest += [dict(item, route=route) for item in stats['slowest']]
+            self._slowest.sort(key=lambda item: item['ms'], reverse=True)
+            del self._slowest[SLOW_STATEMENTS_TOTAL:]
+
+    def snapshot(self):
+        with self._lock:
+            routes = {}
+            for route, entry in sorted(self._routes.items()):
+                requests = entry['requests']
+                routes[route] = {
+                    'requests': requests,
+                    'avg_ms': round(entry['total_ms'] / requests, 3),
+                    'avg_db_ms': round(entry['db_ms'] / requests, 3),
+                    'avg_statements': round(entry['statements'] / requests, 2),
+                    'max_statements': entry['max_statements'],
+                    'latency_histogram_ms': dict(zip(_bucket_labels(LATENCY_BUCKETS_MS), entry['latency_histogram'])),
+                    'statement_histogram': dict(zip(_bucket_labels(QUERY_COUNT_BUCKETS), entry['statement_histogram']))
+                }
+            return {'routes': routes, 'slowest_statements': list(self._slowest)}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._slowest.clear()
+
+
+route_metrics = RouteMetrics()
+
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    return g.get('_sql_stats')
+
+
+def _install_engine_events(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _request_stats() is not None:
+            conn.info.setdefault('_sql_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _request_stats()
+        started = conn.info.get('_sql_started')
+        if stats is None or not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+        stats['count'] += 1
+        stats['db_ms'] += elapsed_ms
+        stats['slowest'].append({'sql': statement, 'ms': round(elapsed_ms, 3)})
+        stats['slowest'].sort(key=lambda item: item['ms'], reverse=True)
+        del stats['slowest'][SLOW_STATEMENTS_PER_REQUEST:]
+
+
+def init_instrumentation(app, db):
+    with app.app_context():
+        _install_engine_events(db.engine)
+
+    @app.before_request
+    def start_sql_stats():
+        if app.config.get('SQL_INSTRUMENTATION'):
+            g._sql_stats = {'count': 0, 'db_ms': 0.0, 'slowest': []}
+            g._request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_sql_stats(response):
+        stats = g.pop('_sql_stats', None)
+        if stats is None:
+            return response
+        elapsed_ms = (time.perf_counter() - g._request_started) * 1000
+        route = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        route_metrics.record(route, elapsed_ms, stats)
+
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats["db_ms"]:.2f};desc="{stats["count"]} queries", total;dur={elapsed_ms:.2f}'
+        )
+
+        query_budget = app.config.get('SQL_QUERY_BUDGET', 0)
+        time_budget = app.config.get('REQUEST_TIME_BUDGET_MS', 0)
+        if (query_budget and stats['count'] > query_budget) or (time_budget and elapsed_ms > time_budget):
+            app.logger.warning(
+                'Request over budget: %s took %.1fms with %d queries (db %.1fms); slowest: %s',
+                route, elapsed_ms, stats['count'], stats['db_ms'],
+                '; '.join(f'{item["ms"]}ms {" ".join(item["sql"].split())[:200]}' for item in stats['slowest'])
+            )
+        return response
+
+    # 計測結果の確認用 API (計測が無効なら 404)
+    @app.route('/api/_debug/metrics', methods=['GET', 'DELETE'])
+    def debug_metrics():
+        if not app.config.get('SQL_INSTRUMENTATION'):
+            return jsonify({'error': 'Not found'}), 404
+        if request.method == 'DELETE':
+            route_metrics.reset()
+            return jsonify({'message': 'Metrics reset'})
+        return jsonify(dict(route_metrics.snapshot(), response_cache=response_cache.stats()))
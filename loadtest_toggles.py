@@ -0,0 +1,126 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+# 同時トグルの負荷試験
+# gunicorn の複数ワーカーを模して、複数プロセス x 複数スレッドから同じ SQLite ファイルに
+# トグルを送り、SQLite プロファイルごとのスループットと失敗数を比較する
+# 使い方: python loadtest_toggles.py [--workers 4] [--threads 4] [--seconds 5]
+
+
+# init_db: テーブルを作る (準備用のプロセスだけで行う)
+def _load_app(database_path, profile, init_db=False):
+    from app import create_app
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database_path,
+        'SQLITE_PROFILE': profile,
+        'INIT_DB_ON_STARTUP': init_db
+    })
+    # 失敗はステータスコードで数えるので、例外のログは出さない
+    app.logger.setLevel(logging.CRITICAL)
+    return app
+
+
+def _setup(database_path, profile, routine_count):
+    app = _load_app(database_path, profile, init_db=True)
+    client = app.test_client()
+    ids = [client.post('/api/routines', json={'title': f'Load {i}'}).get_json()['id'] for i in range(routine_count)]
+    parent_id = client.post('/api/routines', json={'title': 'Load parent'}).get_json()['id']
+    sub_ids = [client.post(f'/api/routines/{parent_id}/subtasks', json={'title': f'Sub {i}'}).get_json()['id'] for i in range(3)]
+    return ids, sub_ids
+
+
+def _worker(database_path, profile, routine_ids, sub_ids, threads, start_at, seconds, seed):
+    app = _load_app(database_path, profile)
+    results = {'ok': 0, 'failed': 0, 'reads': 0}
+    lock = threading.Lock()
+
+    def run(thread_index):
+        rng = random.Random(seed * 100 + thread_index)
+        client = app.test_client()
+        ok = failed = reads = 0
+        while time.time() < start_at:
+            time.sleep(0.001)
+        deadline = start_at + seconds
+        while time.time() < deadline:
+            d = (date.today() - timedelta(days=rng.randint(0, 60))).isoformat()
+            roll = rng.random()
+            if roll < 0.1:
+                r = client.get('/api/history/all?limit=50')
+                reads += 1
+            elif roll < 0.3:
+                r = client.post(f'/api/subtasks/{rng.choice(sub_ids)}/toggle', json={'date': d})
+            else:
+                r = client.post(f'/api/routines/{rng.choice(routine_ids)}/toggle', json={'date': d})
+            if r.status_code == 200:
+                ok += 1
+            else:
+                failed += 1
+        with lock:
+            results['ok'] += ok
+            results['failed'] += failed
+            results['reads'] += reads
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results
+
+
+def _setup_entry(args):
+    return _setup(*args)
+
+
+def _worker_entry(args):
+    return _worker(*args)
+
+
+def run_profile(profile, workers, threads, seconds, routine_count=20):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, 'load.db')
+        with ctx.Pool(1) as pool:
+            routine_ids, sub_ids = pool.map(_setup_entry, [(database_path, profile, routine_count)])[0]
+
+        # 全ワーカーの読み込みが終わってから一斉に開始する
+        start_at = time.time() + 3
+        with ctx.Pool(workers) as pool:
+            parts = pool.map(_worker_entry, [
+                (database_path, profile, routine_ids, sub_ids, threads, start_at, seconds, seed)
+                for seed in range(workers)
+            ])
+    total = {key: sum(part[key] for part in parts) for key in ('ok', 'failed', 'reads')}
+    return {
+        'profile': profile,
+        'workers': workers,
+        'threads': threads,
+        'seconds': seconds,
+        'requests_ok': total['ok'],
+        'requests_failed': total['failed'],
+        'throughput_per_sec': round(total['ok'] / seconds, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent toggle load test for SQLite profiles')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profiles', default='default,production')
+    args = parser.parse_args()
+
+    for profile in args.profiles.split(','):
+        print(json.dumps(run_profile(profile, args.workers, args.threads, args.seconds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from sqlalchemy import inspect, text
+from models import db, DailyRollup, MonthlyRollup, Routine, RoutineLog, SubTask, SubTaskLog, DEFAULT_USER_ID
+
+# 既存の todos.db 向けの簡易スキーママイグレーション
+# db.create_all() は既存テーブルを変更しないため、列の変更はここで行う
+# 適用済みのバージョンは SQLite の PRAGMA user_version に記録する
+
+
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+# 1: ログテーブルの date_str (文字列) を log_date (DATE) に置き換え、複合インデックスを作成
+# SQLAlchemy の Date は SQLite に 'YYYY-MM-DD' として保存されるため、値はそのままコピーできる
+def _migrate_log_dates(conn):
+    for model in (RoutineLog, SubTaskLog):
+        table = model.__table__
+        if 'date_str' in _columns(conn, table.name):
+            conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+            # 旧テーブルのインデックス名と衝突しないよう、リネーム後に新しいテーブルを作成する
+            for index in list(table.indexes):
+                conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+            table.create(conn)
+            # 旧テーブルにある列だけをコピーする (後のバージョンで追加された列は既定値になる)
+            old_columns = _columns(conn, f'{table.name}_old')
+            other = [c.name for c in table.columns if c.name != 'log_date' and c.name in old_columns]
+            values = list(other)
+            # 所有ユーザーの列 (3 で追加) は既定値を持たないので、既定のユーザーを入れる
+            if 'user_id' not in old_columns:
+                other.append('user_id')
+                values.append(str(DEFAULT_USER_ID))
+            conn.execute(text(
+                f'INSERT INTO {table.name} ({", ".join(other)}, log_date) '
+                f'SELECT {", ".join(values)}, date_str FROM {table.name}_old'
+            ))
+            conn.execute(text(f'DROP TABLE {table.name}_old'))
+
+    _create_missing_indexes(conn)
+
+
+# 追加されたインデックス (既存テーブルには create_all では作られない)
+# 列がまだ無いインデックスは、その列を追加するバージョンで作成する
+def _create_missing_indexes(conn):
+    for table in db.metadata.sorted_tables:
+        columns = _columns(conn, table.name)
+        for index in table.indexes:
+            if {c.name for c in index.columns} <= columns:
+                index.create(conn, checkfirst=True)
+
+
+# 2: 差分同期用の updated_seq 列を追加 (既存の行は 0 = 初回の全件同期でだけ返す)
+# 以前はサブタスクを削除してもログが残っていたため、親のないサブタスクログも削除する
+def _add_updated_seq(conn):
+    for model in (Routine, SubTask, RoutineLog, SubTaskLog):
+        if 'updated_seq' not in _columns(conn, model.__tablename__):
+            conn.execute(text(f'ALTER TABLE {model.__tablename__} ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0'))
+    _create_missing_indexes(conn)
+    conn.execute(text('DELETE FROM sub_task_log WHERE subtask_id NOT IN (SELECT id FROM sub_task)'))
+
+
+# 3: 複数ユーザー対応。所有ユーザーの列を追加し、既存の行はすべて既定のユーザーのものにする
+# 全ユーザー横断のインデックスはユーザー単位のものに置き換え、ロールアップはユーザーごとに作り直す (起動時の補完で再集計)
+# 変更イベントの user_id は NULL (全ユーザーに送る) のままにする
+def _add_user_id(conn):
+    for model in (Routine, SubTask, RoutineLog, SubTaskLog):
+        if 'user_id' not in _columns(conn, model.__tablename__):
+            conn.execute(text(f'ALTER TABLE {model.__tablename__} ADD COLUMN user_id INTEGER NOT NULL DEFAULT {DEFAULT_USER_ID}'))
+    if 'user_id' not in _columns(conn, 'sync_tombstone'):
+        conn.execute(text(f'ALTER TABLE sync_tombstone ADD COLUMN user_id INTEGER NOT NULL DEFAULT {DEFAULT_USER_ID}'))
+    if 'user_id' not in _columns(conn, 'change_event'):
+        conn.execute(text('ALTER TABLE change_event ADD COLUMN user_id INTEGER'))
+    for name in ('ix_routine_updated_seq', 'ix_sub_task_updated_seq', 'ix_routine_log_updated_seq', 'ix_sub_task_log_updated_seq',
+                 'ix_routine_log_date_completed', 'ix_sub_task_log_date_completed'):
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    for model in (DailyRollup, MonthlyRollup):
+        if 'user_id' not in _columns(conn, model.__tablename__):
+            conn.execute(text(f'DROP TABLE {model.__tablename__}'))
+            model.__table__.create(conn)
+    _create_missing_indexes(conn)
+
+
+MIGRATIONS = [
+    (1, _migrate_log_dates),
+    (2, _add_updated_seq),
+    (3, _add_user_id),
+]
+
+
+def schema_version(conn):
+    return conn.execute(text('PRAGMA user_version')).scalar()
+
+
+# 未適用のマイグレーションを順に実行する (新規DBでは何もせずバージョンだけ進む)
+def upgrade_schema():
+    applied = []
+    with db.engine.begin() as conn:
+        current = schema_version(conn)
+        for version, migrate in MIGRATIONS:
+            if version > current:
+                migrate(conn)
+                conn.execute(text(f'PRAGMA user_version = {version}'))
+                applied.append(version)
+    return applied
@@ -3,14 +3,38 @@ from datetime import datetime
 
 db = SQLAlchemy()
 
+# シングルユーザーモード (MULTI_USER が無効) で全データを持つユーザー
+# 複数ユーザー対応前のDBの行もマイグレーションでこのユーザーのものになる
+DEFAULT_USER_ID = 1
+
+# ユーザー (アカウント)。API トークンは SHA-256 のハッシュだけを保存する (users.py)
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    token_hash = db.Column(db.String(64), nullable=True, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # ルーチン（タスク）モデル
 class Routine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # 所有ユーザー (サブタスク・ログにも同じ値を持たせ、ユーザー単位の検索をインデックスだけで行う)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False) # ルーチン名
     target_days = db.Column(db.String(20), default="0,1,2,3,4,5,6") # 実行曜日 "0,1,2..." (0=Sun)
     created_at = db.Column(db.DateTime, default=datetime.utcnow) # 作成日時
+    # 最後に変更されたトランザクションの同期連番 (sync.py が自動で付ける)
+    updated_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # ログとのリレーション設定 (ルーチン削除時にログも削除)
     logs = db.relationship('RoutineLog', backref='routine', lazy=True, cascade="all, delete-orphan")
+    # ストリーク状態 (ルーチン削除時に一緒に削除)
+    streak = db.relationship('RoutineStreak', backref='routine', uselist=False, lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # ユーザーのルーチン一覧 (作成日時順) 用
+        db.Index('ix_routine_user_created', 'user_id', 'created_at'),
+        # ユーザー単位の差分同期用
+        db.Index('ix_routine_user_seq', 'user_id', 'updated_seq'),
+    )
 
     def to_dict(self):
         return {
@@ -24,21 +48,60 @@ class Routine(db.Model):
 class RoutineLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     routine_id = db.Column(db.Integer, db.ForeignKey('routine.id'), nullable=False)
-    date_str = db.Column(db.String(10), nullable=False) # 日付フォーマット: YYYY-MM-DD
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # ルーチンの所有ユーザー
+    log_date = db.Column(db.Date, nullable=False) # 対象日 (APIでは YYYY-MM-DD 形式)
     completed = db.Column(db.Boolean, default=False) # 完了ステータス
+    # 最後に変更されたトランザクションの同期連番 (sync.py が自動で付ける)
+    updated_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
-    # 同じルーチン・同じ日付のログは重複させない
-    __table_args__ = (db.UniqueConstraint('routine_id', 'date_str', name='unique_routine_date'),)
+    __table_args__ = (
+        # 同じルーチン・同じ日付のログは重複させない
+        db.UniqueConstraint('routine_id', 'log_date', name='unique_routine_date'),
+        # ルーチン単位の期間検索 (週間ボード・ストリーク・年間履歴) 用のカバリングインデックス
+        db.Index('ix_routine_log_routine_date_completed', 'routine_id', 'log_date', 'completed'),
+        # ユーザーの全ルーチン横断の期間検索 (分析・全履歴) 用
+        db.Index('ix_routine_log_user_date_completed', 'user_id', 'log_date', 'completed'),
+        db.Index('ix_routine_log_user_seq', 'user_id', 'updated_seq'),
+    )
+
+# ルーチンごとのストリーク状態 (トグル時に差分更新される)
+class RoutineStreak(db.Model):
+    routine_id = db.Column(db.Integer, db.ForeignKey('routine.id'), primary_key=True)
+    last_completed = db.Column(db.Date, nullable=True) # 最新の完了日
+    current_run = db.Column(db.Integer, nullable=False, default=0) # last_completed で終わる連続日数
+    longest_streak = db.Column(db.Integer, nullable=False, default=0) # 過去最長の連続日数
+
+# ユーザーごとの日別の完了数ロールアップ (分析API用に RoutineLog から集計済み)
+class DailyRollup(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    date_str = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD
+    weekday = db.Column(db.Integer, nullable=False) # 0=Sun ... 6=Sat
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
+
+# ユーザーごとの月別の完了数ロールアップ
+class MonthlyRollup(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), primary_key=True) # YYYY-MM
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
 
 # サブタスクモデル
 class SubTask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    routine_id = db.Column(db.Integer, db.ForeignKey('routine.id'), nullable=False)
+    routine_id = db.Column(db.Integer, db.ForeignKey('routine.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # 親ルーチンの所有ユーザー
     title = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 最後に変更されたトランザクションの同期連番 (sync.py が自動で付ける)
+    updated_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # リレーション: 親ルーチンから参照可能にする
     routine_rel = db.relationship('Routine', backref=db.backref('subtasks', lazy=True, cascade="all, delete-orphan"))
+    # ログとのリレーション設定 (サブタスク削除時にログも削除)
+    logs = db.relationship('SubTaskLog', backref='subtask', lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_sub_task_user_seq', 'user_id', 'updated_seq'),
+    )
 
     def to_dict(self):
         return {
@@ -51,7 +114,53 @@ class SubTask(db.Model):
 class SubTaskLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subtask_id = db.Column(db.Integer, db.ForeignKey('sub_task.id'), nullable=False)
-    date_str = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # サブタスクの所有ユーザー
+    log_date = db.Column(db.Date, nullable=False)
     completed = db.Column(db.Boolean, default=False)
+    # 最後に変更されたトランザクションの同期連番 (sync.py が自動で付ける)
+    updated_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.UniqueConstraint('subtask_id', 'log_date', name='unique_subtask_date'),
+        db.Index('ix_sub_task_log_subtask_date_completed', 'subtask_id', 'log_date', 'completed'),
+        db.Index('ix_sub_task_log_user_date_completed', 'user_id', 'log_date', 'completed'),
+        db.Index('ix_sub_task_log_user_seq', 'user_id', 'updated_seq'),
+    )
+
+# 変更フィードのイベント (追記のみ、id は送信順の連番)
+# AUTOINCREMENT にして、古いイベントを削除しても id が再利用されないようにする
+class ChangeEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    kind = db.Column(db.String(20), nullable=False) # routine / subtask / routine_log / subtask_log / reset
+    action = db.Column(db.String(10), nullable=False) # upsert / delete
+    entity_id = db.Column(db.Integer, nullable=True)
+    payload = db.Column(db.Text, nullable=False) # 変更内容 (JSON)
+    # 送信先のユーザー (NULL は全ユーザー: CLI でのインポートなど)
+    user_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_change_event_user_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+# 差分同期の連番 (1行だけ)
+class SyncState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0) # 最後に払い出した連番
+    full_sync_seq = db.Column(db.Integer, nullable=False, default=0) # これより前からの同期は全件を返す
+
+# 削除された行の墓標 (差分同期で削除を伝える)
+# 親ルーチン・親サブタスクと一緒に削除された子の行は記録しない
+class SyncTombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False) # 削除された行の所有ユーザー
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    kind = db.Column(db.String(20), nullable=False) # routine / subtask / routine_log / subtask_log
+    entity_id = db.Column(db.Integer, nullable=False) # ログの場合は routine_id / subtask_id
+    log_date = db.Column(db.Date, nullable=True)
 
-    __table_args__ = (db.UniqueConstraint('subtask_id', 'date_str', name='unique_subtask_date'),)
+    __table_args__ = (
+        db.Index('ix_sync_tombstone_user_seq', 'user_id', 'seq'),
+    )
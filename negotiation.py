@@ -0,0 +1,115 @@
+import gzip
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# API レスポンスの形式・圧縮の選択 (Accept / Accept-Encoding)
+# 形式: JSON (既定) か MessagePack (Accept で application/msgpack を JSON より優先した場合、msgpack モジュールが必要)
+# 圧縮: zstd (zstandard モジュールが必要) か gzip。COMPRESS_MIN_BYTES 未満の本文は圧縮しない
+# キャッシュするAPI (cached_response) は選んだ形式・圧縮ごとに変換後の本文をキャッシュし、それ以外は after_request で変換する
+# ストリーミングのレスポンス (履歴の配列・NDJSON・エクスポート・変更フィード) はそのまま返す
+# JSON のシリアライズは orjson があれば orjson で行う (ASCII 以外の文字をエスケープしないこと以外は標準の JSON プロバイダと同じ出力)
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+# orjson を使う JSON プロバイダ (キーの並び替え・日付の形式 (HTTP 日付) は Flask の既定と同じ)
+class OrjsonProvider(DefaultJSONProvider):
+    def _encode(self, obj, indent=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj, kwargs.get('indent')).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and current_app.debug)
+        return current_app.response_class(self._encode(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def available_encodings():
+    return [name for name, module in (('zstd', zstandard), ('gzip', gzip)) if module is not None]
+
+
+def _wants_msgpack():
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes[MSGPACK_MIMETYPE] > request.accept_mimetypes['application/json']
+
+
+# クライアントが受け付ける圧縮のうち、品質値が最も高いもの (同じなら zstd を優先)
+def _content_encoding():
+    if not current_app.config['API_COMPRESSION']:
+        return None
+    accepted = request.accept_encodings
+    best = max(available_encodings(), key=lambda name: accepted[name], default=None)
+    return best if best and accepted[best] else None
+
+
+# リクエストのヘッダから (形式, 圧縮) を決める
+def negotiate():
+    return ('msgpack' if _wants_msgpack() else 'json'), _content_encoding()
+
+
+def compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# JSON の本文を選んだ形式・圧縮に変換する。戻り値: (本文, MIME タイプ (JSON のままなら None), 圧縮 (しなければ None))
+def encode_body(body, fmt, encoding):
+    mimetype = None
+    if fmt == 'msgpack':
+        body = msgpack.packb(current_app.json.loads(body))
+        mimetype = MSGPACK_MIMETYPE
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, mimetype, None
+    return compress(body, encoding), mimetype, encoding
+
+
+def vary(response):
+    response.vary.update(('Accept', 'Accept-Encoding'))
+
+
+def _negotiate_response(response):
+    if (not request.path.startswith('/api/') or response.is_streamed or response.status_code == 304
+            or response.mimetype != 'application/json' or 'Accept' in response.vary):
+        return response
+    body, mimetype, encoding = encode_body(response.get_data(), *negotiate())
+    response.set_data(body)
+    if mimetype:
+        response.content_type = mimetype
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    vary(response)
+    return response
+
+
+def init_negotiation(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    app.after_request(_negotiate_response)
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import bindparam, func, update
+from models import db, Routine, RoutineLog, DailyRollup, MonthlyRollup, DEFAULT_USER_ID
+from archive import log_table
+
+# ユーザーごとの完了数のロールアップ (日別・月別・曜日別)
+# トグル時に差分更新しておき、/api/analytics/overall はログ件数に関係なく
+# 数百行以内のインデックス読み取りで集計できるようにする
+
+
+def _weekday(day):
+    # 0=Sun ... 6=Sat (strftime('%w') と同じ)
+    return day.isoweekday() % 7
+
+
+# ルーチンログの完了状態が変わったときに呼ぶ (delta: +1 / -1)
+def apply_completion_delta(routine_id, day, delta):
+    apply_completion_deltas({(routine_id, day): delta})
+
+
+# 複数のルーチンログの変更をまとめて反映する (deltas: {(routine_id, day): +1 / -1})
+# 日別・月別のロールアップの行は、対象の (ユーザー, 日付)・(ユーザー, 月) をそれぞれ1回のクエリで読み込む
+# ルーチンはセッションから読む (一括トグルはまとめて読み込み済み)
+def apply_completion_deltas(deltas):
+    daily = defaultdict(int)
+    for (routine_id, day), delta in deltas.items():
+        daily[(db.session.get(Routine, routine_id).user_id, day.isoformat())] += delta
+    monthly = _monthly_from_daily(daily)
+    users = {user_id for user_id, _ in daily}
+
+    daily_rows = {(r.user_id, r.date_str): r for r in DailyRollup.query.filter(
+        DailyRollup.user_id.in_(users),
+        DailyRollup.date_str.in_({date_str for _, date_str in daily})
+    )}
+    monthly_rows = {(r.user_id, r.month): r for r in MonthlyRollup.query.filter(
+        MonthlyRollup.user_id.in_(users),
+        MonthlyRollup.month.in_({month for _, month in monthly})
+    )}
+    for (user_id, date_str), delta in daily.items():
+        row = daily_rows.get((user_id, date_str))
+        if row is None:
+            row = DailyRollup(user_id=user_id, date_str=date_str, weekday=_weekday(date.fromisoformat(date_str)), completed_count=0)
+            db.session.add(row)
+        row.completed_count += delta
+    for (user_id, month), delta in monthly.items():
+        row = monthly_rows.get((user_id, month))
+        if row is None:
+            row = MonthlyRollup(user_id=user_id, month=month, completed_count=0)
+            db.session.add(row)
+        row.completed_count += delta
+
+
+# ルーチン削除時: そのルーチンの完了ログ分をロールアップから差し引く
+# 日別の完了数を1回の GROUP BY で数え、日別・月別それぞれ1回の UPDATE (executemany) で差し引く
+# (ロールアップの行はそのルーチンの完了を数えたときに作られているので、挿入は要らない)
+def remove_routine_completions(routine_id):
+    user_id = db.session.get(Routine, routine_id).user_id
+    logs = log_table(RoutineLog)
+    rows = db.session.query(logs.c.log_date, func.count()).filter(
+        logs.c.routine_id == routine_id,
+        logs.c.completed == True
+    ).group_by(logs.c.log_date)
+    daily = {(user_id, log_date.isoformat()): count for log_date, count in rows}
+    if not daily:
+        return
+
+    # セッションに読み込み済みのロールアップの行があれば、UPDATE の前に書き出しておく
+    db.session.flush()
+    table = DailyRollup.__table__
+    db.session.execute(
+        update(table).where(table.c.user_id == bindparam('owner'), table.c.date_str == bindparam('key')).values(
+            completed_count=table.c.completed_count - bindparam('removed')
+        ),
+        [{'owner': owner, 'key': date_str, 'removed': count} for (owner, date_str), count in daily.items()]
+    )
+    table = MonthlyRollup.__table__
+    db.session.execute(
+        update(table).where(table.c.user_id == bindparam('owner'), table.c.month == bindparam('key')).values(
+            completed_count=table.c.completed_count - bindparam('removed')
+        ),
+        [{'owner': owner, 'key': month, 'removed': count} for (owner, month), count in _monthly_from_daily(daily).items()]
+    )
+
+
+# RoutineLog から集計した日別の完了数 {(user_id, date_str): count} (user_id を指定するとそのユーザーだけ)
+def _raw_daily_counts(user_id=None):
+    logs = log_table(RoutineLog)
+    rows = db.session.query(logs.c.user_id, logs.c.log_date, func.count()).filter(
+        logs.c.completed == True
+    ).group_by(logs.c.user_id, logs.c.log_date)
+    if user_id is not None:
+        rows = rows.filter(logs.c.user_id == user_id)
+    return {(owner, log_date.isoformat()): count for owner, log_date, count in rows}
+
+
+def _monthly_from_daily(daily):
+    monthly = defaultdict(int)
+    for (user_id, date_str), count in daily.items():
+        monthly[(user_id, date_str[:7])] += count
+    return monthly
+
+
+# ロールアップを RoutineLog から作り直す (user_id を指定するとそのユーザーの分だけ)
+def rebuild_rollups(user_id=None):
+    daily_rows = DailyRollup.query
+    monthly_rows = MonthlyRollup.query
+    if user_id is not None:
+        daily_rows = daily_rows.filter(DailyRollup.user_id == user_id)
+        monthly_rows = monthly_rows.filter(MonthlyRollup.user_id == user_id)
+    daily_rows.delete()
+    monthly_rows.delete()
+
+    daily = _raw_daily_counts(user_id)
+    db.session.add_all(
+        DailyRollup(user_id=owner, date_str=date_str, weekday=_weekday(date.fromisoformat(date_str)), completed_count=count)
+        for (owner, date_str), count in daily.items()
+    )
+    db.session.add_all(
+        MonthlyRollup(user_id=owner, month=month, completed_count=count)
+        for (owner, month), count in _monthly_from_daily(daily).items()
+    )
+    return len(daily)
+
+
+# ロールアップが空で、完了ログだけ存在する場合 (既存DBからの移行直後) に作成する
+def backfill_rollups():
+    if db.session.query(DailyRollup.date_str).first() is not None:
+        return False
+    logs = log_table(RoutineLog)
+    if db.session.query(logs.c.id).filter(logs.c.completed == True).first() is None:
+        return False
+    rebuild_rollups()
+    return True
+
+
+# ロールアップと RoutineLog の集計を突き合わせ、食い違いを返す
+# 戻り値: [(種別, キー, ロールアップの値, 実際の値), ...]
+# キーは (user_id, 日付または月)
+def check_rollups():
+    daily = _raw_daily_counts()
+    monthly = _monthly_from_daily(daily)
+
+    mismatches = []
+    stored_daily = {(r.user_id, r.date_str): r for r in DailyRollup.query}
+    for key in sorted(set(daily) | set(stored_daily)):
+        row = stored_daily.get(key)
+        stored = row.completed_count if row else 0
+        if stored != daily.get(key, 0):
+            mismatches.append(('day', key, stored, daily.get(key, 0)))
+        elif row and row.weekday != _weekday(date.fromisoformat(key[1])):
+            mismatches.append(('weekday', key, row.weekday, _weekday(date.fromisoformat(key[1]))))
+
+    stored_monthly = {(r.user_id, r.month): r.completed_count for r in MonthlyRollup.query}
+    for key in sorted(set(monthly) | set(stored_monthly)):
+        if stored_monthly.get(key, 0) != monthly.get(key, 0):
+            mismatches.append(('month', key, stored_monthly.get(key, 0), monthly.get(key, 0)))
+    return mismatches
+
+
+# start_str 以降の日別完了数 {date_str: (weekday, count)}
+def daily_counts_since(start_str, user_id=DEFAULT_USER_ID):
+    rows = db.session.query(DailyRollup.date_str, DailyRollup.weekday, DailyRollup.completed_count).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.date_str >= start_str
+    )
+    return {date_str: (weekday, count) for date_str, weekday, count in rows}
+
+
+# 指定した月 (YYYY-MM) の完了数 {month: count}
+def monthly_counts(months, user_id=DEFAULT_USER_ID):
+    rows = db.session.query(MonthlyRollup.month, MonthlyRollup.completed_count).filter(
+        MonthlyRollup.user_id == user_id,
+        MonthlyRollup.month.in_(months)
+    )
+    return dict(rows.all())
@@ -0,0 +1,120 @@
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from models import db
+
+# SQLite の接続設定プロファイル
+# 'default' は SQLite の既定値のまま (ロールバックジャーナル、接続時に何もしない)
+# 'production' は複数ワーカー・複数スレッドで動かすための設定
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        # WAL では読み取りが書き込みを待たない (書き込み同士は従来どおり1つずつ)
+        'journal_mode': 'WAL',
+        # WAL では NORMAL でもDBは壊れない (電源断時に直近のコミットが失われることがあるだけ)
+        'synchronous': 'NORMAL',
+        # 書き込みロックを取れないときに待つ時間 (ミリ秒)
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        # 負の値は KiB 単位 (約20MB)
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# ファイルDB用の接続プール設定 (メモリDBは Flask-SQLAlchemy が単一接続の StaticPool にする)
+# ワーカープロセスごとにプールを持つため、スレッド数に合わせて小さめにしておく
+POOL_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+}
+
+# "database is locked" で失敗した書き込みの再試行回数と初回の待ち時間 (秒、以降は倍々)
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+# 書き込み用のトランザクションを BEGIN IMMEDIATE で開始するかどうか
+_immediate = ContextVar('sqlite_immediate', default=False)
+# 実行中の書き込みAPIの状態 ({'committed': コミット済みか})。書き込みAPIの外では None
+_write_state = ContextVar('sqlite_write_state', default=None)
+
+
+def sqlite_pragmas(profile, overrides=None):
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'Unknown SQLite profile: {profile}')
+    return dict(SQLITE_PROFILES[profile], **(overrides or {}))
+
+
+# SQLALCHEMY_ENGINE_OPTIONS に渡すエンジン設定
+def engine_options(database_uri):
+    url = make_url(database_uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return {}
+    return dict(POOL_OPTIONS)
+
+
+# 接続ごとに PRAGMA を設定し、トランザクションの開始を自前で行う
+# pysqlite は最初の書き込み直前に暗黙の BEGIN を発行するため、読み取りから始まった
+# トランザクションが途中で書き込みロックを取りに行き、WAL では待たずに失敗することがある
+# 書き込みAPI (write_transaction) では最初から BEGIN IMMEDIATE でロックを取る
+def install_sqlite_profile(engine, pragmas):
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if _immediate.get() else 'BEGIN')
+
+
+def is_locked_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+# 書き込みAPIの中でコミットしたら、以降は再試行しない
+# コミット後の読み取り (期限切れになった属性の再読み込みなど) は書き込みロックを取らずに BEGIN で始める
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    state = _write_state.get()
+    if state is not None:
+        state['committed'] = True
+        _immediate.set(False)
+
+
+# 書き込みAPI用のデコレータ
+# BEGIN IMMEDIATE で書き込みロックを取り、busy_timeout を過ぎてもロックが取れなければ
+# ロールバックしてAPI全体を少し待ってからやり直す
+# やり直すのはコミット前に失敗した場合だけ (コミット後に失敗した場合にやり直すと、同じ変更を2回適用してしまう)
+def write_transaction(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        state = {'committed': False}
+        immediate_token = _immediate.set(True)
+        state_token = _write_state.set(state)
+        try:
+            for attempt in range(LOCK_RETRIES + 1):
+                try:
+                    return view(*args, **kwargs)
+                except OperationalError as error:
+                    db.session.rollback()
+                    if state['committed'] or not is_locked_error(error) or attempt == LOCK_RETRIES:
+                        raise
+                    time.sleep(LOCK_RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+        finally:
+            _write_state.reset(state_token)
+            _immediate.reset(immediate_token)
+    return wrapper
@@ -22,13 +22,89 @@ let currentWeekOffset = 0; // 週オフセット (0 = 今週)
 let globalRoutines = []; // 追加: 全ルーチンのキャッシュ
 let cachedWeekDates = [];
 
+// 読み取りAPIの形式 (localStorage.apiFormat = 'msgpack' で MessagePack を使う。既定は JSON)
+// 圧縮 (gzip / zstd) はブラウザが Accept-Encoding で選ぶので指定しない
+const API_FORMAT = localStorage.getItem('apiFormat') === 'msgpack' ? 'msgpack' : 'json';
+
+function apiGet(url) {
+    const headers = API_FORMAT === 'msgpack' ? { 'Accept': 'application/msgpack, application/json;q=0.5' } : {};
+    return fetch(url, { headers: headers });
+}
+
+// レスポンスの本文を読む (サーバーが MessagePack を返さなかった場合は JSON)
+async function readData(response) {
+    if ((response.headers.get('Content-Type') || '').startsWith('application/msgpack')) {
+        return decodeMsgpack(new Uint8Array(await response.arrayBuffer()));
+    }
+    return response.json();
+}
+
+// MessagePack のデコーダ (API が返す型: nil・真偽値・整数・浮動小数点数・文字列・配列・マップ)
+function decodeMsgpack(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const text = new TextDecoder();
+    let pos = 0;
+    const str = (length) => text.decode(bytes.subarray(pos, pos += length));
+    const array = (length) => Array.from({ length: length }, () => read());
+    const map = (length) => {
+        const obj = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            obj[key] = read();
+        }
+        return obj;
+    };
+    const next = (size, getter) => {
+        const value = view[getter](pos);
+        pos += size;
+        return value;
+    };
+    function read() {
+        const type = bytes[pos++];
+        if (type < 0x80) return type;
+        if (type < 0x90) return map(type & 0x0f);
+        if (type < 0xa0) return array(type & 0x0f);
+        if (type < 0xc0) return str(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xca: return next(4, 'getFloat32');
+            case 0xcb: return next(8, 'getFloat64');
+            case 0xcc: return next(1, 'getUint8');
+            case 0xcd: return next(2, 'getUint16');
+            case 0xce: return next(4, 'getUint32');
+            case 0xcf: return Number(next(8, 'getBigUint64'));
+            case 0xd0: return next(1, 'getInt8');
+            case 0xd1: return next(2, 'getInt16');
+            case 0xd2: return next(4, 'getInt32');
+            case 0xd3: return Number(next(8, 'getBigInt64'));
+            case 0xd9: return str(next(1, 'getUint8'));
+            case 0xda: return str(next(2, 'getUint16'));
+            case 0xdb: return str(next(4, 'getUint32'));
+            case 0xdc: return array(next(2, 'getUint16'));
+            case 0xdd: return array(next(4, 'getUint32'));
+            case 0xde: return map(next(2, 'getUint16'));
+            case 0xdf: return map(next(4, 'getUint32'));
+        }
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+    return read();
+}
+
 // ルーチン一覧の取得と表示
 async function fetchRoutines() {
     try {
         // オフセット付きでAPIリクエスト
-        const response = await fetch(`/api/routines?offset=${currentWeekOffset}`);
+        const response = await apiGet(`/api/routines?offset=${currentWeekOffset}`);
+        // 複数ユーザーモードで未ログインならトークンを入力してもらう
+        if (response.status === 401) {
+            if (await login()) await fetchRoutines();
+            return;
+        }
         if (!response.ok) throw new Error('Failed to fetch routines');
-        const data = await response.json();
+        const data = await readData(response);
 
         globalRoutines = data.routines; // グローバル変数に保存
         cachedWeekDates = data.week_dates; // Save for modal usage
@@ -36,11 +112,131 @@ async function fetchRoutines() {
         // ヘッダーとリストの更新
         renderWeekHeader(data.week_dates);
         renderRoutines(data.routines, data.week_dates);
+
+        // 変更フィードに未接続なら、このボードの時点から差分を受け取る (サーバーが配信している場合だけ)
+        if (data.event_stream) connectChangeFeed(data.last_event_id);
     } catch (error) {
         console.error('Error fetching routines:', error);
     }
 }
 
+// トークン (flask create-user で発行) を入力してもらい、セッション Cookie を作る
+// 成功すれば true (以降の API・変更フィードは Cookie で認証される)
+async function login() {
+    const token = prompt('API トークンを入力してください');
+    if (!token) return false;
+    const response = await fetch('/api/session', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ token: token })
+    });
+    if (!response.ok) alert('トークンが正しくありません');
+    return response.ok;
+}
+
+// --- 変更フィード (Server-Sent Events) ---
+// 他のタブ・端末を含む全ての変更を /api/events から差分で受け取り、globalRoutines を書き換えて再描画する
+// 接続中は更新操作のあとにボード全体を取り直さない
+// 同期ワーカーの構成ではストリームがワーカーを占有するため、サーバーは配信せず (event_stream: false)、画面も接続しない
+let changeFeed = null;
+let renderScheduled = false;
+
+function connectChangeFeed(lastEventId) {
+    if (changeFeed || typeof EventSource === 'undefined' || lastEventId === undefined) return;
+    // 再接続時はブラウザが Last-Event-ID を付けて続きから受け取る
+    changeFeed = new EventSource(`/api/events?after=${lastEventId}`);
+    changeFeed.addEventListener('change', (e) => applyChange(JSON.parse(e.data)));
+    // 差分で追いつけない場合はボード全体を取り直す
+    changeFeed.addEventListener('reset', () => fetchRoutines());
+}
+
+function isChangeFeedLive() {
+    return changeFeed !== null && changeFeed.readyState === EventSource.OPEN;
+}
+
+// 更新操作の後に呼ぶ (変更フィードが使えないときだけボードを取り直す)
+async function refreshAfterWrite() {
+    if (isChangeFeedLive()) return;
+    await fetchRoutines();
+}
+
+function emptyWeekLogs() {
+    return cachedWeekDates.map(date => ({ date: date, completed: false }));
+}
+
+function setWeekLog(weekLogs, date, completed) {
+    const log = weekLogs.find(l => l.date === date);
+    if (log) log.completed = completed;
+}
+
+// 1件の変更を手元の状態に反映する (同じ変更を2回受け取っても結果は変わらない)
+function applyChange(change) {
+    const data = change.data;
+    const findRoutine = id => globalRoutines.find(r => r.id === id);
+
+    if (change.kind === 'routine') {
+        if (change.action === 'delete') {
+            globalRoutines = globalRoutines.filter(r => r.id !== data.id);
+        } else {
+            const routine = findRoutine(data.id);
+            if (routine) {
+                routine.title = data.title;
+                routine.target_days = data.target_days;
+            } else {
+                // 一覧は作成日時の降順なので先頭に追加する
+                globalRoutines.unshift({
+                    id: data.id,
+                    title: data.title,
+                    target_days: data.target_days,
+                    week_logs: emptyWeekLogs(),
+                    subtasks: [],
+                    current_streak: 0
+                });
+            }
+        }
+    } else if (change.kind === 'subtask') {
+        const routine = findRoutine(data.routine_id);
+        if (routine) {
+            routine.subtasks = routine.subtasks.filter(s => s.id !== data.id);
+            if (change.action !== 'delete') {
+                routine.subtasks.push({ id: data.id, title: data.title, week_logs: emptyWeekLogs() });
+                routine.subtasks.sort((a, b) => a.id - b.id);
+            }
+        }
+    } else if (change.kind === 'routine_log') {
+        const routine = findRoutine(data.routine_id);
+        if (routine) {
+            setWeekLog(routine.week_logs, data.date, data.completed);
+            routine.current_streak = data.current_streak;
+        }
+    } else if (change.kind === 'subtask_log') {
+        const routine = findRoutine(data.routine_id);
+        const subtask = routine && routine.subtasks.find(s => s.id === data.subtask_id);
+        if (subtask) setWeekLog(subtask.week_logs, data.date, data.completed);
+    } else if (change.kind === 'reset') {
+        fetchRoutines();
+        return;
+    }
+    scheduleRender();
+}
+
+// 連続して届いた変更は1フレームにまとめて描画する
+function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(() => {
+        renderScheduled = false;
+        renderRoutines(globalRoutines, cachedWeekDates);
+        if (currentDetailRoutineId) {
+            const routine = globalRoutines.find(r => r.id === currentDetailRoutineId);
+            if (routine) {
+                detailModalTitle.textContent = routine.title;
+                renderModalSubtasks(routine);
+            }
+        }
+    });
+}
+
 // 曜日の表示用フォーマット (Sun, Mon...)
 function formatDateDisplay(dateStr) {
     const date = new Date(dateStr);
@@ -223,7 +419,7 @@ async function deleteSubtask(subtaskId) {
             method: 'DELETE'
         });
         if (response.ok) {
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error deleting subtask:', error);
@@ -240,7 +436,7 @@ async function toggleSubtask(subtaskId, date) {
         });
 
         if (response.ok) {
-            fetchRoutines(); // Refresh to update parent status
+            refreshAfterWrite(); // Refresh to update parent status
         }
     } catch (error) {
         console.error('Error toggling subtask:', error);
@@ -259,22 +455,11 @@ async function openGlobalHistory() {
     // alert("Global Routines Fetched: " + globalRoutines.length);
 
     try {
-        const response = await fetch('/api/history/all');
-        if (!response.ok) throw new Error('Failed to fetch history');
-        const data = await response.json();
-
-        // データをマップに加工 (日付 -> タイトル配列)
-        const map = new Map();
-        data.forEach(item => {
-            if (!map.has(item.date)) map.set(item.date, []);
-            map.get(item.date).push(item.title);
-        });
-
-        cachedHistoryData = map; // データキャッシュ
+        await fetchHistoryForMonth();
         modalTitle.textContent = "ルーティン実績";
 
         renderCalendar();
-        renderGlobalHistoryList(map);
+        renderGlobalHistoryList(cachedHistoryData);
 
         // モーダル表示アニメーション
         modal.style.display = 'flex';
@@ -286,6 +471,27 @@ async function openGlobalHistory() {
     }
 }
 
+// 表示中の月の完了履歴だけを取得してキャッシュする
+async function fetchHistoryForMonth() {
+    const year = currentViewDate.getFullYear();
+    const month = currentViewDate.getMonth();
+    const mStr = String(month + 1).padStart(2, '0');
+    const lastDay = String(new Date(year, month + 1, 0).getDate()).padStart(2, '0');
+
+    const response = await apiGet(`/api/history/all?from=${year}-${mStr}-01&to=${year}-${mStr}-${lastDay}`);
+    if (!response.ok) throw new Error('Failed to fetch history');
+    const data = await readData(response);
+
+    // データをマップに加工 (日付 -> タイトル配列)
+    const map = new Map();
+    data.forEach(item => {
+        if (!map.has(item.date)) map.set(item.date, []);
+        map.get(item.date).push(item.title);
+    });
+
+    cachedHistoryData = map; // データキャッシュ
+}
+
 // 履歴リストの描画
 function renderGlobalHistoryList(historyMap) {
     historyList.innerHTML = '';
@@ -456,10 +662,17 @@ function selectDate(dateStr) {
     }
 }
 
-// 月変更
-function changeMonth(offset) {
+// 月変更 (表示する月の履歴を取得し直す)
+async function changeMonth(offset) {
     currentViewDate.setMonth(currentViewDate.getMonth() + offset);
+    selectedDate = null;
+    try {
+        await fetchHistoryForMonth();
+    } catch (error) {
+        console.error('Error fetching history:', error);
+    }
     renderCalendar();
+    renderGlobalHistoryList(cachedHistoryData || new Map());
 }
 
 window.changeMonth = changeMonth;
@@ -542,7 +755,7 @@ async function saveNewRoutine() {
 
         if (response.ok) {
             closeAddModal();
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error adding routine:', error);
@@ -566,7 +779,7 @@ async function toggleDay(routineId, date) {
         });
 
         if (response.ok) {
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error toggling routine:', error);
@@ -581,7 +794,7 @@ async function deleteRoutine(id) {
         });
 
         if (response.ok) {
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error deleting routine:', error);
@@ -619,8 +832,8 @@ async function openAnalyticsModal() {
     setTimeout(() => analyticsModal.classList.add('active'), 10);
 
     try {
-        const response = await fetch('/api/analytics/overall');
-        const data = await response.json();
+        const response = await apiGet('/api/analytics/overall');
+        const data = await readData(response);
         cachedAnalyticsData = data; // Cache the data
 
         document.getElementById('total-rate-display').textContent = data.total_completion_rate + '%';
@@ -838,8 +1051,8 @@ let currentDetailRoutineId = null;
 
 async function renderRoutineStats(routineId) {
     try {
-        const response = await fetch(`/api/analytics/routine/${routineId}`);
-        const data = await response.json();
+        const response = await apiGet(`/api/analytics/routine/${routineId}`);
+        const data = await readData(response);
 
         // Find or create stats container in modal
         let statsContainer = document.getElementById('modal-routine-stats');
@@ -991,7 +1204,7 @@ async function editRoutineNameInModal(id, currentTitle) {
         });
         if (response.ok) {
             // Refresh data
-            await fetchRoutines();
+            await refreshAfterWrite();
             // Update Modal Title
             detailModalTitle.textContent = newTitle;
             // Update onclick handler with new title
@@ -1014,7 +1227,7 @@ async function addSubtaskFromModal(routineId) {
         });
 
         if (response.ok) {
-            await fetchRoutines();
+            await refreshAfterWrite();
             // Refresh Modal
             const updatedRoutine = globalRoutines.find(r => r.id === routineId);
             renderModalSubtasks(updatedRoutine);
@@ -1031,7 +1244,7 @@ async function deleteSubtaskOnModal(subtaskId) {
             method: 'DELETE'
         });
         if (response.ok) {
-            await fetchRoutines();
+            await refreshAfterWrite();
             // Refresh Modal
             if (currentDetailRoutineId) {
                 const updatedRoutine = globalRoutines.find(r => r.id === currentDetailRoutineId);
@@ -1052,7 +1265,7 @@ async function toggleSubtaskInModal(subtaskId, date) {
         });
 
         if (response.ok) {
-            await fetchRoutines();
+            await refreshAfterWrite();
             // Refresh Modal
             if (currentDetailRoutineId) {
                 const updatedRoutine = globalRoutines.find(r => r.id === currentDetailRoutineId);
@@ -1106,7 +1319,7 @@ async function editRoutine(id, currentTitle) {
         });
 
         if (response.ok) {
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error updating routine:', error);
@@ -1126,7 +1339,7 @@ async function addSubtask(routineId) {
         });
 
         if (response.ok) {
-            fetchRoutines();
+            refreshAfterWrite();
         }
     } catch (error) {
         console.error('Error adding subtask:', error);
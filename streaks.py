@@ -0,0 +1,301 @@
+import heapq
+from datetime import date, timedelta
+from models import db, Routine, RoutineLog, RoutineStreak
+from archive import log_table
+
+# ストリーク (連続達成日数) の永続化と差分更新
+# RoutineStreak に「最新の完了日」と「その日で終わる連続日数」「最長記録」を保存しておき、
+# 読み取りは履歴の長さに関係なく O(1) で済ませる
+# 履歴を遡る計算はアーカイブ済みのログ (archive.py) も読む
+
+
+# day から step 方向 (-1: 過去へ, 1: 未来へ) に連続して完了している日数
+def _run_length(routine_id, day, step):
+    logs = log_table(RoutineLog, end=day) if step < 0 else log_table(RoutineLog, start=day)
+    query = db.session.query(logs.c.log_date).filter(
+        logs.c.routine_id == routine_id,
+        logs.c.completed == True
+    )
+    if step < 0:
+        query = query.filter(logs.c.log_date <= day).order_by(logs.c.log_date.desc())
+    else:
+        query = query.filter(logs.c.log_date >= day).order_by(logs.c.log_date)
+
+    run = 0
+    expected = day
+    for (log_date,) in query.yield_per(64):
+        if log_date != expected:
+            break
+        run += 1
+        expected = expected + timedelta(days=step)
+    return run
+
+
+# 完了日の昇順リストから (最新の完了日, その日で終わる連続日数, 最長記録) を求める
+def _scan(dates):
+    last = None
+    run = 0
+    longest = 0
+    for d in dates:
+        run = run + 1 if last is not None and d == last + timedelta(days=1) else 1
+        longest = max(longest, run)
+        last = d
+    return last, run, longest
+
+
+def _completed_dates(routine_id):
+    logs = log_table(RoutineLog)
+    rows = db.session.query(logs.c.log_date).filter(
+        logs.c.routine_id == routine_id,
+        logs.c.completed == True
+    ).order_by(logs.c.log_date)
+    return (log_date for (log_date,) in rows.yield_per(256))
+
+
+# day より前の最新の完了日 (無ければ None)
+def _previous_completed(routine_id, day):
+    logs = log_table(RoutineLog, end=day)
+    previous = db.session.query(logs.c.log_date).filter(
+        logs.c.routine_id == routine_id,
+        logs.c.log_date < day,
+        logs.c.completed == True
+    ).order_by(logs.c.log_date.desc()).first()
+    return previous[0] if previous else None
+
+
+# ストリークの差分更新で読むルーチン1つの完了状態
+# [start, end] の日は known ({日付: 完了かどうか}) を使い、それ以外の日はDBを読む
+# 一括トグルは変更した日の範囲を known にまとめて読み込み、変更を1件ずつ known に反映しながら差分更新する
+# 範囲の外はバッチで変わらないので、範囲の端から先の連続日数・直前の完了日は1回だけ読む
+# 範囲を持たない場合 (単体のトグル) は常にDBを読む
+class _CompletionView:
+    def __init__(self, routine_id, start=None, end=None, known=None):
+        self.routine_id = routine_id
+        self.start = start
+        self.end = end
+        self.known = known or {}
+        self._outside = {}
+
+    def _inside(self, day):
+        return self.start is not None and self.start <= day <= self.end
+
+    def _read_outside(self, key, read):
+        if key not in self._outside:
+            self._outside[key] = read()
+        return self._outside[key]
+
+    # day から step 方向 (-1: 過去へ, 1: 未来へ) に連続して完了している日数
+    # 範囲の外から数える場合は、範囲から離れる方向に数えること
+    def run_length(self, day, step):
+        run = 0
+        while self._inside(day):
+            if not self.known.get(day, False):
+                return run
+            run += 1
+            day += timedelta(days=step)
+        return run + self._read_outside(('run', day, step), lambda: _run_length(self.routine_id, day, step))
+
+    # day より前の最新の完了日 (無ければ None)
+    def previous(self, day):
+        if self.start is not None and day > self.start:
+            candidate = min(day - timedelta(days=1), self.end)
+            while candidate >= self.start:
+                if self.known.get(candidate, False):
+                    return candidate
+                candidate -= timedelta(days=1)
+            day = self.start
+        return self._read_outside(('previous', day), lambda: _previous_completed(self.routine_id, day))
+
+    # 全履歴の最長の連続日数 (最長記録の連続が分断された場合だけ読む)
+    def longest(self):
+        dates = _completed_dates(self.routine_id)
+        if self.start is None:
+            return _scan(dates)[2]
+        outside = (d for d in dates if not self._inside(d))
+        inside = sorted(d for d, completed in self.known.items() if completed and self._inside(d))
+        return _scan(heapq.merge(outside, inside))[2]
+
+
+# RoutineLog の履歴からストリーク状態を計算する (セッションには追加しない)
+def _compute_states(routine_ids=None):
+    logs = log_table(RoutineLog)
+    query = db.session.query(logs.c.routine_id, logs.c.log_date).filter(logs.c.completed == True)
+    if routine_ids is not None:
+        query = query.filter(logs.c.routine_id.in_(routine_ids))
+    query = query.order_by(logs.c.routine_id, logs.c.log_date)
+
+    dates_by_routine = {}
+    for routine_id, log_date in query.yield_per(1000):
+        dates_by_routine.setdefault(routine_id, []).append(log_date)
+
+    if routine_ids is None:
+        routine_ids = [rid for (rid,) in db.session.query(Routine.id)]
+
+    states = {}
+    for routine_id in routine_ids:
+        last, run, longest = _scan(dates_by_routine.get(routine_id, []))
+        states[routine_id] = RoutineStreak(
+            routine_id=routine_id,
+            last_completed=last,
+            current_run=run,
+            longest_streak=longest
+        )
+    return states
+
+
+# RoutineLog の履歴からストリーク状態を再構築して保存する (routine_ids 省略時は全ルーチン)
+def rebuild_streaks(routine_ids=None):
+    computed = _compute_states(routine_ids)
+    existing = {s.routine_id: s for s in RoutineStreak.query.filter(RoutineStreak.routine_id.in_(list(computed)))}
+    states = {}
+    for routine_id, fresh in computed.items():
+        state = existing.get(routine_id)
+        if state is None:
+            state = fresh
+            db.session.add(state)
+        else:
+            state.last_completed = fresh.last_completed
+            state.current_run = fresh.current_run
+            state.longest_streak = fresh.longest_streak
+        states[routine_id] = state
+    return states
+
+
+# ストリーク状態を持たないルーチン (既存DBからの移行直後など) の状態を作成する
+def backfill_missing_streaks():
+    missing = [rid for (rid,) in db.session.query(Routine.id).outerjoin(RoutineStreak).filter(RoutineStreak.routine_id == None)]
+    if missing:
+        rebuild_streaks(missing)
+    return missing
+
+
+def _get_state(routine_id):
+    state = db.session.get(RoutineStreak, routine_id)
+    if state is None:
+        state = rebuild_streaks([routine_id])[routine_id]
+    return state
+
+
+# ログの完了状態が変わった直後に呼ぶ (変更はセッションに反映済みであること)
+def update_streak(routine_id, day, completed):
+    db.session.flush()
+    return _apply_change(_get_state(routine_id), day, completed, _CompletionView(routine_id))
+
+
+# 複数のログの変更をまとめて反映する (一括トグル用、変更はセッションに反映済みであること)
+# changes: {(routine_id, day): 完了かどうか} (状態が変わったものだけ)
+# フラッシュ・ストリーク状態・変更した日の範囲の完了ログの読み込みは1回ずつ
+# ルーチンごとに、範囲を変更前の状態から始めて日付順に1件ずつ差分更新する (1件ずつトグルしたのと同じ結果になる)
+# 戻り値: {routine_id: 現在のストリーク}
+def update_streaks(changes):
+    db.session.flush()
+    by_routine = {}
+    for (routine_id, day), completed in sorted(changes.items()):
+        by_routine.setdefault(routine_id, []).append((day, completed))
+    states = {s.routine_id: s for s in RoutineStreak.query.filter(RoutineStreak.routine_id.in_(list(by_routine)))}
+    missing = [routine_id for routine_id in by_routine if routine_id not in states]
+    if missing:
+        # 状態が無かったルーチンは履歴から作る (今回の変更も含むので、差分は適用しない)
+        states.update(rebuild_streaks(missing))
+
+    start = min(day for _, day in changes)
+    end = max(day for _, day in changes)
+    logs = log_table(RoutineLog, start, end)
+    stored = {}
+    # 変更した日の範囲 (全ルーチン分) の完了ログ
+    for routine_id, log_date in db.session.query(logs.c.routine_id, logs.c.log_date).filter(
+        logs.c.routine_id.in_(list(by_routine)),
+        logs.c.log_date >= start,
+        logs.c.log_date <= end,
+        logs.c.completed == True
+    ):
+        stored.setdefault(routine_id, set()).add(log_date)
+
+    for routine_id, days in by_routine.items():
+        if routine_id in missing:
+            continue
+        start, end = days[0][0], days[-1][0]
+        known = {d: True for d in stored.get(routine_id, ()) if start <= d <= end}
+        for day, completed in days:
+            known[day] = not completed
+        view = _CompletionView(routine_id, start, end, known)
+        for day, completed in days:
+            known[day] = completed
+            _apply_change(states[routine_id], day, completed, view)
+    today = date.today()
+    return {routine_id: _current_from_state(states[routine_id], today) for routine_id in by_routine}
+
+
+def _apply_change(state, day, completed, view):
+    last = state.last_completed
+    run = state.current_run
+
+    if completed:
+        if last is None or day > last:
+            run = run + 1 if last is not None and day == last + timedelta(days=1) else 1
+            state.last_completed = day
+            state.current_run = run
+            state.longest_streak = max(state.longest_streak, run)
+        elif day < last - timedelta(days=run - 1):
+            # 現在の連続より前の日: その日を含む連続の長さを数える
+            containing = view.run_length(day, -1) + view.run_length(day + timedelta(days=1), 1)
+            if day == last - timedelta(days=run):
+                state.current_run = containing
+            state.longest_streak = max(state.longest_streak, containing)
+        return state
+
+    if last is None or day > last:
+        return state
+
+    # 取り消した日の前後に残った連続日数
+    left = view.run_length(day - timedelta(days=1), -1)
+    right = view.run_length(day + timedelta(days=1), 1)
+
+    if day == last:
+        # 最新の完了日を取り消した: 直前の完了日まで遡る
+        previous = view.previous(day)
+        if previous is None:
+            state.last_completed = None
+            state.current_run = 0
+        else:
+            state.last_completed = previous
+            state.current_run = view.run_length(previous, -1)
+    elif day > last - timedelta(days=run):
+        # 現在の連続の途中を取り消した: 連続は取り消した日の翌日から数え直し
+        state.current_run = (last - day).days
+
+    # 最長記録だった連続が分断された場合のみ全履歴から再計算する
+    if left + 1 + right >= state.longest_streak:
+        state.longest_streak = view.longest()
+    return state
+
+
+def _current_from_state(state, today):
+    last = state.last_completed
+    if last is None or last < today - timedelta(days=1):
+        return 0
+    if last <= today:
+        return state.current_run
+    # 未来日に完了がある場合のみ、今日 (未完了なら昨日) から数え直す
+    run = _run_length(state.routine_id, today, -1)
+    return run or _run_length(state.routine_id, today - timedelta(days=1), -1)
+
+
+# 今日 (未完了なら昨日) から遡った連続完了日数
+def current_streak(routine_id, today=None):
+    return _current_from_state(_get_state(routine_id), today or date.today())
+
+
+# 複数ルーチンの現在ストリークをまとめて取得する
+def current_streaks(routine_ids):
+    today = date.today()
+    states = {s.routine_id: s for s in RoutineStreak.query.filter(RoutineStreak.routine_id.in_(routine_ids))}
+    missing = [rid for rid in routine_ids if rid not in states]
+    if missing:
+        # 状態が未作成のルーチンは履歴から計算する (読み取り時は保存しない)
+        states.update(_compute_states(missing))
+    return {rid: _current_from_state(states[rid], today) for rid in routine_ids}
+
+
+def longest_streak(routine_id):
+    return _get_state(routine_id).longest_streak
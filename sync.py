@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, insert, select, update
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog, SyncState, SyncTombstone, DEFAULT_USER_ID
+from archive import log_table
+
+# 差分同期 (GET /api/sync?since=<seq>)
+# Routine / SubTask / RoutineLog / SubTaskLog の行は、最後に変更されたトランザクションの連番 (updated_seq) を持つ
+# 連番はトランザクションごとに1つ (SyncState.last_seq を1つ進める)。書き込みは直列なので、連番の順がコミット順になる
+# 削除は SyncTombstone に残す。ルーチン・サブタスクの削除で一緒に消える子の行は、親の墓標だけで表す
+# 墓標を整理した範囲の連番を指定された場合は、差分ではなく全件を返す (full: true)
+# ORM を通さない書き込み (インポート) は、_transaction_seq の連番を自分で updated_seq に入れる
+
+SYNCED_MODELS = (Routine, SubTask, RoutineLog, SubTaskLog)
+
+# 同期レスポンスの列 (各行は配列で返す。全件のレスポンスにだけ含める)
+COLUMNS = {
+    'routines': ['id', 'title', 'target_days', 'created_at'],
+    'subtasks': ['id', 'routine_id', 'title'],
+    'routine_logs': ['routine_id', 'date', 'completed'],
+    'subtask_logs': ['subtask_id', 'date', 'completed']
+}
+
+
+def _state_row(connection):
+    connection.execute(insert(SyncState).prefix_with('OR IGNORE').values(id=1, last_seq=0, full_sync_seq=0))
+
+
+# このトランザクションの連番 (最初の変更時に1回だけ進める)
+def _transaction_seq(session):
+    seq = session.info.get('sync_seq')
+    if seq is None:
+        connection = session.connection()
+        _state_row(connection)
+        connection.execute(update(SyncState).where(SyncState.id == 1).values(last_seq=SyncState.last_seq + 1))
+        seq = connection.execute(select(SyncState.last_seq).where(SyncState.id == 1)).scalar()
+        session.info['sync_seq'] = seq
+    return seq
+
+
+def _tombstones(session, deleted):
+    routine_ids = {obj.id for obj in deleted if isinstance(obj, Routine)}
+    subtask_ids = {obj.id for obj in deleted if isinstance(obj, SubTask)}
+    tombstones = []
+    for obj in deleted:
+        if isinstance(obj, Routine):
+            tombstones.append({'kind': 'routine', 'entity_id': obj.id, 'user_id': obj.user_id})
+        elif isinstance(obj, SubTask):
+            if obj.routine_id not in routine_ids:
+                tombstones.append({'kind': 'subtask', 'entity_id': obj.id, 'user_id': obj.user_id})
+        elif isinstance(obj, RoutineLog):
+            if obj.routine_id not in routine_ids:
+                tombstones.append({'kind': 'routine_log', 'entity_id': obj.routine_id, 'log_date': obj.log_date, 'user_id': obj.user_id})
+        elif obj.subtask_id not in subtask_ids:
+            subtask = session.get(SubTask, obj.subtask_id)
+            if subtask is not None and subtask.routine_id not in routine_ids:
+                tombstones.append({'kind': 'subtask_log', 'entity_id': obj.subtask_id, 'log_date': obj.log_date, 'user_id': obj.user_id})
+    return tombstones
+
+
+# フラッシュ前に、追加・変更された行へ連番を付け、削除された行の墓標を作る
+def _stamp_sync_seq(session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, SYNCED_MODELS)]
+    changed += [obj for obj in session.dirty if isinstance(obj, SYNCED_MODELS) and session.is_modified(obj)]
+    deleted = {obj for obj in session.deleted if isinstance(obj, SYNCED_MODELS)}
+    if not changed and not deleted:
+        return
+
+    seq = _transaction_seq(session)
+    for obj in changed:
+        obj.updated_seq = seq
+    now = datetime.utcnow()
+    with session.no_autoflush:
+        tombstones = _tombstones(session, deleted)
+    for tombstone in tombstones:
+        session.add(SyncTombstone(seq=seq, created_at=now, **tombstone))
+
+
+def _clear_sync_seq(session):
+    session.info.pop('sync_seq', None)
+
+
+# セッションのイベントは全アプリ共通なので、create_app を何度呼んでも1回だけ登録する
+def init_sync(app, db):
+    for name, listener in (('before_flush', _stamp_sync_seq), ('after_commit', _clear_sync_seq), ('after_rollback', _clear_sync_seq)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+
+
+def current_seq():
+    state = db.session.get(SyncState, 1)
+    return state.last_seq if state else 0
+
+
+# table の columns 列を、user_id のユーザーの行のうち since より後に変更されたものだけ読む ((user_id, updated_seq) のインデックスで読む)
+# 並びは order_by の列の順
+def _rows(table, columns, since, user_id, order_by):
+    query = db.session.query(*(table.c[name] for name in columns)).filter(table.c.user_id == user_id)
+    if since:
+        query = query.filter(table.c.updated_seq > since)
+    return query.order_by(*(table.c[name] for name in order_by))
+
+
+# 連番は全ユーザー共通なので、他のユーザーの変更で seq が進んでも差分は空になるだけ
+def sync_payload(since, user_id=DEFAULT_USER_ID):
+    state = db.session.get(SyncState, 1)
+    seq = state.last_seq if state else 0
+    full = since <= 0 or since > seq or (state is not None and since < state.full_sync_seq)
+    if full:
+        since = 0
+
+    routines = _rows(Routine.__table__, ['id', 'title', 'target_days', 'created_at'], since, user_id, ['id'])
+    subtasks = _rows(SubTask.__table__, ['id', 'routine_id', 'title'], since, user_id, ['id'])
+    # ログはアーカイブ済みの行も含める (アーカイブへの移動では updated_seq は変わらない)
+    routine_logs = _rows(log_table(RoutineLog), ['routine_id', 'log_date', 'completed'], since, user_id, ['routine_id', 'log_date'])
+    subtask_logs = _rows(log_table(SubTaskLog), ['subtask_id', 'log_date', 'completed'], since, user_id, ['subtask_id', 'log_date'])
+
+    payload = {
+        'seq': seq,
+        'full': full,
+        'routines': [[rid, title, target_days, created_at.isoformat() if created_at else None] for rid, title, target_days, created_at in routines],
+        'subtasks': [list(row) for row in subtasks],
+        'routine_logs': [[rid, d.isoformat(), bool(done)] for rid, d, done in routine_logs],
+        'subtask_logs': [[sid, d.isoformat(), bool(done)] for sid, d, done in subtask_logs],
+        'deleted': {'routines': [], 'subtasks': [], 'routine_logs': [], 'subtask_logs': []}
+    }
+    if full:
+        # 列の説明は全件のときだけ付ける (差分を小さくするため)
+        payload['columns'] = COLUMNS
+    else:
+        tombstones = SyncTombstone.query.filter(SyncTombstone.user_id == user_id, SyncTombstone.seq > since).order_by(SyncTombstone.id)
+        for tombstone in tombstones:
+            if tombstone.kind in ('routine', 'subtask'):
+                payload['deleted'][tombstone.kind + 's'].append(tombstone.entity_id)
+            else:
+                payload['deleted'][tombstone.kind + 's'].append([tombstone.entity_id, tombstone.log_date.isoformat()])
+    return payload
+
+
+# keep_days 日より古い墓標を削除する。削除した範囲より前からの同期は全件になる。戻り値: 削除件数
+def prune_tombstones(keep_days):
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    newest = db.session.query(func.max(SyncTombstone.seq)).filter(SyncTombstone.created_at < cutoff).scalar()
+    if newest is None:
+        return 0
+    deleted = SyncTombstone.query.filter(SyncTombstone.seq <= newest).delete()
+    _state_row(db.session.connection())
+    db.session.execute(update(SyncState).where(SyncState.id == 1).values(
+        full_sync_seq=func.max(SyncState.full_sync_seq, newest)
+    ))
+    return deleted
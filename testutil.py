@@ -0,0 +1,16 @@
+from app import app
+from cache import bump_data_version
+from models import db
+
+# 検証スクリプト (verify_*.py) 共通の手順
+# 各スクリプトは DATABASE_URL をメモリ上のDBにしてから import する (todos.db には触れない)
+# pytest に集められないよう、ファイル名・関数名は test で始めない
+
+
+# テーブルを作り直し、API を通さずに投入したデータも読ませるためレスポンスキャッシュを無効化する
+# flask_app: 既定は app.py のアプリ (設定を変えて create_app したアプリも渡せる)
+def reset_db(flask_app=app):
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    bump_data_version()
@@ -0,0 +1,230 @@
+from sqlalchemy import and_, func, select
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog
+from streaks import current_streak, update_streak, update_streaks
+from events import record_event
+from archive import restore_archived
+import rollups
+
+# ルーチン/サブタスクの完了状態の更新処理
+# 単体トグルAPIと一括トグルAPIで共通に使う (コミットは呼び出し側で行う)
+
+# 一括トグルで1リクエストに含められる操作数の上限
+MAX_BATCH_OPERATIONS = 1000
+
+# set_routine_log でログを未取得であることを表す (None は「ログが存在しない」)
+_UNLOADED = object()
+
+
+# ルーチンログの完了状態が変わったときに、派生データ (ストリーク・ロールアップ) を更新する
+def record_completion_change(routine_id, log_date, completed):
+    update_streak(routine_id, log_date, completed)
+    rollups.apply_completion_delta(routine_id, log_date, 1 if completed else -1)
+    record_event('routine_log', 'upsert', routine_id, {
+        'routine_id': routine_id,
+        'date': log_date.isoformat(),
+        'completed': completed,
+        'current_streak': current_streak(routine_id)
+    })
+
+
+# 複数のルーチンログの変更をまとめて派生データに反映する (一括トグル・親ルーチンの一括再計算用)
+# changes: {(routine_id, log_date): [変更前, 変更後]} (set_routine_log に渡して集めたもの)
+# ストリーク・ロールアップは1回のフラッシュの後にまとめて読み込み、(ルーチン, 日付) ごとに差分を適用する
+def record_completion_changes(changes):
+    changed = {key: after for key, (before, after) in changes.items() if before != after}
+    if not changed:
+        return
+    streaks = update_streaks(changed)
+    rollups.apply_completion_deltas({key: 1 if completed else -1 for key, completed in changed.items()})
+    for (routine_id, log_date), completed in sorted(changed.items()):
+        record_event('routine_log', 'upsert', routine_id, {
+            'routine_id': routine_id,
+            'date': log_date.isoformat(),
+            'completed': completed,
+            'current_streak': streaks[routine_id]
+        })
+
+
+# サブタスクログの完了状態が変わったときに、変更フィードを更新する
+def record_subtask_change(subtask_id, routine_id, log_date, completed):
+    record_event('subtask_log', 'upsert', subtask_id, {
+        'subtask_id': subtask_id,
+        'routine_id': routine_id,
+        'date': log_date.isoformat(),
+        'completed': completed
+    })
+
+
+# ルーチンログを指定の状態にする (ログが無く未完了を指定された場合は作成しない)
+# log を渡した場合は再取得しない (まとめて読み込んだログを使う場合)
+# changes を渡した場合は派生データを更新せずに変更を集める (最後に record_completion_changes で反映する。
+# 同じ日を何度変えても、最初の変更前と最後の変更後の状態だけが残る)
+# 戻り値: (ログ, 状態が変わったかどうか)
+def set_routine_log(routine_id, log_date, completed, log=_UNLOADED, changes=None):
+    if log is _UNLOADED:
+        log = RoutineLog.query.filter_by(routine_id=routine_id, log_date=log_date).first()
+    was_complete = bool(log and log.completed)
+    if log:
+        log.completed = completed
+    elif completed:
+        log = RoutineLog(routine_id=routine_id, log_date=log_date, completed=True)
+        db.session.add(log)
+
+    changed = was_complete != completed
+    if changes is not None:
+        changes.setdefault((routine_id, log_date), [was_complete, completed])[1] = completed
+    elif changed:
+        record_completion_change(routine_id, log_date, completed)
+    return log, changed
+
+
+# 親ルーチンのステータス判定：その日の全てのサブタスクが完了していればTrue
+# 複数の (ルーチン, 日付) を1回の集計クエリで判定する
+# サブタスクを持たないルーチンは判定の対象外 (結果に含めない)
+def compute_parent_completion(pairs):
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    routine_ids = {routine_id for routine_id, _ in pairs}
+    dates = {log_date for _, log_date in pairs}
+
+    sibling = db.aliased(SubTask)
+    total = select(func.count(sibling.id)).where(sibling.routine_id == SubTask.routine_id).scalar_subquery()
+    # サブタスク側から完了ログを外部結合し、(ルーチン, 日付) ごとの完了数を数える
+    # 完了ログが1件もないサブタスクは log_date が NULL の行にまとまる
+    rows = db.session.query(SubTask.routine_id, SubTaskLog.log_date, func.count(SubTaskLog.id), total).outerjoin(
+        SubTaskLog, and_(
+            SubTaskLog.subtask_id == SubTask.id,
+            SubTaskLog.log_date.in_(dates),
+            SubTaskLog.completed == True
+        )
+    ).filter(SubTask.routine_id.in_(routine_ids)).group_by(SubTask.routine_id, SubTaskLog.log_date)
+
+    totals = {}
+    done = {}
+    for routine_id, log_date, done_count, total_count in rows:
+        totals[routine_id] = total_count
+        if log_date is not None:
+            done[(routine_id, log_date)] = done_count
+
+    return {
+        (routine_id, log_date): done.get((routine_id, log_date), 0) == totals[routine_id]
+        for routine_id, log_date in pairs
+        if routine_id in totals
+    }
+
+
+# 親ルーチンのログをサブタスクの状態に合わせて更新する (トランザクション内で呼ぶ)
+# changes は set_routine_log と同じ (渡した場合は派生データの更新を呼び出し側でまとめて行う)
+# 戻り値: {(routine_id, log_date): 完了かどうか}
+def recompute_parent_completions(pairs, changes=None):
+    states = compute_parent_completion(pairs)
+    if not states:
+        return states
+
+    logs = RoutineLog.query.filter(
+        RoutineLog.routine_id.in_({routine_id for routine_id, _ in states}),
+        RoutineLog.log_date.in_({log_date for _, log_date in states})
+    )
+    logs = {(log.routine_id, log.log_date): log for log in logs}
+    for (routine_id, log_date), all_complete in states.items():
+        set_routine_log(routine_id, log_date, all_complete, logs.get((routine_id, log_date)), changes)
+    return states
+
+
+def recompute_parent_completion(routine_id, log_date):
+    return recompute_parent_completions([(routine_id, log_date)]).get((routine_id, log_date), False)
+
+
+# サブタスクログがある全ての (ルーチン, 日付) について親ルーチンの状態を再計算する
+# chunk_size 件ずつ処理する。戻り値: 再計算した組の数
+def recompute_all_parent_completions(chunk_size=500):
+    pairs = db.session.query(SubTask.routine_id, SubTaskLog.log_date).join(SubTask).distinct().order_by(
+        SubTask.routine_id, SubTaskLog.log_date
+    ).all()
+    for start in range(0, len(pairs), chunk_size):
+        changes = {}
+        recompute_parent_completions(pairs[start:start + chunk_size], changes)
+        record_completion_changes(changes)
+    return len(pairs)
+
+
+# 一括トグル: operations は検証済みの (kind, id, log_date, completed) のリスト
+# 反転ではなく指定状態への設定なので、同じ操作を何度送っても結果は変わらない
+# ログの変更を全て適用してから、派生データ (ストリーク・ロールアップ・変更フィード) をまとめて更新する
+# 戻り値: (各操作の結果, 再計算した親ルーチンの状態)
+def apply_toggle_batch(operations):
+    routine_ops = [op for op in operations if op[0] == 'routine']
+    subtask_ops = [op for op in operations if op[0] == 'subtask']
+
+    # 対象のサブタスクとルーチンをまとめて読み込み、処理が終わるまで参照を持っておく
+    # (新しいログの所有ユーザー・ロールアップのユーザーは、1件ずつ読まずにセッションから引ける)
+    subtasks = {}
+    if subtask_ops:
+        subtasks = {subtask.id: subtask for subtask in SubTask.query.filter(SubTask.id.in_({op[1] for op in subtask_ops}))}
+    subtask_parents = {subtask_id: subtask.routine_id for subtask_id, subtask in subtasks.items()}
+    routines = Routine.query.filter(Routine.id.in_({op[1] for op in routine_ops} | set(subtask_parents.values()))).all()
+    # アーカイブ済みの日付のログは先に元のテーブルに戻す
+    restore_archived([(op[1], op[2]) for op in routine_ops] + [(subtask_parents[op[1]], op[2]) for op in subtask_ops])
+
+    # 対象のログをまとめて読み込む
+    routine_logs = {}
+    if routine_ops:
+        rows = RoutineLog.query.filter(
+            RoutineLog.routine_id.in_({op[1] for op in routine_ops}),
+            RoutineLog.log_date.in_({op[2] for op in routine_ops})
+        )
+        routine_logs = {(log.routine_id, log.log_date): log for log in rows}
+
+    subtask_logs = {}
+    if subtask_ops:
+        rows = SubTaskLog.query.filter(
+            SubTaskLog.subtask_id.in_({op[1] for op in subtask_ops}),
+            SubTaskLog.log_date.in_({op[2] for op in subtask_ops})
+        )
+        subtask_logs = {(log.subtask_id, log.log_date): log for log in rows}
+
+    results = []
+    affected = {}
+    changes = {}
+    for kind, item_id, log_date, completed in operations:
+        if kind == 'routine':
+            key = (item_id, log_date)
+            routine_logs[key], _ = set_routine_log(item_id, log_date, completed, routine_logs.get(key), changes)
+        else:
+            key = (item_id, log_date)
+            log = subtask_logs.get(key)
+            if log:
+                changed = log.completed != completed
+                log.completed = completed
+            else:
+                changed = completed
+                if completed:
+                    subtask_logs[key] = SubTaskLog(subtask_id=item_id, log_date=log_date, completed=True)
+                    db.session.add(subtask_logs[key])
+            if changed:
+                record_subtask_change(item_id, subtask_parents[item_id], log_date, completed)
+                # 親ルーチンの再計算は (ルーチン, 日付) ごとに最後に1回だけ行う
+                affected[(subtask_parents[item_id], log_date)] = True
+        results.append({'kind': kind, 'id': item_id, 'date': log_date.isoformat(), 'completed': completed})
+
+    parents = [
+        {'routine_id': routine_id, 'date': log_date.isoformat(), 'completed': completed}
+        for (routine_id, log_date), completed in sorted(recompute_parent_completions(affected, changes).items())
+    ]
+    record_completion_changes(changes)
+    return results, parents
+
+
+# 一括トグル対象のIDが user_id のユーザーのものとして存在するか確認し、存在しないものを (kind, id) のリストで返す
+def find_missing_targets(operations, user_id):
+    routine_ids = {op[1] for op in operations if op[0] == 'routine'}
+    subtask_ids = {op[1] for op in operations if op[0] == 'subtask'}
+    missing = []
+    if routine_ids:
+        found = {rid for (rid,) in db.session.query(Routine.id).filter(Routine.id.in_(routine_ids), Routine.user_id == user_id)}
+        missing += [('routine', rid) for rid in sorted(routine_ids - found)]
+    if subtask_ids:
+        found = {sid for (sid,) in db.session.query(SubTask.id).filter(SubTask.id.in_(subtask_ids), SubTask.user_id == user_id)}
+        missing += [('subtask', sid) for sid in sorted(subtask_ids - found)]
+    return missing
@@ -0,0 +1,263 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog, DEFAULT_USER_ID
+from archive import discard_archived, log_table
+from cache import bump_data_version
+from events import record_event
+from sqlite_profile import write_transaction
+from streaks import rebuild_streaks
+from sync import _transaction_seq
+import rollups
+
+# 一括エクスポート・インポート (NDJSON / CSV)
+# NDJSON: 1行1件、"table" で種類を表す。全テーブルを親から順に (routines, subtasks, routine_logs, subtask_logs) 出力する
+# CSV: 1ファイル1テーブル、1行目は列名。インポート時は列名からテーブルを判定する
+# 読み出しは少しずつ (yield_per)、書き込みは IMPORT_CHUNK 件ごとに1トランザクションでまとめて行う
+# インポートは既存の行を上書きする (ルーチン・サブタスクは id、ログは (ID, 日付) の一意制約で判定)
+# どちらも1人のユーザーのデータだけを扱う。他のユーザーのルーチン・サブタスクの id は上書きも参照もできない
+
+# テーブル名: (モデル, 列, 上書き時の一意キー)
+TABLES = {
+    'routines': (Routine, ['id', 'title', 'target_days', 'created_at'], ['id']),
+    'subtasks': (SubTask, ['id', 'routine_id', 'title', 'created_at'], ['id']),
+    'routine_logs': (RoutineLog, ['routine_id', 'date', 'completed'], ['routine_id', 'log_date']),
+    'subtask_logs': (SubTaskLog, ['subtask_id', 'date', 'completed'], ['subtask_id', 'log_date']),
+}
+FORMATS = ('ndjson', 'csv')
+# インポートで受け付ける Content-Type (形式ごと)
+# 他のサイトのフォームから送れる種類 (text/plain など) は受け付けない (セッション Cookie つきで取り込まれないように)
+IMPORT_MIMETYPES = {
+    'ndjson': ('application/x-ndjson', 'application/json'),
+    'csv': ('text/csv',),
+}
+# 1回の読み出し件数と、1トランザクションで書き込む件数
+EXPORT_CHUNK = 5000
+IMPORT_CHUNK = 20000
+
+
+def _db_column(model, name):
+    return getattr(model, 'log_date' if name == 'date' else name)
+
+
+def _export_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+# ログはアーカイブ済みの行も含めて書き出す
+def iter_rows(table, user_id):
+    model, columns, keys = TABLES[table]
+    source = log_table(model) if model in (RoutineLog, SubTaskLog) else model.__table__
+    query = select(*[source.c[_db_column(model, name).key] for name in columns]).where(source.c.user_id == user_id)
+    query = query.order_by(*[source.c[_db_column(model, name).key] for name in keys])
+    for row in db.session.execute(query.execution_options(yield_per=EXPORT_CHUNK)):
+        yield [_export_value(value) for value in row]
+
+
+# エクスポートの本文を少しずつ返すジェネレータ (tables: 出力するテーブル名のリスト。CSV は1つだけ)
+def iter_export(fmt, tables, user_id=DEFAULT_USER_ID):
+    if fmt == 'csv':
+        table = tables[0]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(TABLES[table][1])
+        for index, row in enumerate(iter_rows(table, user_id), 1):
+            writer.writerow([int(value) if isinstance(value, bool) else value for value in row])
+            if index % EXPORT_CHUNK == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    for table in tables:
+        columns = TABLES[table][1]
+        lines = []
+        for row in iter_rows(table, user_id):
+            lines.append(current_app.json.dumps({'table': table, **dict(zip(columns, row))}) + '\n')
+            if len(lines) == EXPORT_CHUNK:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (1, '1', 'true', 'True'):
+        return True
+    if value in (0, '0', 'false', 'False'):
+        return False
+    raise ValueError(f'invalid completed value {value!r}')
+
+
+def _parse_int(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'invalid id {value!r}')
+    return int(value)
+
+
+def _parse_text(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError(f'invalid text {value!r}')
+    return value
+
+
+# 1件分の値を DB に書き込む形に変換する (不正な値は ValueError)
+def _convert(table, values):
+    if table in ('routines', 'subtasks'):
+        row = {'id': _parse_int(values['id']), 'title': _parse_text(values['title'])}
+        created_at = values.get('created_at')
+        row['created_at'] = datetime.fromisoformat(created_at) if created_at else datetime.utcnow()
+        if table == 'routines':
+            row['target_days'] = values.get('target_days') or '0,1,2,3,4,5,6'
+        else:
+            row['routine_id'] = _parse_int(values['routine_id'])
+        return row
+    owner = TABLES[table][1][0]
+    return {
+        owner: _parse_int(values[owner]),
+        'log_date': date.fromisoformat(values['date']),
+        'completed': _parse_bool(values['completed'])
+    }
+
+
+def _upsert_statement(table):
+    model, columns, keys = TABLES[table]
+    statement = insert(model)
+    updated = [_db_column(model, name).key for name in columns if _db_column(model, name).key not in keys] + ['updated_seq']
+    return statement.on_conflict_do_update(index_elements=keys, set_={name: statement.excluded[name] for name in updated})
+
+
+# テーブル: [(モデル, 所有者を確認する列, 存在しない id を許すか)]: 他のユーザーの行を指していないか確かめる
+# ルーチン・サブタスクは id そのもの (既存の行なら同じユーザーのものだけ上書きできる、無ければ新規作成)
+# サブタスク・ログは親の id (存在して、同じユーザーのものであること)
+OWNER_CHECKS = {
+    'routines': [(Routine, 'id', True)],
+    'subtasks': [(SubTask, 'id', True), (Routine, 'routine_id', False)],
+    'routine_logs': [(Routine, 'routine_id', False)],
+    'subtask_logs': [(SubTask, 'subtask_id', False)],
+}
+
+
+# インポートの書き込み (テーブルごとに件数を数える)
+class BulkImporter:
+    def __init__(self, chunk_size=None, user_id=DEFAULT_USER_ID):
+        self.chunk_size = chunk_size or IMPORT_CHUNK
+        self.user_id = user_id
+        self.pending = {table: [] for table in TABLES}
+        self.pending_count = 0
+        self.counts = {table: 0 for table in TABLES}
+
+    def add(self, table, values):
+        self.pending[table].append(_convert(table, values))
+        self.pending_count += 1
+        if self.pending_count >= self.chunk_size:
+            self.flush()
+
+    # rows が指す id のうち、他のユーザーのもの (ルーチン・サブタスクの上書き) か存在しないもの (親) があれば ValueError
+    def _check_owner(self, table, rows):
+        for model, column, allow_new in OWNER_CHECKS[table]:
+            ids = {row[column] for row in rows}
+            found = dict(db.session.query(model.id, model.user_id).filter(model.id.in_(ids)).all())
+            foreign = sorted(i for i in ids if found.get(i, self.user_id) != self.user_id)
+            if not allow_new:
+                foreign += sorted(i for i in ids if i not in found)
+            if foreign:
+                raise ValueError(f'{table}: {column} {foreign[0]} does not belong to this user')
+
+    # 溜まった行を1トランザクションで書き込む (ロックが取れなければ write_transaction が再試行する)
+    @write_transaction
+    def flush(self):
+        if not self.pending_count:
+            return
+        # ORM を通さない書き込みなので、このトランザクションの連番はここで付ける
+        # インポートは行を削除しないので、差分同期は updated_seq だけで取り込んだ行を返せる (全件にはしない)
+        seq = _transaction_seq(db.session)
+        # 親を先に書き込む (子の所有者の確認は、同じまとまりで書き込んだ親も含めて行う)
+        for table in TABLES:
+            rows = self.pending[table]
+            if rows:
+                self._check_owner(table, rows)
+                model, _, keys = TABLES[table]
+                if model in (RoutineLog, SubTaskLog):
+                    # アーカイブ済みの同じ日のログは上書きする行で置き換える
+                    discard_archived(model, [(row[keys[0]], row['log_date']) for row in rows])
+                db.session.execute(_upsert_statement(table), [dict(row, updated_seq=seq, user_id=self.user_id) for row in rows])
+        db.session.commit()
+        bump_data_version()
+        for table in TABLES:
+            self.counts[table] += len(self.pending[table])
+            self.pending[table] = []
+        self.pending_count = 0
+
+    # 派生データ (ストリーク・ロールアップ) を作り直し、開いているクライアントに全体の再取得を促す
+    @write_transaction
+    def finish(self):
+        if not any(self.counts.values()):
+            return
+        rebuild_streaks([rid for (rid,) in db.session.query(Routine.id).filter(Routine.user_id == self.user_id)])
+        rollups.rebuild_rollups(self.user_id)
+        record_event('reset', 'upsert', None, {'reason': 'import'})
+        db.session.commit()
+        bump_data_version()
+
+
+def _ndjson_records(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            values = json.loads(line)
+        except ValueError:
+            raise ValueError(f'line {number}: invalid JSON')
+        if not isinstance(values, dict) or values.get('table') not in TABLES:
+            raise ValueError(f'line {number}: unknown table')
+        yield number, values['table'], values
+
+
+def _csv_records(lines):
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    # Excel などが付ける BOM を取り除く
+    if header and header[0].startswith('\ufeff'):
+        header[0] = header[0][1:]
+    table = next((name for name, (_, columns, _) in TABLES.items() if columns == header), None)
+    if table is None:
+        raise ValueError('line 1: unknown CSV header')
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(header):
+            raise ValueError(f'line {reader.line_num}: expected {len(header)} columns')
+        yield reader.line_num, table, dict(zip(header, row))
+
+
+# lines (文字列の iterable) をインポートする。戻り値: (テーブルごとの件数, エラーメッセージまたは None)
+# エラーの行より前の書き込み済みのトランザクションは残る (上書きなので、直したファイルでやり直せる)
+def import_lines(lines, fmt, chunk_size=None, user_id=DEFAULT_USER_ID):
+    importer = BulkImporter(chunk_size, user_id)
+    error = None
+    records = _csv_records(lines) if fmt == 'csv' else _ndjson_records(lines)
+    try:
+        for number, table, values in records:
+            try:
+                importer.add(table, values)
+            except KeyError as exc:
+                raise ValueError(f'line {number}: missing {exc}')
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f'line {number}: {exc}')
+        importer.flush()
+    except ValueError as exc:
+        db.session.rollback()
+        error = str(exc)
+    finally:
+        importer.finish()
+    return importer.counts, error
@@ -0,0 +1,109 @@
+import hashlib
+import secrets
+from flask import current_app, g, has_request_context, jsonify, request, session
+from sqlalchemy import event
+from models import db, User, Routine, RoutineLog, SubTask, SubTaskLog, DEFAULT_USER_ID
+
+# ユーザー (アカウント) とリクエストのユーザーの解決
+# MULTI_USER が無効 (既定) の場合は認証せず、全リクエストを既定のユーザー (DEFAULT_USER_ID) として扱う
+# 有効な場合は Authorization: Bearer <トークン> か、POST /api/session で作ったセッション Cookie でユーザーを決める
+# ルーチン・サブタスク・ログはすべて user_id を持ち、読み取りAPIは必ずリクエストのユーザーで絞り込む
+
+# ユーザーが持つ行 (新しい行の user_id はフラッシュ前に自動で付ける)
+OWNED_MODELS = (Routine, SubTask, RoutineLog, SubTaskLog)
+# 認証なしで使えるパス (画面・静的ファイルと、トークンからセッションを作るAPI)
+PUBLIC_ENDPOINTS = ('main.index', 'main.create_session', 'main.asset', 'static')
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# ユーザーを作る (同じ名前のユーザーがいればトークンだけ作り直す)。戻り値: (ユーザー, トークン)
+# トークンは保存しないので、呼び出し側で表示する
+def issue_token(name):
+    token = secrets.token_urlsafe(32)
+    user = User.query.filter_by(name=name).first()
+    if user is None:
+        user = User(name=name)
+        db.session.add(user)
+    user.token_hash = hash_token(token)
+    return user, token
+
+
+def user_for_token(token):
+    if not token:
+        return None
+    return User.query.filter_by(token_hash=hash_token(token)).first()
+
+
+# 既定のユーザーの行を作る (シングルユーザーモードのデータと、移行前のデータの所有者)
+def ensure_default_user():
+    if db.session.get(User, DEFAULT_USER_ID) is not None:
+        return False
+    db.session.add(User(id=DEFAULT_USER_ID, name='default'))
+    return True
+
+
+# リクエストのユーザーID (リクエスト外、または未認証なら None)
+def request_user_id():
+    return g.get('user_id') if has_request_context() else None
+
+
+# データを読み書きするユーザーID (CLI などリクエスト外では既定のユーザー)
+def current_user_id():
+    user_id = request_user_id()
+    return DEFAULT_USER_ID if user_id is None else user_id
+
+
+# リクエストのヘッダ・セッションからユーザーIDを決める (見つからなければ None)
+def resolve_request_user():
+    if not current_app.config['MULTI_USER']:
+        return DEFAULT_USER_ID
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        user = user_for_token(auth[len('Bearer '):].strip())
+        return user.id if user else None
+    return session.get('user_id')
+
+
+def _load_user():
+    g.user_id = resolve_request_user()
+    if g.user_id is None and request.endpoint not in PUBLIC_ENDPOINTS:
+        return jsonify({'error': 'Authentication required'}), 401
+
+
+def _owner_of(session, obj):
+    if isinstance(obj, Routine):
+        return current_user_id()
+    if isinstance(obj, SubTask):
+        parent = obj.routine_rel or session.get(Routine, obj.routine_id)
+    elif isinstance(obj, RoutineLog):
+        parent = session.get(Routine, obj.routine_id)
+    else:
+        parent = session.get(SubTask, obj.subtask_id)
+    return parent.user_id
+
+
+# フラッシュ前に、新しい行へ所有ユーザーを付ける (サブタスク・ログは親と同じユーザー)
+def _assign_owner(session, flush_context, instances):
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, OWNED_MODELS) and obj.user_id is None:
+                obj.user_id = _owner_of(session, obj)
+
+
+# セッションのイベントは全アプリ共通なので、create_app を何度呼んでも1回だけ登録する
+def init_users(app, db):
+    app.before_request(_load_user)
+    if not event.contains(db.session, 'before_flush', _assign_owner):
+        event.listen(db.session, 'before_flush', _assign_owner)
+
+
+# リクエストのユーザーのルーチン・サブタスク (他のユーザーの行は存在しないものとして 404)
+def owned_routine_or_404(routine_id):
+    return Routine.query.filter_by(id=routine_id, user_id=current_user_id()).first_or_404()
+
+
+def owned_subtask_or_404(subtask_id):
+    return SubTask.query.filter_by(id=subtask_id, user_id=current_user_id()).first_or_404()
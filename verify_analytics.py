@@ -0,0 +1,171 @@
+import os
+import random
+from datetime import date, datetime, time, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from analytics import overall_analytics, routine_analytics, parse_target_days
+from models import db, Routine, RoutineLog, RoutineStreak, DailyRollup, MonthlyRollup
+import rollups
+from streaks import current_streak, longest_streak, rebuild_streaks
+
+TODAY = date.today()
+
+
+def seed(seed=11, routine_count=12):
+    rng = random.Random(seed)
+    patterns = ['0,1,2,3,4,5,6', '1,2,3,4,5', '0,6', '2', '', '1,3,5']
+    with app.app_context():
+        for i in range(routine_count):
+            created = TODAY - timedelta(days=rng.randint(0, 300))
+            routine = Routine(title=f'R{i}', target_days=patterns[i % len(patterns)], created_at=datetime.combine(created, time(9)))
+            db.session.add(routine)
+            db.session.flush()
+            for back in range(-3, 400):
+                # 作成日より前・未来日のログも含める
+                if rng.random() < 0.55:
+                    db.session.add(RoutineLog(routine_id=routine.id, log_date=TODAY - timedelta(days=back), completed=rng.random() < 0.9))
+        rebuild_streaks()
+        rollups.rebuild_rollups()
+        db.session.commit()
+
+
+def sun_weekday(day):
+    return int(day.strftime('%w'))
+
+
+# 1日ずつ数える参照実装
+def naive_rate(routines, completed, first, last):
+    done = total = 0
+    for routine in routines:
+        targets = parse_target_days(routine.target_days)
+        day = first
+        while day <= last:
+            if day >= routine.created_at.date() and sun_weekday(day) in targets:
+                total += 1
+                done += (routine.id, day) in completed
+            day += timedelta(days=1)
+    return int(done / total * 100) if total else 0
+
+
+def naive_count(completed, first, last, routine_id=None):
+    return sum(1 for rid, d in completed if first <= d <= last and (routine_id is None or rid == routine_id))
+
+
+def load_naive():
+    routines = Routine.query.all()
+    completed = {(log.routine_id, log.log_date) for log in RoutineLog.query.filter_by(completed=True)}
+    return routines, completed
+
+
+def test_bit_helpers():
+    assert parse_target_days('0, 2,9,x') == {0, 2}
+
+
+def test_overall_matches_naive():
+    reset_db()
+    seed()
+    with app.app_context():
+        data = overall_analytics(TODAY)
+        routines, completed = load_naive()
+        past = {(rid, d) for rid, d in completed if d <= TODAY}
+
+        assert data['total_completion_rate'] == naive_rate(routines, completed, TODAY - timedelta(days=29), TODAY)
+        assert data['active_streaks'] == sum(1 for r in routines if current_streak(r.id) > 0)
+
+        for item in data['completion_history']:
+            first = date.fromisoformat(item['month'] + '-01')
+            last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            assert item['count'] == naive_count(past, first, last), item
+
+        start_of_week = TODAY - timedelta(days=TODAY.weekday())
+        for i, item in zip(range(3, -1, -1), data['weekly_history']):
+            w_start = start_of_week - timedelta(weeks=i)
+            assert item['count'] == naive_count(past, w_start, w_start + timedelta(days=6)), item
+
+        day_counts = [0] * 7
+        for _, d in past:
+            if d >= TODAY - timedelta(days=180):
+                day_counts[sun_weekday(d)] += 1
+        assert data['day_distribution'] == day_counts
+
+        assert len(data['heatmap']) == 84 and data['heatmap'][-1]['date'] == TODAY.isoformat()
+        for item in data['heatmap']:
+            d = date.fromisoformat(item['date'])
+            assert item['count'] == naive_count(past, d, d), item
+
+
+# 件数はロールアップ、ストリークは RoutineStreak から読む (ログを全期間なめ直さない)
+def test_served_from_derived_tables():
+    reset_db()
+    seed(seed=4)
+    with app.app_context():
+        yesterday = (TODAY - timedelta(days=1)).isoformat()
+        old_month = (TODAY - timedelta(days=120)).isoformat()[:7]
+        routine = Routine.query.first()
+        db.session.get(DailyRollup, (1, yesterday)).completed_count = 99
+        db.session.get(MonthlyRollup, (1, old_month)).completed_count = 999
+        db.session.get(RoutineStreak, routine.id).longest_streak = 500
+        db.session.flush()
+
+        data = overall_analytics(TODAY)
+        assert data['heatmap'][-2] == {'date': yesterday, 'count': 99}
+        assert {'month': old_month, 'count': 999} in data['completion_history']
+        assert routine_analytics(routine, TODAY)['longest_streak'] == 500
+        db.session.rollback()
+
+
+def test_routine_matches_naive_and_streak_state():
+    reset_db()
+    seed(seed=21)
+    with app.app_context():
+        routines, completed = load_naive()
+        start_of_week = TODAY - timedelta(days=TODAY.weekday())
+        for routine in routines:
+            data = routine_analytics(routine, TODAY)
+            assert data['current_streak'] == current_streak(routine.id), routine.id
+            assert data['longest_streak'] == longest_streak(routine.id), routine.id
+            assert data['completion_rate'] == naive_rate([routine], completed, routine.created_at.date(), TODAY)
+            expected_trend = [
+                naive_count(completed, start_of_week - timedelta(weeks=i), start_of_week - timedelta(weeks=i) + timedelta(days=6), routine.id)
+                for i in range(3, -1, -1)
+            ]
+            assert data['weekly_trend'] == expected_trend, routine.id
+            targets = parse_target_days(routine.target_days)
+            for item in data['heatmap']:
+                d = date.fromisoformat(item['date'])
+                assert item['completed'] == ((routine.id, d) in completed)
+                assert item['scheduled'] == (d >= routine.created_at.date() and sun_weekday(d) in targets)
+
+
+def test_api_uses_scheduled_days():
+    reset_db()
+    client = app.test_client()
+    # 月曜のみのルーチンを3週間前に作成し、予定日 (月曜) をすべて完了する
+    created = TODAY - timedelta(days=21)
+    with app.app_context():
+        routine = Routine(title='Mondays', target_days='1', created_at=datetime.combine(created, time()))
+        db.session.add(routine)
+        db.session.commit()
+        routine_id = routine.id
+    day = created
+    while day <= TODAY:
+        if day.weekday() == 0:
+            client.post(f'/api/routines/{routine_id}/toggle', json={'date': day.isoformat()})
+        day += timedelta(days=1)
+    data = client.get(f'/api/analytics/routine/{routine_id}').get_json()
+    assert data['completion_rate'] == 100
+    assert data['title'] == 'Mondays'
+    assert client.get('/api/analytics/overall').get_json()['total_completion_rate'] == 100
+
+
+if __name__ == '__main__':
+    test_bit_helpers()
+    test_overall_matches_naive()
+    test_served_from_derived_tables()
+    test_routine_matches_naive_and_streak_state()
+    test_api_uses_scheduled_days()
+    print("\nALL ANALYTICS TESTS PASSED!")
@@ -0,0 +1,87 @@
+import os
+import tempfile
+from datetime import date
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import inspect
+from app import app, create_app
+from cache import response_cache
+from config import load_config
+from models import db, Routine, SyncTombstone
+
+TODAY = date.today().isoformat()
+
+
+def test_config_profiles():
+    assert load_config('production')['DEBUG'] is False
+    development = load_config('development')
+    assert development['DEBUG'] is True and development['INIT_DB_ON_STARTUP'] is True
+    assert load_config('testing')['TESTING'] is True
+    try:
+        load_config('staging')
+        assert False, 'unknown profile must fail'
+    except ValueError:
+        pass
+
+    # 環境変数はプロファイルの既定値より、create_app に渡した設定は環境変数より優先される
+    os.environ['FLASK_DEBUG'] = '0'
+    os.environ['EVENT_RETRY_MS'] = '500'
+    try:
+        config = load_config({'APP_ENV': 'development', 'EVENT_RETRY_MS': 100})
+        assert config['DEBUG'] is False and config['EVENT_RETRY_MS'] == 100
+        assert load_config('production')['EVENT_RETRY_MS'] == 500
+    finally:
+        del os.environ['FLASK_DEBUG'], os.environ['EVENT_RETRY_MS']
+    assert app.config['APP_ENV'] == 'production'
+    print("Config profiles: OK")
+
+
+def test_create_app_does_not_touch_database():
+    cache_size = response_cache.max_entries
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'factory.db')
+        factory_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        # アプリを作っただけでは接続しない (ファイルも作られない)
+        assert not os.path.exists(path)
+
+        runner = factory_app.test_cli_runner()
+        result = runner.invoke(args=['upgrade-db'])
+        assert result.exit_code == 0, result.output
+        with factory_app.app_context():
+            assert 'routine' in inspect(db.engine).get_table_names()
+        assert 'Schema is up to date.' in runner.invoke(args=['upgrade-db']).output
+
+        # アプリごとに別のDBを使う
+        client = factory_app.test_client()
+        assert client.post('/api/routines', json={'title': 'Isolated'}).status_code == 201
+        with factory_app.app_context():
+            assert Routine.query.count() == 1
+            db.engine.dispose()
+    response_cache.max_entries = cache_size
+    print("create_app does not touch the database: OK")
+
+
+def test_repeated_factories_register_listeners_once():
+    cache_size = response_cache.max_entries
+    with tempfile.TemporaryDirectory() as tmp:
+        for index in range(3):
+            factory_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, f'{index}.db'), 'INIT_DB_ON_STARTUP': True})
+        client = factory_app.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+        subtask_id = client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'S'}).get_json()['id']
+        client.post(f'/api/subtasks/{subtask_id}/toggle', json={'date': TODAY})
+        client.delete(f'/api/subtasks/{subtask_id}')
+        with factory_app.app_context():
+            assert SyncTombstone.query.count() == 1
+            db.engine.dispose()
+    response_cache.max_entries = cache_size
+    print("Listeners registered once: OK")
+
+
+if __name__ == '__main__':
+    test_config_profiles()
+    test_create_app_does_not_touch_database()
+    test_repeated_factories_register_listeners_once()
+    print("\nALL APP FACTORY TESTS PASSED!")
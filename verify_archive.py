@@ -0,0 +1,225 @@
+import os
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event, func, select
+from app import app
+from testutil import reset_db
+from archive import archive_table, archive_years, compact_logs, log_table
+from cache import bump_data_version
+from models import db, RoutineLog, SubTaskLog
+import rollups
+from streaks import longest_streak, rebuild_streaks
+
+TODAY = date.today()
+ARCHIVE_DAYS = 365
+# 境界より前の日付 (2年前・3年前の連続した数日) と直近の日付
+OLD_DATES = [TODAY - timedelta(days=730 + i) for i in range(4)] + [TODAY - timedelta(days=1100 + i) for i in range(3)]
+RECENT_DATES = [TODAY - timedelta(days=i) for i in range(3)]
+
+
+def make_data(client):
+    routine_id = client.post('/api/routines', json={'title': '読書'}).get_json()['id']
+    other_id = client.post('/api/routines', json={'title': '運動'}).get_json()['id']
+    subtask_id = client.post(f'/api/routines/{other_id}/subtasks', json={'title': 'ストレッチ'}).get_json()['id']
+    for day in OLD_DATES + RECENT_DATES:
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': day.isoformat()})
+        client.post(f'/api/subtasks/{subtask_id}/toggle', json={'date': day.isoformat()})
+    return routine_id, other_id, subtask_id
+
+
+def count_rows(model):
+    with app.app_context():
+        hot = db.session.query(func.count()).select_from(model).scalar()
+        total = db.session.query(func.count()).select_from(log_table(model)).scalar()
+    return hot, total
+
+
+# 読み取りAPIの結果 (アーカイブの前後で同じになるはず)
+def snapshot(client, routine_id):
+    bump_data_version()
+    old_year = OLD_DATES[-1].year
+    old_monday = OLD_DATES[0] - timedelta(days=OLD_DATES[0].weekday())
+    week_offset = (old_monday - (TODAY - timedelta(days=TODAY.weekday()))).days // 7
+    return {
+        'history': client.get(f'/api/routines/{routine_id}/history?year={old_year}').get_json(),
+        'all': client.get('/api/history/all').get_json(),
+        'page': client.get('/api/history/all?limit=3&from=2000-01-01').get_json(),
+        'board': client.get(f'/api/routines?offset={week_offset}').get_json()['routines'],
+        'analytics': client.get(f'/api/analytics/routine/{routine_id}').get_json(),
+        'sync': client.get('/api/sync').get_json(),
+        'export': client.get('/api/export').get_data(as_text=True),
+    }
+
+
+class archiving:
+    def __enter__(self):
+        app.config['ARCHIVE_AFTER_DAYS'] = ARCHIVE_DAYS
+
+    def __exit__(self, *args):
+        app.config['ARCHIVE_AFTER_DAYS'] = 0
+
+
+def test_compaction_is_resumable():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    with archiving(), app.app_context():
+        # 無効なら何もしない
+        app.config['ARCHIVE_AFTER_DAYS'] = 0
+        assert sum(compact_logs().values()) == 0
+        app.config['ARCHIVE_AFTER_DAYS'] = ARCHIVE_DAYS
+
+        # 1バッチで止めても、次の実行で続きから移す
+        assert compact_logs(batch_size=2, max_batches=1) == {'routine_log': 2, 'sub_task_log': 0}
+        assert compact_logs(batch_size=2) == {'routine_log': 2 * len(OLD_DATES) - 2, 'sub_task_log': len(OLD_DATES)}
+        assert sum(compact_logs().values()) == 0
+        assert archive_years(RoutineLog) == sorted({d.year for d in OLD_DATES})
+        archived = db.session.execute(select(func.count()).select_from(archive_table(SubTaskLog, OLD_DATES[0].year))).scalar()
+        assert archived == sum(1 for d in OLD_DATES if d.year == OLD_DATES[0].year)
+        # 直近の期間だけを読むなら元のテーブルそのもの
+        assert log_table(RoutineLog, TODAY - timedelta(days=30)) is RoutineLog.__table__
+        assert log_table(RoutineLog) is not RoutineLog.__table__
+    # サブタスクを持つルーチンは親ルーチンのログもある
+    with archiving():
+        assert count_rows(RoutineLog) == (2 * len(RECENT_DATES), 2 * (len(OLD_DATES) + len(RECENT_DATES)))
+        assert count_rows(SubTaskLog) == (len(RECENT_DATES), len(OLD_DATES) + len(RECENT_DATES))
+    print("Compaction is resumable: OK")
+
+
+def test_archived_logs_stay_readable():
+    reset_db()
+    client = app.test_client()
+    routine_id, _, _ = make_data(client)
+    with archiving():
+        before = snapshot(client, routine_id)
+        assert len(before['history']['completed_dates']) == 3
+        with app.app_context():
+            longest = longest_streak(routine_id)
+            compact_logs()
+        after = snapshot(client, routine_id)
+        assert after == before
+        # 次のページもアーカイブをまたいで続く
+        cursor = after['page']['next_cursor']
+        assert client.get(f'/api/history/all?limit=100&from=2000-01-01&cursor={cursor}').get_json()['items'] == before['all'][3:]
+
+        # 派生データの再構築・整合性の確認もアーカイブを含めて行う
+        with app.app_context():
+            rebuild_streaks()
+            assert longest_streak(routine_id) == longest == 4
+            assert rollups.check_rollups() == []
+            rollups.rebuild_rollups()
+            assert rollups.check_rollups() == []
+            db.session.commit()
+    print("Archived logs stay readable: OK")
+
+
+def test_hot_path_is_unchanged():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+
+    def statements(url):
+        bump_data_version()
+        executed = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            assert client.get(url).status_code == 200
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return executed
+
+    urls = ['/api/routines?offset=0', '/api/analytics/overall']
+    plain = {url: statements(url) for url in urls}
+    with archiving():
+        with app.app_context():
+            compact_logs()
+        for url in urls:
+            archived = statements(url)
+            assert archived == plain[url], url
+            assert not any('archive' in statement for statement in archived)
+    print("Hot path is unchanged: OK")
+
+
+def test_writes_to_archived_days():
+    reset_db()
+    client = app.test_client()
+    routine_id, other_id, subtask_id = make_data(client)
+    old_day = OLD_DATES[0].isoformat()
+    with archiving():
+        with app.app_context():
+            compact_logs()
+        # アーカイブ済みの日を取り消すと、その日のログは元のテーブルに戻ってから更新される
+        response = client.post(f'/api/routines/{routine_id}/toggle', json={'date': old_day}).get_json()
+        assert response == {'date': old_day, 'completed': False}
+        response = client.post(f'/api/subtasks/{subtask_id}/toggle', json={'date': old_day}).get_json()
+        assert response['completed'] is False and response['parent_routine_completed'] is False
+        batch = client.post('/api/toggles/batch', json={'operations': [
+            {'kind': 'subtask', 'id': subtask_id, 'date': OLD_DATES[1].isoformat(), 'completed': False}
+        ]}).get_json()
+        assert batch['parent_routines'] == [{'routine_id': other_id, 'date': OLD_DATES[1].isoformat(), 'completed': False}]
+        with app.app_context():
+            hot = {(log.routine_id, log.log_date) for log in RoutineLog.query}
+            assert {(routine_id, OLD_DATES[0]), (other_id, OLD_DATES[0]), (other_id, OLD_DATES[1])} <= hot
+            logs = log_table(RoutineLog)
+            # 同じ日のログは元のテーブルとアーカイブの両方には無い
+            keys = db.session.query(logs.c.routine_id, logs.c.log_date).all()
+            assert len(keys) == len(set(keys))
+            assert rollups.check_rollups() == []
+        history = client.get(f'/api/routines/{routine_id}/history?year={OLD_DATES[0].year}').get_json()
+        assert old_day not in history['completed_dates']
+
+        # 戻したログも次の実行でまたアーカイブされる
+        with app.app_context():
+            assert compact_logs() == {'routine_log': 3, 'sub_task_log': 2}
+
+        # ルーチンを削除するとアーカイブ済みのログも消える
+        assert client.delete(f'/api/routines/{other_id}').status_code == 200
+        with app.app_context():
+            assert rollups.check_rollups() == []
+        assert count_rows(SubTaskLog) == (0, 0)
+        assert count_rows(RoutineLog)[1] == len(OLD_DATES) + len(RECENT_DATES)
+
+        # インポートで上書きしたアーカイブ済みの日のログは1件だけになる
+        line = f'{{"table": "routine_logs", "routine_id": {routine_id}, "date": "{OLD_DATES[2].isoformat()}", "completed": false}}\n'
+        assert client.post('/api/import', data=line.encode(), content_type='application/x-ndjson').get_json()['imported']['routine_logs'] == 1
+        assert count_rows(RoutineLog)[1] == len(OLD_DATES) + len(RECENT_DATES)
+        history = client.get(f'/api/routines/{routine_id}/history?year={OLD_DATES[2].year}').get_json()
+        assert OLD_DATES[2].isoformat() not in history['completed_dates']
+    print("Writes to archived days: OK")
+
+
+def test_cli_commands():
+    reset_db()
+    client = app.test_client()
+    routine_id, _, _ = make_data(client)
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['compact-logs']).exit_code != 0
+    with archiving():
+        before = snapshot(client, routine_id)
+        result = runner.invoke(args=['compact-logs', '--batch-size', '3', '--pause', '0'])
+        assert result.exit_code == 0 and "'routine_log': 14" in result.output
+        result = runner.invoke(args=['unarchive-logs'])
+        assert result.exit_code == 0 and "'sub_task_log': 7" in result.output
+        with app.app_context():
+            assert archive_years(RoutineLog) == [] and archive_years(SubTaskLog) == []
+        assert count_rows(RoutineLog) == (2 * (len(OLD_DATES) + len(RECENT_DATES)),) * 2
+    assert snapshot(client, routine_id) == before
+    print("CLI compact/unarchive: OK")
+
+
+if __name__ == '__main__':
+    test_compaction_is_resumable()
+    test_archived_logs_stay_readable()
+    test_hot_path_is_unchanged()
+    test_writes_to_archived_days()
+    test_cli_commands()
+    print("\nALL ARCHIVE TESTS PASSED!")
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from flask import Flask, Response, request
+from app import app, create_app
+from testutil import reset_db
+from asgi import AsyncApplication, RESPONSE_QUEUE_SIZE
+from models import db, Routine, RoutineLog
+
+TODAY = date.today()
+
+
+# メモリ上のDBは1本の接続を共有するので、読み取りも1スレッドで動かす
+def make_application():
+    return AsyncApplication(app, read_threads=1)
+
+
+# ASGI アプリを直接呼び、(ステータス, ヘッダ, 本文) を返す
+async def call(application, method, path, body=None, headers=(), query=b'', disconnect_after=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    request_headers = [(b'host', b'testserver')] + [(k.encode(), v.encode()) for k, v in headers]
+    if body is not None:
+        request_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': query, 'headers': request_headers,
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)
+    }
+    messages = [{'type': 'http.request', 'body': payload, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is not None:
+            await asyncio.sleep(disconnect_after)
+            return {'type': 'http.disconnect'}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert sent[-1].get('more_body', False) is False
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_matches_flask_responses():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'S'})
+    application = make_application()
+
+    async def run():
+        status, headers, body = await call(application, 'GET', '/api/routines', query=b'offset=0')
+        assert status == 200 and headers[b'content-type'] == b'application/json'
+        assert json.loads(body) == client.get('/api/routines?offset=0').get_json()
+        status, _, body = await call(application, 'PUT', f'/api/routines/{routine_id}', body={'title': 'Renamed'})
+        assert status == 200 and json.loads(body)['title'] == 'Renamed'
+        status, _, _ = await call(application, 'POST', '/api/routines/999/toggle', body={'date': TODAY.isoformat()})
+        assert status == 404
+    asyncio.run(run())
+    print("ASGI responses match Flask: OK")
+
+
+def test_writes_go_through_single_writer():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    application = make_application()
+    assert application.executor_for({'method': 'GET'}) is application.readers
+    assert application.executor_for({'method': 'POST'}) is application.writer
+    assert application.executor_for({'method': 'DELETE'}) is application.writer
+
+    async def run():
+        days = [(TODAY - timedelta(days=i)).isoformat() for i in range(20)]
+        toggles = [call(application, 'POST', f'/api/routines/{routine_id}/toggle', body={'date': d}) for d in days]
+        # 同時に送ったトグルも書き込みスレッドで1件ずつ処理される
+        results = await asyncio.gather(*toggles)
+        assert [status for status, _, _ in results] == [200] * 20
+    asyncio.run(run())
+    with app.app_context():
+        assert RoutineLog.query.filter_by(completed=True).count() == 20
+    print("Single writer lane: OK")
+
+
+# ストリームの読み取りスレッドと書き込みスレッドが同時にDBを使うので、接続を共有しないファイルのDBで動かす
+def test_event_stream_wakes_on_write():
+    with tempfile.TemporaryDirectory() as tmp:
+        streaming = create_app({'APP_ENV': 'testing', 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'asgi.db')})
+        try:
+            check_event_stream(streaming)
+        finally:
+            with streaming.app_context():
+                db.engine.dispose()
+    print("Event stream wakes on write: OK")
+
+
+def check_event_stream(flask_app):
+    routine_id = flask_app.test_client().post('/api/routines', json={'title': 'R'}).get_json()['id']
+    # ASGI モードはストリーム中にスレッドを占有しないので、変更フィードを配信する
+    assert flask_app.config['EVENT_STREAM'] is False
+    application = AsyncApplication(flask_app)
+    assert flask_app.config['EVENT_STREAM'] is True
+    flask_app.config['EVENT_STREAM_TIMEOUT'] = 5
+    flask_app.config['EVENT_POLL_SECONDS'] = 5
+
+    async def run():
+        stream = asyncio.ensure_future(call(application, 'GET', '/api/events', disconnect_after=1))
+        await asyncio.sleep(0.2)
+        status, _, _ = await call(application, 'POST', f'/api/routines/{routine_id}/toggle', body={'date': TODAY.isoformat()})
+        assert status == 200
+        status, headers, body = await stream
+        assert status == 200 and headers[b'content-type'].startswith(b'text/event-stream')
+        # ポーリング間隔 (5秒) を待たずに、切断 (1秒) までに変更が届いている
+        assert b'event: change' in body and b'"kind":"routine_log"' in body
+
+        status, _, body = await call(application, 'GET', '/api/events', query=b'after=abc')
+        assert status == 400 and json.loads(body) == {'error': 'Invalid event id'}
+    asyncio.run(run())
+
+
+# 本文は Flask が読む分だけ受け取る (全体を読み終える前にアプリが動き始める)
+def test_request_body_is_streamed():
+    chunks = [bytes([65 + i]) * 65536 for i in range(6)]
+    received = []
+    reads = []
+    echo = Flask('echo')
+
+    @echo.route('/upload', methods=['POST'])
+    def upload():
+        total = 0
+        while True:
+            data = request.stream.read(65536)
+            if not data:
+                break
+            reads.append(len(received))
+            total += len(data)
+        return {'bytes': total}
+
+    application = AsyncApplication(echo, read_threads=1)
+
+    async def run():
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+
+        async def receive():
+            received.append(messages[0])
+            return messages.pop(0)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        # Content-Length の無い (chunked の) 本文
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'POST', 'path': '/upload', 'query_string': b'',
+                 'headers': [(b'content-type', b'application/octet-stream')]}
+        await application(scope, receive, send)
+        return json.loads(b''.join(m.get('body', b'') for m in sent[1:]))
+    assert asyncio.run(run()) == {'bytes': 6 * 65536}
+    # 最初の読み取りの時点では、まだ最初のメッセージしか受け取っていない
+    assert reads[0] == 1 and reads == sorted(reads) and len(received) == len(chunks)
+    print("Request body is streamed: OK")
+
+
+# レスポンスは上限つきのキューで渡す (送信が遅くても Flask のスレッドが先に全体を作り溜めない)
+def test_response_queue_is_bounded():
+    produced = []
+    closed = threading.Event()
+    slow = Flask('slow')
+
+    @slow.route('/chunks')
+    def chunks():
+        def generate():
+            try:
+                for i in range(100):
+                    produced.append(i)
+                    yield b'x' * 1024
+            finally:
+                closed.set()
+        return Response(generate())
+
+    application = AsyncApplication(slow, read_threads=1)
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': '/chunks', 'query_string': b'', 'headers': []}
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def run():
+        ahead = []
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                await asyncio.sleep(0.001)
+                ahead.append(len(produced) - len(ahead))
+        await application(scope, receive, send)
+        return ahead
+    ahead = asyncio.run(run())
+    assert len(ahead) == 101 and max(ahead) <= RESPONSE_QUEUE_SIZE + 2
+    assert closed.is_set()
+
+    # クライアントへの送信に失敗しても、Flask のスレッドはキューの空きを待ったまま止まらない
+    produced.clear()
+    closed.clear()
+
+    async def broken():
+        async def send(message):
+            if message['type'] == 'http.response.body' and len(produced) > 3:
+                raise OSError('client went away')
+        try:
+            await application(scope, receive, send)
+        except OSError:
+            return True
+    assert asyncio.run(broken())
+    assert closed.wait(2)
+    print("Response queue is bounded: OK")
+
+
+# 途中で切れたインポートは書き込まない (切断も、Content-Length より短く終わった本文も ClientDisconnected で 400)
+def test_truncated_import_is_not_committed():
+    reset_db()
+    application = make_application()
+    line = json.dumps({'table': 'routines', 'id': 1, 'title': 'Imported'}).encode() + b'\n'
+
+    async def upload(messages, content_length=None):
+        headers = [(b'content-type', b'application/x-ndjson')]
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'POST', 'path': '/api/import', 'query_string': b'', 'headers': headers}
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        await application(scope, receive, send)
+        return sent[0]['status']
+
+    async def run():
+        disconnect = {'type': 'http.disconnect'}
+        # 100000 バイトと宣言して最初の1行だけ送り、切断する
+        assert await upload([{'type': 'http.request', 'body': line, 'more_body': True}, disconnect], 100000) == 400
+        # 宣言より短いまま本文が終わる
+        assert await upload([{'type': 'http.request', 'body': line, 'more_body': False}], len(line) + 10) == 400
+        # Content-Length の無い本文の途中で切断する
+        assert await upload([{'type': 'http.request', 'body': line, 'more_body': True}, disconnect]) == 400
+        # 最後まで届いた本文は書き込む
+        assert await upload([{'type': 'http.request', 'body': line, 'more_body': False}], len(line)) == 200
+    asyncio.run(run())
+    with app.app_context():
+        assert [r.title for r in Routine.query] == ['Imported']
+    print("Truncated import is not committed: OK")
+
+
+def test_lifespan():
+    application = make_application()
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(application({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    print("Lifespan: OK")
+
+
+if __name__ == '__main__':
+    test_matches_flask_responses()
+    test_writes_go_through_single_writer()
+    test_event_stream_wakes_on_write()
+    test_request_body_is_streamed()
+    test_response_queue_is_bounded()
+    test_truncated_import_is_not_committed()
+    test_lifespan()
+    print("\nALL ASGI TESTS PASSED!")
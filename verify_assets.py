@@ -0,0 +1,132 @@
+import gzip
+import json
+import os
+import tempfile
+import brotli
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, create_app
+from assets import build_assets, minify, IMMUTABLE_CACHE
+
+
+def test_minify_keeps_literals():
+    js = '''// コメント
+const a = 'x  //  y';   /* ブロック */
+const b = `line1
+    ${items.map(i => `<li class="${i}">  ${i + 1}</li>`).join('')}  end`;
+const c = a
+    .replace(/\\/\\/ +/g, "");
+let d = e - -f
+'''
+    out = minify(js, 'js')
+    assert "const a='x  //  y';" in out
+    assert '`line1\n    ${items.map(i=>`<li class="${i}">  ${i + 1}</li>`).join(\'\')}  end`' in out
+    assert '.replace(/\\/\\/ +/g,"")' in out
+    # 記号で終わらない行の改行は残す (セミコロンの自動挿入)。+ と - の前後の空白も残す
+    assert 'const c=a\n.replace' in out and 'e - -f' in out
+    assert 'コメント' not in out and 'ブロック' not in out
+
+    # キーワードの後ろの / も正規表現 (中の空白・引用符はそのまま)。プロパティ名や値の後ろの / は除算
+    js = '''function f(s) {
+    if (typeof /x/ === 'object') return /a  b/.test(s)
+    switch (s) { case /["]/.test(s): return obj.return / 2 }
+}
+const after   =   total / 2 / count
+'''
+    out = minify(js, 'js')
+    assert 'typeof/x/===' in out and 'return/a  b/.test(s)' in out and 'case/["]/.test(s)' in out
+    assert 'obj.return/2' in out and out.endswith('const after=total/2/count\n')
+
+    css = '''/* 色 */
+.a .b > .c ,
+.d:hover {
+    color: red ;
+    margin: 0 auto;
+}
+'''
+    assert minify(css, 'css') == '.a .b > .c,.d:hover{color:red;margin:0 auto;}\n'
+    print("Minify keeps literals: OK")
+
+
+def test_build_and_serve():
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = build_assets(app.static_folder, tmp)
+        assert set(manifest) == {'script.js', 'style.css'}
+        assert manifest['script.js'].startswith('script.') and manifest['script.js'].endswith('.js')
+        with open(os.path.join(tmp, 'manifest.json')) as f:
+            assert json.load(f) == manifest
+        # どのファイルも gzip 版と brotli 版を作る
+        for name in manifest.values():
+            assert os.path.exists(os.path.join(tmp, name + '.gz')) and os.path.exists(os.path.join(tmp, name + '.br')), name
+        # 同じ内容なら同じ名前・同じ圧縮ファイルになる
+        with open(os.path.join(tmp, manifest['script.js'] + '.gz'), 'rb') as f:
+            compressed = f.read()
+        assert build_assets(app.static_folder, tmp) == manifest
+        with open(os.path.join(tmp, manifest['script.js'] + '.gz'), 'rb') as f:
+            assert f.read() == compressed
+
+        built = create_app({'APP_ENV': 'testing', 'ASSET_DIR': tmp})
+        client = built.test_client()
+        page = client.get('/').get_data(as_text=True)
+        assert f'/assets/{manifest["script.js"]}' in page and f'/assets/{manifest["style.css"]}' in page
+
+        url = f'/assets/{manifest["script.js"]}'
+        plain = client.get(url)
+        assert plain.status_code == 200 and 'Content-Encoding' not in plain.headers
+        assert plain.headers['Cache-Control'] == IMMUTABLE_CACHE and plain.headers['Vary'] == 'Accept-Encoding'
+        zipped = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        assert zipped.headers['Content-Encoding'] == 'gzip' and zipped.mimetype == 'text/javascript'
+        assert gzip.decompress(zipped.data) == plain.data
+        assert len(zipped.data) < len(plain.data) / 3
+        # br を受け付けるなら .br を返す (gzip と並んでいても br を優先する)
+        for accept in ('br', 'gzip, deflate, br'):
+            compressed = client.get(url, headers={'Accept-Encoding': accept})
+            assert compressed.headers['Content-Encoding'] == 'br' and compressed.mimetype == 'text/javascript', accept
+            assert compressed.headers['Vary'] == 'Accept-Encoding'
+            assert brotli.decompress(compressed.data) == plain.data
+        assert len(compressed.data) < len(zipped.data)
+        styles = client.get(f'/assets/{manifest["style.css"]}', headers={'Accept-Encoding': 'br'})
+        assert styles.headers['Content-Encoding'] == 'br' and styles.mimetype == 'text/css'
+        # 再検証しても本文は送らない
+        assert client.get(url, headers={'If-None-Match': plain.headers['ETag']}).status_code == 304
+
+        # マニフェストに無いファイル・古いビルドのファイルは返さない
+        assert client.get('/assets/manifest.json').status_code == 404
+        assert client.get('/assets/script.000000000000.js').status_code == 404
+        assert client.get('/assets/../app.py').status_code == 404
+
+    # ビルドしていない (または BUILT_ASSETS=0 の) 場合は static/ の元のファイルを使う
+    with tempfile.TemporaryDirectory() as tmp:
+        page = create_app({'APP_ENV': 'testing', 'ASSET_DIR': tmp}).test_client().get('/').get_data(as_text=True)
+        assert '/static/script.js' in page and '/static/style.css' in page
+    print("Build and serve assets: OK")
+
+
+def test_rebuild_removes_only_built_files():
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as tmp:
+        for name in ('script.js', 'style.css'):
+            with open(os.path.join(source, name), 'w') as f:
+                f.write('a { color: red; }\n' if name.endswith('.css') else 'let a = 1\n')
+        # ASSET_DIR が元のファイルの置き場所でも、ビルドしたファイル以外は消さない
+        for name in ('keep.txt', 'script.js'):
+            with open(os.path.join(tmp, name), 'w') as f:
+                f.write(name)
+        first = build_assets(source, tmp)
+        with open(os.path.join(source, 'script.js'), 'w') as f:
+            f.write('let a = 2\n')
+        second = build_assets(source, tmp)
+        assert second['script.js'] != first['script.js'] and second['style.css'] == first['style.css']
+        expected = {'keep.txt', 'script.js', 'manifest.json'}
+        for name in second.values():
+            expected |= {name, name + '.gz', name + '.br'}
+        assert set(os.listdir(tmp)) == expected
+    print("Rebuild removes only built files: OK")
+
+
+if __name__ == '__main__':
+    test_minify_keeps_literals()
+    test_build_and_serve()
+    test_rebuild_removes_only_built_files()
+    print("\nALL ASSET TESTS PASSED!")
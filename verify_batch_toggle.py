@@ -0,0 +1,186 @@
+import json
+import os
+import random
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app
+from testutil import reset_db
+from models import db, ChangeEvent, RoutineLog, RoutineStreak, SubTaskLog
+import rollups
+from streaks import _compute_states, current_streak
+
+
+def setup_routines(client):
+    plain_id = client.post('/api/routines', json={'title': 'Plain'}).get_json()['id']
+    parent_id = client.post('/api/routines', json={'title': 'Parent'}).get_json()['id']
+    sub_ids = [
+        client.post(f'/api/routines/{parent_id}/subtasks', json={'title': f'Sub {i}'}).get_json()['id']
+        for i in range(3)
+    ]
+    return plain_id, parent_id, sub_ids
+
+
+def test_week_fill_in_one_transaction():
+    reset_db()
+    client = app.test_client()
+    plain_id, parent_id, sub_ids = setup_routines(client)
+    today = date.today()
+    week = [(today - timedelta(days=i)).isoformat() for i in range(7)]
+    operations = [{'kind': 'routine', 'id': plain_id, 'date': d, 'completed': True} for d in week]
+    operations += [{'kind': 'subtask', 'id': sid, 'date': d, 'completed': True} for sid in sub_ids for d in week]
+
+    commits = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, 'commit', listener)
+    try:
+        r = client.post('/api/toggles/batch', json={'operations': operations})
+    finally:
+        event.remove(engine, 'commit', listener)
+    assert r.status_code == 200, r.get_json()
+    assert len(commits) == 1, commits
+
+    data = r.get_json()
+    assert all(item['completed'] for item in data['results'])
+    # 親ルーチンは (ルーチン, 日付) ごとに1回だけ再計算される
+    assert sorted(p['date'] for p in data['parent_routines']) == sorted(week)
+    assert all(p['completed'] and p['routine_id'] == parent_id for p in data['parent_routines'])
+
+    with app.app_context():
+        assert RoutineLog.query.filter_by(completed=True).count() == 14
+        assert rollups.check_rollups() == []
+        for routine_id in (plain_id, parent_id):
+            assert current_streak(routine_id) == 7
+            rebuilt = _compute_states([routine_id])[routine_id]
+            assert rebuilt.longest_streak == 7
+
+
+def test_set_semantics_are_idempotent():
+    reset_db()
+    client = app.test_client()
+    plain_id, parent_id, sub_ids = setup_routines(client)
+    d = date.today().isoformat()
+    operations = [
+        {'kind': 'routine', 'id': plain_id, 'date': d, 'completed': True},
+        {'kind': 'subtask', 'id': sub_ids[0], 'date': d, 'completed': True},
+    ]
+    first = client.post('/api/toggles/batch', json={'operations': operations}).get_json()
+    second = client.post('/api/toggles/batch', json={'operations': operations}).get_json()
+    assert first['results'] == second['results']
+    # 2回目は状態が変わらないので親ルーチンの再計算も発生しない
+    assert first['parent_routines'] == [{'routine_id': parent_id, 'date': d, 'completed': False}]
+    assert second['parent_routines'] == []
+
+    with app.app_context():
+        assert RoutineLog.query.filter_by(routine_id=plain_id, completed=True).count() == 1
+        assert SubTaskLog.query.filter_by(completed=True).count() == 1
+
+    # 未完了への設定も同様
+    operations = [{'kind': 'routine', 'id': plain_id, 'date': d, 'completed': False}] * 2
+    data = client.post('/api/toggles/batch', json={'operations': operations}).get_json()
+    assert [item['completed'] for item in data['results']] == [False, False]
+    with app.app_context():
+        assert RoutineLog.query.filter_by(routine_id=plain_id, completed=True).count() == 0
+        assert rollups.check_rollups() == []
+
+
+def test_invalid_batch_applies_nothing():
+    reset_db()
+    client = app.test_client()
+    plain_id, parent_id, sub_ids = setup_routines(client)
+    d = date.today().isoformat()
+    valid = {'kind': 'routine', 'id': plain_id, 'date': d, 'completed': True}
+
+    r = client.post('/api/toggles/batch', json={'operations': [valid, {'kind': 'routine', 'id': plain_id, 'date': 'bad', 'completed': True}]})
+    assert r.status_code == 400
+    r = client.post('/api/toggles/batch', json={'operations': [valid, {'kind': 'subtask', 'id': 9999, 'date': d, 'completed': True}]})
+    assert r.status_code == 404
+    assert r.get_json()['missing'] == [{'kind': 'subtask', 'id': 9999}]
+    r = client.post('/api/toggles/batch', json={'operations': []})
+    assert r.status_code == 400
+
+    with app.app_context():
+        assert RoutineLog.query.count() == 0
+
+
+# 一括トグルで発行された INSERT 以外の SQL の数 (読み込み・更新はバッチの大きさに関係なく一定)
+def count_batch_statements(client, operations):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith('INSERT INTO'):
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        r = client.post('/api/toggles/batch', json={'operations': operations})
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert r.status_code == 200, r.get_json()
+    return len(statements)
+
+
+def test_statement_count_independent_of_batch_size():
+    today = date.today()
+    counts = []
+    for routines, days in ((1, 1), (20, 10)):
+        reset_db()
+        client = app.test_client()
+        routine_ids = [client.post('/api/routines', json={'title': f'R{i}'}).get_json()['id'] for i in range(routines)]
+        operations = [
+            {'kind': 'routine', 'id': routine_id, 'date': (today - timedelta(days=back)).isoformat(), 'completed': True}
+            for routine_id in routine_ids for back in range(days)
+        ]
+        counts.append(count_batch_statements(client, operations))
+    print(f"Batch statement counts: {counts}")
+    assert counts[0] == counts[1], counts
+
+
+# チェックと取り消しが混ざったバッチでも、ストリーク・ロールアップは履歴から作り直したものと一致する
+def test_mixed_batches_match_rebuilt_state():
+    reset_db()
+    client = app.test_client()
+    plain_ids = [client.post('/api/routines', json={'title': f'R{i}'}).get_json()['id'] for i in range(3)]
+    extra_id, parent_id, sub_ids = setup_routines(client)
+    plain_ids.append(extra_id)
+    rng = random.Random(5)
+    today = date.today()
+    for _ in range(30):
+        operations = []
+        for _ in range(rng.randint(1, 40)):
+            d = (today + timedelta(days=rng.randint(-20, 2))).isoformat()
+            if rng.random() < 0.25:
+                operations.append({'kind': 'subtask', 'id': rng.choice(sub_ids), 'date': d, 'completed': rng.random() < 0.7})
+            else:
+                operations.append({'kind': 'routine', 'id': rng.choice(plain_ids), 'date': d, 'completed': rng.random() < 0.65})
+        assert client.post('/api/toggles/batch', json={'operations': operations}).status_code == 200
+
+        with app.app_context():
+            assert rollups.check_rollups() == []
+            routine_ids = plain_ids + [parent_id]
+            rebuilt = _compute_states(routine_ids)
+            for state in RoutineStreak.query:
+                expected = rebuilt[state.routine_id]
+                assert (state.last_completed, state.current_run, state.longest_streak) == \
+                    (expected.last_completed, expected.current_run, expected.longest_streak), state.routine_id
+            # 変更フィードの最後のイベントのストリークは現在の値
+            latest = {}
+            for e in ChangeEvent.query.filter_by(kind='routine_log').order_by(ChangeEvent.id):
+                latest[e.entity_id] = json.loads(e.payload)['current_streak']
+            assert latest == {routine_id: current_streak(routine_id) for routine_id in latest}
+
+
+if __name__ == '__main__':
+    test_week_fill_in_one_transaction()
+    test_set_semantics_are_idempotent()
+    test_invalid_batch_applies_nothing()
+    test_statement_count_independent_of_batch_size()
+    test_mixed_batches_match_rebuilt_state()
+    print("\nALL BATCH TOGGLE TESTS PASSED!")
@@ -0,0 +1,88 @@
+import os
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from bench_api import build_scenarios, compare_results, measure_payloads, percentile, run_benchmarks
+from dataset import generate_dataset
+from models import db, RoutineLog, RoutineStreak, SubTask
+import rollups
+from streaks import _compute_states
+from toggles import compute_parent_completion
+
+
+def test_dataset_is_reproducible_and_consistent():
+    counts = []
+    for _ in range(2):
+        reset_db()
+        with app.app_context():
+            counts.append(generate_dataset(routines=8, subtasks_per_routine=2, years=0.5, parent_ratio=0.5, seed=7))
+            db.session.commit()
+    assert counts[0] == counts[1]
+    assert counts[0]['routines'] == 8 and counts[0]['subtasks'] > 0 and counts[0]['routine_logs'] > 0
+
+    with app.app_context():
+        assert rollups.check_rollups() == []
+        stored = {s.routine_id: (s.last_completed, s.current_run, s.longest_streak) for s in RoutineStreak.query}
+        rebuilt = {rid: (s.last_completed, s.current_run, s.longest_streak) for rid, s in _compute_states().items()}
+        assert stored == rebuilt
+        # 親ルーチンのログはサブタスクの状態と一致している
+        parent_ids = {rid for (rid,) in db.session.query(SubTask.routine_id).distinct()}
+        days = [date.today() - timedelta(days=i) for i in range(60)]
+        states = compute_parent_completion([(rid, d) for rid in parent_ids for d in days])
+        done = {(log.routine_id, log.log_date) for log in RoutineLog.query.filter(
+            RoutineLog.routine_id.in_(parent_ids), RoutineLog.completed == True)}
+        for key, complete in states.items():
+            assert complete == (key in done), key
+
+
+def test_benchmark_covers_routes_and_restores_toggles():
+    reset_db()
+    with app.app_context():
+        generate_dataset(routines=6, subtasks_per_routine=2, years=0.3, parent_ratio=0.5, seed=1)
+        db.session.commit()
+        scenarios = build_scenarios(app, 4)
+        batch_id = scenarios['POST /api/toggles/batch (7 days)'][0][2]['operations'][0]['id']
+        # 単体トグルは2回ずつ行うので、一括トグルの対象以外のログは元に戻る
+        before = {(log.routine_id, log.log_date, log.completed) for log in RoutineLog.query if log.routine_id != batch_id}
+
+    results = run_benchmarks(app, iterations=4, warmup=2)
+    assert set(results) == set(scenarios)
+    for name, result in results.items():
+        assert result['iterations'] >= 2, name
+        assert 0 < result['p50_ms'] <= result['p90_ms'] <= result['p99_ms'] <= result['max_ms'], (name, result)
+        assert result['statements_per_request'] > 0, name
+
+    with app.app_context():
+        after = {(log.routine_id, log.log_date, log.completed) for log in RoutineLog.query if log.routine_id != batch_id}
+        assert {row for row in after if row[2]} == {row for row in before if row[2]}
+        assert rollups.check_rollups() == []
+
+    # GET のシナリオごとに形式・圧縮ごとのサイズを出す (gzip は常に使える)
+    payloads = measure_payloads(app, repeat=2)
+    assert set(payloads) == {name for name, requests in scenarios.items() if requests[0][0] == 'GET'}
+    board = payloads['GET /api/routines?offset=0']
+    assert board['json']['bytes'] > board['json+gzip']['bytes'] > 0
+    assert board['json']['provider_ms'] >= 0 and board['json+gzip']['encode_ms'] >= 0
+
+
+def test_compare_flags_regressions():
+    assert percentile([1, 2, 3, 4], 0.5) == 2.5
+    baseline = {'results': {'a': {'p50_ms': 10, 'statements_per_request': 5}, 'b': {'p50_ms': 10, 'statements_per_request': 5}}}
+    current = {'results': {'a': {'p50_ms': 11, 'statements_per_request': 5}, 'b': {'p50_ms': 30, 'statements_per_request': 5},
+                           'c': {'p50_ms': 1, 'statements_per_request': 1}}}
+    rows, regressions = compare_results(current, baseline, max_regression=1.2)
+    assert [row['scenario'] for row in rows] == ['a', 'b']
+    assert [row['scenario'] for row in regressions] == ['b']
+    current['results']['a']['statements_per_request'] = 6
+    assert [row['scenario'] for row in compare_results(current, baseline)[1]] == ['a', 'b']
+
+
+if __name__ == '__main__':
+    test_dataset_is_reproducible_and_consistent()
+    test_benchmark_covers_routes_and_restores_toggles()
+    test_compare_flags_regressions()
+    print("\nALL BENCHMARK TESTS PASSED!")
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import tempfile
+from datetime import date
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app, create_app
+from testutil import reset_db
+from cache import response_cache
+from models import db
+
+
+def count_statements(func):
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return len(statements), result
+
+
+def test_past_week_is_served_from_cache():
+    reset_db()
+    client = app.test_client()
+    client.post('/api/routines', json={'title': 'R'})
+    first_count, first = count_statements(lambda: client.get('/api/routines?offset=-3'))
+    second_count, second = count_statements(lambda: client.get('/api/routines?offset=-3'))
+    assert first.headers['X-Cache'] == 'MISS' and second.headers['X-Cache'] == 'HIT'
+    assert first_count > 0 and second_count == 0, (first_count, second_count)
+    assert first.get_data() == second.get_data()
+    assert first.headers['ETag'] == second.headers['ETag'] and first.headers['ETag'].startswith('W/')
+
+
+def test_if_none_match_returns_304():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    for url in ('/api/routines?offset=0', '/api/analytics/overall', f'/api/analytics/routine/{routine_id}'):
+        etag = client.get(url).headers['ETag']
+        r = client.get(url, headers={'If-None-Match': etag})
+        assert r.status_code == 304, url
+        assert r.get_data() == b''
+    assert client.get('/api/analytics/routine/9999').status_code == 404
+
+
+def test_writes_invalidate_cached_responses():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    today = date.today().isoformat()
+    before = client.get('/api/routines?offset=0')
+    before_analytics = client.get(f'/api/analytics/routine/{routine_id}').get_json()
+
+    client.post(f'/api/routines/{routine_id}/toggle', json={'date': today})
+    after = client.get('/api/routines?offset=0', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200 and after.headers['X-Cache'] == 'MISS'
+    logs = after.get_json()['routines'][0]['week_logs']
+    assert {'date': today, 'completed': True} in logs
+    assert client.get(f'/api/analytics/routine/{routine_id}').get_json()['current_streak'] == before_analytics['current_streak'] + 1
+
+    # 変更がなければ再計算後も同じ ETag になる
+    client.put(f'/api/routines/{routine_id}', json={'title': 'R'})
+    again = client.get('/api/routines?offset=0')
+    assert again.headers['X-Cache'] == 'MISS' and again.headers['ETag'] == after.headers['ETag']
+
+
+def test_lru_bound_and_counters():
+    reset_db()
+    client = app.test_client()
+    client.post('/api/routines', json={'title': 'R'})
+    original = response_cache.max_entries
+    response_cache.max_entries = 3
+    try:
+        start = response_cache.stats()
+        for offset in range(5):
+            client.get(f'/api/routines?offset=-{offset}')
+        assert response_cache.stats()['entries'] == 3
+        # 最近使った offset は残り、古いものは追い出されている
+        assert client.get('/api/routines?offset=-4').headers['X-Cache'] == 'HIT'
+        assert client.get('/api/routines?offset=-0').headers['X-Cache'] == 'MISS'
+        stats = response_cache.stats()
+        assert stats['hits'] - start['hits'] == 1
+        assert stats['misses'] - start['misses'] == 6
+    finally:
+        response_cache.max_entries = original
+
+
+# 他のプロセス (別のワーカー・CLI コマンド) がDBを書き換えたら、キャッシュを使わずに読み直す
+def test_external_writes_invalidate_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.db')
+        worker = create_app({'APP_ENV': 'testing', 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        client = worker.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'before'}).get_json()['id']
+        first = client.get('/api/routines?offset=0')
+        assert client.get('/api/routines?offset=0').headers['X-Cache'] == 'HIT'
+
+        other = sqlite3.connect(path)
+        other.execute('UPDATE routine SET title = ? WHERE id = ?', ('after', routine_id))
+        other.commit()
+        other.close()
+
+        response = client.get('/api/routines?offset=0', headers={'If-None-Match': first.headers['ETag']})
+        assert response.status_code == 200 and response.headers['X-Cache'] == 'MISS'
+        assert response.get_json()['routines'][0]['title'] == 'after'
+        assert client.get('/api/routines?offset=0').headers['X-Cache'] == 'HIT'
+        with worker.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    test_past_week_is_served_from_cache()
+    test_if_none_match_returns_304()
+    test_writes_invalidate_cached_responses()
+    test_lru_bound_and_counters()
+    test_external_writes_invalidate_cache()
+    print("\nALL CACHE TESTS PASSED!")
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from cache import bump_data_version
+from events import event_notifier, prune_events
+from models import db, ChangeEvent
+
+# ストリームを配信する構成 (ASGI モード・開発用サーバー) として検証する
+app.config['EVENT_STREAM'] = True
+TODAY = date.today().isoformat()
+
+
+# SSE の本文を (id, event, data) のリストにする (コメント行と retry は読み飛ばす)
+def parse_sse(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = {}
+        for line in block.split('\n'):
+            if line.startswith(':') or ': ' not in line:
+                continue
+            name, value = line.split(': ', 1)
+            fields[name] = value
+        if 'event' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def read_stream(client, **kwargs):
+    app.config['EVENT_STREAM_TIMEOUT'] = 0.05
+    response = client.get('/api/events', **kwargs)
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.startswith('retry: ')
+    return parse_sse(body)
+
+
+def make_changes(client):
+    routine_id = client.post('/api/routines', json={'title': 'Parent'}).get_json()['id']
+    subtask_id = client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'Sub'}).get_json()['id']
+    client.post(f'/api/subtasks/{subtask_id}/toggle', json={'date': TODAY})
+    client.put(f'/api/routines/{routine_id}', json={'title': 'Renamed'})
+    return routine_id, subtask_id
+
+
+def test_mutations_are_streamed_in_order():
+    reset_db()
+    client = app.test_client()
+    routine_id, subtask_id = make_changes(client)
+
+    events = read_stream(client, query_string={'after': 0})
+    ids = [event_id for event_id, _, _ in events]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    changes = [(item['kind'], item['action'], item['entity_id']) for _, name, item in events if name == 'change']
+    assert changes == [
+        ('routine', 'upsert', routine_id),
+        ('subtask', 'upsert', subtask_id),
+        ('subtask_log', 'upsert', subtask_id),
+        ('routine_log', 'upsert', routine_id),
+        ('routine', 'upsert', routine_id)
+    ]
+    routine_log = events[3][2]['data']
+    assert routine_log == {'routine_id': routine_id, 'date': TODAY, 'completed': True, 'current_streak': 1}
+    assert events[2][2]['data']['routine_id'] == routine_id
+    assert events[4][2]['data']['title'] == 'Renamed'
+
+    # 名前が変わらない更新ではイベントを出さない
+    client.put(f'/api/routines/{routine_id}', json={'title': 'Renamed'})
+    client.delete(f'/api/subtasks/{subtask_id}')
+    client.delete(f'/api/routines/{routine_id}')
+    later = read_stream(client, query_string={'after': ids[-1]})
+    assert [(item['kind'], item['action']) for _, _, item in later] == [('subtask', 'delete'), ('routine', 'delete')]
+    print("Mutations streamed in order: OK")
+
+
+def test_resume_from_last_event_id():
+    reset_db()
+    client = app.test_client()
+    make_changes(client)
+    events = read_stream(client, query_string={'after': 0})
+
+    # Last-Event-ID ヘッダ (再接続) は after より優先される
+    resumed = read_stream(client, headers={'Last-Event-ID': str(events[2][0])}, query_string={'after': 0})
+    assert [e[0] for e in resumed] == [e[0] for e in events[3:]]
+    # 再開位置を指定しなければ過去のイベントは送らない
+    assert read_stream(client) == []
+    assert client.get('/api/events?after=abc').status_code == 400
+
+    # ボードは再開位置を返す
+    board = client.get('/api/routines?offset=0').get_json()
+    assert board['last_event_id'] == events[-1][0]
+    print("Resume from Last-Event-ID: OK")
+
+
+def test_failed_writes_record_nothing():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    with app.app_context():
+        before = ChangeEvent.query.count()
+    response = client.post('/api/toggles/batch', json={'operations': [
+        {'kind': 'routine', 'id': routine_id, 'date': TODAY, 'completed': True},
+        {'kind': 'subtask', 'id': 999, 'date': TODAY, 'completed': True}
+    ]})
+    assert response.status_code == 404
+    client.post('/api/toggles/batch', json={'operations': [
+        {'kind': 'routine', 'id': routine_id, 'date': TODAY, 'completed': False}
+    ]})
+    with app.app_context():
+        assert ChangeEvent.query.count() == before
+    print("Failed writes record nothing: OK")
+
+
+def test_expired_events_send_reset():
+    reset_db()
+    client = app.test_client()
+    make_changes(client)
+    with app.app_context():
+        ChangeEvent.query.update({'created_at': datetime.utcnow() - timedelta(days=30)})
+        deleted = prune_events(7)
+        db.session.commit()
+        remaining = [e.id for e in ChangeEvent.query]
+    # 最新の1件は残る
+    assert deleted == 4 and len(remaining) == 1
+
+    events = read_stream(client, headers={'Last-Event-ID': '1'})
+    assert [(event_id, name) for event_id, name, _ in events] == [(remaining[0], 'reset')]
+    # 別のDBの連番 (最新より大きい) も全体の取り直しになる
+    assert read_stream(client, query_string={'after': 1000})[0][1] == 'reset'
+    # 続きから読めるなら reset は送らない
+    assert read_stream(client, query_string={'after': remaining[0]}) == []
+    print("Expired events send reset: OK")
+
+
+def test_commits_wake_waiting_streams():
+    reset_db()
+    client = app.test_client()
+    client.post('/api/routines', json={'title': 'R'})
+
+    generation = event_notifier.generation
+    # イベントを含まないコミットでは起こさない
+    client.put('/api/routines/1', json={'title': 'R'})
+    assert event_notifier.generation == generation
+
+    woke = []
+    waiter = threading.Thread(target=lambda: woke.append(event_notifier.wait(generation, 5)))
+    started = time.monotonic()
+    waiter.start()
+    client.post('/api/routines/1/toggle', json={'date': TODAY})
+    waiter.join()
+    assert woke[0] != generation and time.monotonic() - started < 2
+    print("Commits wake waiting streams: OK")
+
+
+# 同期ワーカーの構成 (EVENT_STREAM 無効) ではストリームを開かず、ボードも接続しないよう知らせる
+def test_disabled_without_event_stream():
+    reset_db()
+    client = app.test_client()
+    app.config['EVENT_STREAM'] = False
+    try:
+        bump_data_version()
+        assert client.get('/api/routines?offset=0').get_json()['event_stream'] is False
+        assert client.get('/api/routines?weeks=2').get_json()['event_stream'] is False
+        response = client.get('/api/events?after=0')
+        assert response.status_code == 404 and response.mimetype == 'application/json'
+    finally:
+        app.config['EVENT_STREAM'] = True
+        bump_data_version()
+    assert client.get('/api/routines?offset=0').get_json()['event_stream'] is True
+    print("Disabled without EVENT_STREAM: OK")
+
+
+if __name__ == '__main__':
+    test_mutations_are_streamed_in_order()
+    test_resume_from_last_event_id()
+    test_failed_writes_record_nothing()
+    test_expired_events_send_reset()
+    test_commits_wake_waiting_streams()
+    test_disabled_without_event_stream()
+    print("\nALL EVENT TESTS PASSED!")
@@ -0,0 +1,105 @@
+import os
+import json
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from models import db, Routine, RoutineLog
+from history import history_query, decode_cursor
+
+TODAY = date.today()
+
+
+def seed():
+    reset_db()
+    with app.app_context():
+        for i in range(3):
+            routine = Routine(title=f'R{i}')
+            db.session.add(routine)
+            db.session.flush()
+            for back in range(60):
+                # 4日に1日は未完了のログを残す
+                db.session.add(RoutineLog(routine_id=routine.id, log_date=TODAY - timedelta(days=back), completed=back % 4 != 0))
+        db.session.commit()
+
+
+def expected_rows(start=None, end=None, routine_id=None, completed_only=True):
+    with app.app_context():
+        logs = db.session.query(RoutineLog, Routine.title).join(Routine).all()
+        rows = [
+            {'date': log.log_date.isoformat(), 'routine_id': log.routine_id, 'title': title, 'completed': log.completed}
+            for log, title in sorted(logs, key=lambda pair: (pair[0].log_date, pair[0].id), reverse=True)
+            if (start is None or log.log_date >= start) and (end is None or log.log_date <= end)
+            and (routine_id is None or log.routine_id == routine_id) and (log.completed or not completed_only)
+        ]
+    return rows
+
+
+def test_legacy_array_only_completed():
+    seed()
+    client = app.test_client()
+    r = client.get('/api/history/all')
+    assert r.is_streamed
+    assert json.loads(r.get_data()) == expected_rows()
+    data = client.get('/api/history/all?completed_only=0').get_json()
+    assert data == expected_rows(completed_only=False)
+
+
+def test_date_range_and_routine_filters():
+    seed()
+    client = app.test_client()
+    start, end = TODAY - timedelta(days=20), TODAY - timedelta(days=10)
+    data = client.get(f'/api/history/all?from={start}&to={end}&routine_id=2').get_json()
+    assert data == expected_rows(start=start, end=end, routine_id=2)
+    assert data and all(start.isoformat() <= item['date'] <= end.isoformat() for item in data)
+    assert client.get('/api/history/all?from=2024-13-01').status_code == 400
+
+
+def test_keyset_pages_cover_everything_once():
+    seed()
+    client = app.test_client()
+    items = []
+    url = '/api/history/all?limit=7&completed_only=0'
+    cursor = None
+    while True:
+        data = client.get(url + (f'&cursor={cursor}' if cursor else '')).get_json()
+        assert len(data['items']) <= 7
+        items += data['items']
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert items == expected_rows(completed_only=False)
+    assert client.get('/api/history/all?limit=5&cursor=bad').status_code == 400
+
+
+def test_ndjson_stream():
+    seed()
+    client = app.test_client()
+    r = client.get(f'/api/history/all?format=ndjson&from={TODAY - timedelta(days=30)}')
+    assert r.is_streamed
+    assert r.mimetype == 'application/x-ndjson'
+    lines = r.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == expected_rows(start=TODAY - timedelta(days=30))
+
+
+def test_keyset_query_uses_index():
+    seed()
+    with app.app_context():
+        query = history_query(start=TODAY - timedelta(days=30), end=TODAY, cursor=decode_cursor(f'{TODAY}:50')).limit(20)
+        compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {compiled}')).fetchall()
+        details = [row[-1] for row in plan]
+    log_plans = [d for d in details if 'routine_log' in d]
+    assert log_plans and all(d.startswith('SEARCH') and 'INDEX' in d for d in log_plans), details
+
+
+if __name__ == '__main__':
+    test_legacy_array_only_completed()
+    test_date_range_and_routine_filters()
+    test_keyset_pages_cover_everything_once()
+    test_ndjson_stream()
+    test_keyset_query_uses_index()
+    print("\nALL HISTORY TESTS PASSED!")
@@ -0,0 +1,119 @@
+import os
+import logging
+import re
+from datetime import date
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app
+from instrumentation import route_metrics
+from models import db
+import testutil
+
+
+def reset_db():
+    testutil.reset_db()
+    route_metrics.reset()
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def set_config(**values):
+    previous = {key: app.config[key] for key in values}
+    app.config.update(values)
+    return previous
+
+
+def test_server_timing_matches_engine_statements():
+    reset_db()
+    previous = set_config(SQL_INSTRUMENTATION=True)
+    try:
+        client = app.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+        client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'S'})
+
+        statements = []
+        with app.app_context():
+            engine = db.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            r = client.get('/api/routines?offset=0')
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        timing = r.headers['Server-Timing']
+        assert re.match(r'db;dur=[\d.]+;desc="(\d+) queries", total;dur=[\d.]+$', timing), timing
+        assert int(re.search(r'"(\d+) queries"', timing).group(1)) == len(statements)
+
+        # キャッシュから返した場合はSQLを実行しない
+        assert '"0 queries"' in client.get('/api/routines?offset=0').headers['Server-Timing']
+    finally:
+        set_config(**previous)
+
+
+def test_metrics_endpoint_reports_routes():
+    reset_db()
+    previous = set_config(SQL_INSTRUMENTATION=True)
+    try:
+        client = app.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+        for _ in range(3):
+            client.post(f'/api/routines/{routine_id}/toggle', json={'date': date.today().isoformat()})
+        data = client.get('/api/_debug/metrics').get_json()
+        toggle = data['routes']['POST /api/routines/<int:routine_id>/toggle']
+        assert toggle['requests'] == 3
+        assert toggle['avg_statements'] > 0
+        assert sum(toggle['latency_histogram_ms'].values()) == 3
+        assert sum(toggle['statement_histogram'].values()) == 3
+        assert data['slowest_statements'] and all('sql' in item and 'route' in item for item in data['slowest_statements'])
+        assert 'hits' in data['response_cache']
+
+        assert client.delete('/api/_debug/metrics').status_code == 200
+        assert 'POST /api/routines/<int:routine_id>/toggle' not in client.get('/api/_debug/metrics').get_json()['routes']
+    finally:
+        set_config(**previous)
+
+
+def test_budget_violations_are_logged():
+    reset_db()
+    previous = set_config(SQL_INSTRUMENTATION=True, SQL_QUERY_BUDGET=1, REQUEST_TIME_BUDGET_MS=0)
+    handler = ListHandler()
+    app.logger.addHandler(handler)
+    try:
+        client = app.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': date.today().isoformat()})
+        assert any('over budget' in m and '/toggle' in m for m in handler.messages), handler.messages
+
+        handler.messages.clear()
+        set_config(SQL_QUERY_BUDGET=1000)
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': date.today().isoformat()})
+        assert handler.messages == []
+    finally:
+        app.logger.removeHandler(handler)
+        set_config(**previous)
+
+
+def test_disabled_by_default():
+    reset_db()
+    client = app.test_client()
+    assert app.config['SQL_INSTRUMENTATION'] is False
+    assert 'Server-Timing' not in client.get('/api/routines?offset=0').headers
+    assert client.get('/api/_debug/metrics').status_code == 404
+
+
+if __name__ == '__main__':
+    test_server_timing_matches_engine_statements()
+    test_metrics_endpoint_reports_routes()
+    test_budget_violations_are_logged()
+    test_disabled_by_default()
+    print("\nALL INSTRUMENTATION TESTS PASSED!")
@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import msgpack
+import zstandard
+from flask.json.provider import DefaultJSONProvider
+from app import app
+from testutil import reset_db
+from cache import bump_data_version
+import negotiation
+
+TODAY = date.today()
+GZIP = {'Accept-Encoding': 'gzip'}
+MSGPACK = {'Accept': 'application/msgpack, application/json;q=0.5'}
+
+
+# ボードの本文が COMPRESS_MIN_BYTES を超えるだけのルーチンを作る
+def make_data(client):
+    ids = [client.post('/api/routines', json={'title': f'ルーチン {i}'}).get_json()['id'] for i in range(12)]
+    for back in range(5):
+        client.post(f'/api/routines/{ids[0]}/toggle', json={'date': (TODAY - timedelta(days=back)).isoformat()})
+    return ids
+
+
+def test_gzip_is_negotiated():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    plain = client.get('/api/routines?offset=0')
+    assert 'Content-Encoding' not in plain.headers
+    assert {'Accept', 'Accept-Encoding'} <= set(plain.vary)
+
+    zipped = client.get('/api/routines?offset=0', headers=GZIP)
+    assert zipped.headers['Content-Encoding'] == 'gzip' and zipped.mimetype == 'application/json'
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    assert len(zipped.data) < len(plain.data) / 3
+    # キャッシュの ETag は表現ごとに異なり、それぞれ 304 で再検証できる
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/api/routines?offset=0', headers=dict(GZIP, **{'If-None-Match': zipped.headers['ETag']})).status_code == 304
+    assert client.get('/api/routines?offset=0', headers=GZIP).headers['X-Cache'] == 'HIT'
+
+    # キャッシュしないAPIも after_request で圧縮する。小さい本文・ストリーミングは圧縮しない
+    sync = client.get('/api/sync', headers={'Accept-Encoding': 'gzip;q=1.0, identity;q=0.5'})
+    assert sync.headers['Content-Encoding'] == 'gzip' and 'ETag' not in sync.headers
+    assert json.loads(gzip.decompress(sync.data)) == client.get('/api/sync').get_json()
+    small = client.post('/api/routines', json={'title': 'Small'}, headers=GZIP)
+    assert small.status_code == 201 and 'Content-Encoding' not in small.headers
+    streamed = client.get('/api/history/all', headers=GZIP)
+    assert 'Content-Encoding' not in streamed.headers and streamed.get_json()
+    assert 'Content-Encoding' not in client.get('/', headers=GZIP).headers
+    print("gzip is negotiated: OK")
+
+
+def test_compression_can_be_disabled():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    app.config['API_COMPRESSION'] = False
+    try:
+        assert 'Content-Encoding' not in client.get('/api/routines?offset=0', headers=GZIP).headers
+    finally:
+        app.config['API_COMPRESSION'] = True
+    print("Compression can be disabled: OK")
+
+
+def test_zstd_is_negotiated():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    plain = client.get('/api/routines?offset=0').get_json()
+    # 品質値が同じなら zstd を優先する
+    zstd = client.get('/api/routines?offset=0', headers={'Accept-Encoding': 'gzip, zstd'})
+    assert zstd.headers['Content-Encoding'] == 'zstd' and zstd.mimetype == 'application/json'
+    assert {'Accept', 'Accept-Encoding'} <= set(zstd.vary)
+    assert json.loads(zstandard.ZstdDecompressor().decompress(zstd.data)) == plain
+    assert client.get('/api/routines?offset=0', headers={'Accept-Encoding': 'gzip, zstd;q=0.5'}).headers['Content-Encoding'] == 'gzip'
+
+    # キャッシュしないAPI (after_request) も同じ
+    sync = client.get('/api/sync', headers={'Accept-Encoding': 'zstd'})
+    assert sync.headers['Content-Encoding'] == 'zstd' and {'Accept', 'Accept-Encoding'} <= set(sync.vary)
+    assert json.loads(zstandard.ZstdDecompressor().decompress(sync.data)) == client.get('/api/sync').get_json()
+    print("zstd is negotiated: OK")
+
+
+def test_msgpack_is_opt_in():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    response = client.get('/api/analytics/overall', headers=MSGPACK)
+    assert response.mimetype == negotiation.MSGPACK_MIMETYPE and 'Content-Encoding' not in response.headers
+    assert {'Accept', 'Accept-Encoding'} <= set(response.vary)
+    assert msgpack.unpackb(response.data) == client.get('/api/analytics/overall').get_json()
+
+    # MessagePack の本文も圧縮する (キャッシュするAPI・しないAPIとも)
+    for url in ('/api/routines?offset=0', '/api/sync'):
+        packed = client.get(url, headers=dict(MSGPACK, **{'Accept-Encoding': 'zstd'}))
+        assert packed.mimetype == negotiation.MSGPACK_MIMETYPE and packed.headers['Content-Encoding'] == 'zstd', url
+        assert {'Accept', 'Accept-Encoding'} <= set(packed.vary)
+        assert msgpack.unpackb(zstandard.ZstdDecompressor().decompress(packed.data)) == client.get(url).get_json(), url
+    # 既定 (Accept なし・*/*) は JSON
+    assert client.get('/api/analytics/overall', headers={'Accept': '*/*'}).mimetype == 'application/json'
+    print("MessagePack is opt-in: OK")
+
+
+def test_orjson_provider_matches_default():
+    reset_db()
+    client = app.test_client()
+    ids = make_data(client)
+    urls = ['/api/routines?offset=0', '/api/analytics/overall', f'/api/analytics/routine/{ids[0]}',
+            f'/api/routines/{ids[0]}/history', '/api/history/all?limit=5', '/api/sync']
+    fast = {url: client.get(url).get_data() for url in urls}
+    provider = app.json
+    app.json = DefaultJSONProvider(app)
+    try:
+        for url in urls:
+            bump_data_version()
+            slow = client.get(url).get_data()
+            # ASCII 以外の文字のエスケープ以外は同じ (キーの順序も同じ)
+            assert json.dumps(json.loads(slow)) == json.dumps(json.loads(fast[url])), url
+    finally:
+        app.json = provider
+    if negotiation.orjson is not None:
+        assert isinstance(app.json, negotiation.OrjsonProvider)
+        with app.test_request_context():
+            assert app.json.dumps({'b': date(2024, 1, 2), 'a': 1}) == '{"a":1,"b":"Tue, 02 Jan 2024 00:00:00 GMT"}'
+    print("orjson provider matches the default: OK")
+
+
+if __name__ == '__main__':
+    test_gzip_is_negotiated()
+    test_compression_can_be_disabled()
+    test_zstd_is_negotiated()
+    test_msgpack_is_opt_in()
+    test_orjson_provider_matches_default()
+    print("\nALL NEGOTIATION TESTS PASSED!")
@@ -0,0 +1,108 @@
+import os
+import random
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app
+from testutil import reset_db
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog
+import rollups
+from toggles import compute_parent_completion, recompute_all_parent_completions
+
+
+# 旧実装と同じ判定: サブタスクごとにログを確認する
+def naive_parent_completion(routine_id, log_date):
+    for st in SubTask.query.filter_by(routine_id=routine_id).all():
+        st_log = SubTaskLog.query.filter_by(subtask_id=st.id, log_date=log_date).first()
+        if not st_log or not st_log.completed:
+            return False
+    return True
+
+
+def test_matches_naive_rule():
+    reset_db()
+    rng = random.Random(5)
+    today = date.today()
+    dates = [today - timedelta(days=i) for i in range(5)]
+    with app.app_context():
+        routine_ids = []
+        for i in range(6):
+            routine = Routine(title=f'R{i}')
+            db.session.add(routine)
+            db.session.flush()
+            routine_ids.append(routine.id)
+            for j in range(i % 4):  # サブタスク0件のルーチンも含める
+                st = SubTask(routine_id=routine.id, title=f'S{j}')
+                db.session.add(st)
+                db.session.flush()
+                for d in dates:
+                    if rng.random() < 0.8:
+                        db.session.add(SubTaskLog(subtask_id=st.id, log_date=d, completed=rng.random() < 0.8))
+        db.session.commit()
+
+        pairs = [(rid, d) for rid in routine_ids for d in dates]
+        states = compute_parent_completion(pairs)
+        for routine_id, d in pairs:
+            if SubTask.query.filter_by(routine_id=routine_id).count() == 0:
+                assert (routine_id, d) not in states
+            else:
+                assert states[(routine_id, d)] == naive_parent_completion(routine_id, d), (routine_id, d)
+
+
+def test_subtask_toggle_statement_count_is_constant():
+    counts = []
+    for subtask_count in (2, 20):
+        reset_db()
+        client = app.test_client()
+        routine_id = client.post('/api/routines', json={'title': 'Parent'}).get_json()['id']
+        sub_ids = [
+            client.post(f'/api/routines/{routine_id}/subtasks', json={'title': f'S{i}'}).get_json()['id']
+            for i in range(subtask_count)
+        ]
+        d = date.today().isoformat()
+        for sid in sub_ids[:-1]:
+            client.post(f'/api/subtasks/{sid}/toggle', json={'date': d})
+
+        statements = []
+        with app.app_context():
+            engine = db.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            data = client.post(f'/api/subtasks/{sub_ids[-1]}/toggle', json={'date': d}).get_json()
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        assert data['parent_routine_completed'] is True
+        counts.append(len(statements))
+    print(f"Statement counts: {counts}")
+    assert counts[0] == counts[1], counts
+
+
+def test_recompute_all_repairs_parent_logs():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Parent'}).get_json()['id']
+    sub_id = client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'S'}).get_json()['id']
+    today = date.today()
+    for back in range(3):
+        client.post(f'/api/subtasks/{sub_id}/toggle', json={'date': (today - timedelta(days=back)).isoformat()})
+
+    with app.app_context():
+        # 親ルーチンのログを壊してから再計算で元に戻す
+        RoutineLog.query.update({RoutineLog.completed: False})
+        rollups.rebuild_rollups()
+        db.session.commit()
+        assert recompute_all_parent_completions() == 3
+        db.session.commit()
+        assert RoutineLog.query.filter_by(routine_id=routine_id, completed=True).count() == 3
+        assert rollups.check_rollups() == []
+
+
+if __name__ == '__main__':
+    test_matches_naive_rule()
+    test_subtask_toggle_statement_count_is_constant()
+    test_recompute_all_repairs_parent_logs()
+    print("\nALL PARENT COMPLETION TESTS PASSED!")
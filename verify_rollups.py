@@ -0,0 +1,160 @@
+import os
+import random
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app
+from testutil import reset_db
+from models import db, Routine, RoutineLog, DailyRollup, DEFAULT_USER_ID
+import rollups
+from streaks import rebuild_streaks
+
+
+# 旧実装と同じ方法で RoutineLog から直接集計したグラフ類 (比較用)
+def naive_overall():
+    today = date.today()
+    history_start = today - timedelta(days=180)
+    logs = RoutineLog.query.filter(
+        RoutineLog.log_date >= history_start,
+        RoutineLog.completed == True
+    ).all()
+    monthly_counts = {}
+    for log in logs:
+        m_key = log.log_date.isoformat()[:7]
+        monthly_counts[m_key] = monthly_counts.get(m_key, 0) + 1
+    history_graph = []
+    for i in range(5, -1, -1):
+        m_key = (today - timedelta(days=30*i)).isoformat()[:7]
+        history_graph.append({'month': m_key, 'count': monthly_counts.get(m_key, 0)})
+
+    start_of_week = today - timedelta(days=today.weekday())
+    weekly_history = []
+    for i in range(3, -1, -1):
+        w_start = start_of_week - timedelta(weeks=i)
+        w_end = w_start + timedelta(days=6)
+        count = RoutineLog.query.filter(
+            RoutineLog.log_date >= w_start,
+            RoutineLog.log_date <= w_end,
+            RoutineLog.completed == True
+        ).count()
+        weekly_history.append({'week': f"{w_start.strftime('%m/%d')}~", 'count': count})
+
+    day_counts = [0] * 7
+    for log in logs:
+        day_counts[int(log.log_date.strftime('%w'))] += 1
+
+    # 達成率は予定日ベースになったため verify_analytics.py で確認する
+    return {
+        'completion_history': history_graph,
+        'weekly_history': weekly_history,
+        'day_distribution': day_counts
+    }
+
+
+def test_rollups_follow_toggles_and_deletes():
+    reset_db()
+    client = app.test_client()
+    rng = random.Random(3)
+    routine_ids = [client.post('/api/routines', json={'title': f'R{i}'}).get_json()['id'] for i in range(4)]
+    sub_ids = [client.post(f'/api/routines/{routine_ids[0]}/subtasks', json={'title': f'S{i}'}).get_json()['id'] for i in range(2)]
+    today = date.today()
+    for _ in range(400):
+        d = (today - timedelta(days=rng.randint(0, 200))).isoformat()
+        if rng.random() < 0.3:
+            client.post(f'/api/subtasks/{rng.choice(sub_ids)}/toggle', json={'date': d})
+        else:
+            client.post(f'/api/routines/{rng.choice(routine_ids[1:])}/toggle', json={'date': d})
+
+    data = client.get('/api/analytics/overall').get_json()
+    with app.app_context():
+        assert rollups.check_rollups() == []
+        expected = naive_overall()
+    for key, value in expected.items():
+        assert data[key] == value, (key, data[key], value)
+
+    client.delete(f'/api/routines/{routine_ids[1]}')
+    with app.app_context():
+        assert rollups.check_rollups() == []
+
+
+def test_checker_detects_and_rebuild_repairs():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    d = date.today().isoformat()
+    client.post(f'/api/routines/{routine_id}/toggle', json={'date': d})
+    with app.app_context():
+        db.session.get(DailyRollup, (DEFAULT_USER_ID, d)).completed_count = 5
+        db.session.commit()
+        assert rollups.check_rollups() == [('day', (DEFAULT_USER_ID, d), 5, 1)]
+        rollups.rebuild_rollups()
+        db.session.commit()
+        assert rollups.check_rollups() == []
+
+
+# days 日分の完了ログを持つルーチンを1つ作る。戻り値: ルーチンの id
+def seed_bulk_routine(days):
+    reset_db()
+    with app.app_context():
+        routine = Routine(title='Bulk')
+        db.session.add(routine)
+        db.session.flush()
+        for back in range(days):
+            d = date.today() - timedelta(days=back)
+            db.session.add(RoutineLog(routine_id=routine.id, log_date=d, completed=True))
+        rebuild_streaks()
+        rollups.rebuild_rollups()
+        db.session.commit()
+        return routine.id
+
+
+# request を実行したときに発行された SQL の数
+def count_statements(request):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert request().status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+
+def test_statement_count_independent_of_log_volume():
+    client = app.test_client()
+    counts = []
+    for days in (10, 1000):
+        seed_bulk_routine(days)
+        counts.append(count_statements(lambda: client.get('/api/analytics/overall')))
+    print(f"Statement counts: {counts}")
+    assert counts[0] == counts[1], counts
+
+
+# ルーチンの削除も、完了ログの件数に関係なく同じ数の SQL でロールアップを差し引く
+def test_delete_statement_count_independent_of_log_volume():
+    client = app.test_client()
+    counts = []
+    for days in (10, 1000):
+        routine_id = seed_bulk_routine(days)
+        counts.append(count_statements(lambda: client.delete(f'/api/routines/{routine_id}')))
+        with app.app_context():
+            assert rollups.check_rollups() == []
+            assert {r.completed_count for r in DailyRollup.query} == {0}
+    print(f"Delete statement counts: {counts}")
+    assert counts[0] == counts[1], counts
+
+
+if __name__ == '__main__':
+    test_rollups_follow_toggles_and_deletes()
+    test_checker_detects_and_rebuild_repairs()
+    test_statement_count_independent_of_log_volume()
+    test_delete_statement_count_independent_of_log_volume()
+    print("\nALL ROLLUP TESTS PASSED!")
@@ -0,0 +1,138 @@
+import os
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event, inspect, text
+from app import app
+from testutil import reset_db
+from models import db, Routine, RoutineLog, SubTaskLog, DEFAULT_USER_ID
+from migrations import upgrade_schema, schema_version
+
+# 変更前 (date_str 文字列列) の todos.db と同じスキーマ
+OLD_SCHEMA = [
+    """CREATE TABLE routine (
+        id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, target_days VARCHAR(20),
+        created_at DATETIME, PRIMARY KEY (id))""",
+    """CREATE TABLE routine_log (
+        id INTEGER NOT NULL, routine_id INTEGER NOT NULL, date_str VARCHAR(10) NOT NULL,
+        completed BOOLEAN, PRIMARY KEY (id),
+        CONSTRAINT unique_routine_date UNIQUE (routine_id, date_str),
+        FOREIGN KEY(routine_id) REFERENCES routine (id))""",
+    """CREATE TABLE sub_task (
+        id INTEGER NOT NULL, routine_id INTEGER NOT NULL, title VARCHAR(100) NOT NULL,
+        created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(routine_id) REFERENCES routine (id))""",
+    """CREATE TABLE sub_task_log (
+        id INTEGER NOT NULL, subtask_id INTEGER NOT NULL, date_str VARCHAR(10) NOT NULL,
+        completed BOOLEAN, PRIMARY KEY (id),
+        CONSTRAINT unique_subtask_date UNIQUE (subtask_id, date_str),
+        FOREIGN KEY(subtask_id) REFERENCES sub_task (id))""",
+]
+
+
+def test_migrates_old_schema():
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(text('PRAGMA user_version = 0'))
+            for statement in OLD_SCHEMA:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO routine (id, title, target_days, created_at) VALUES (1, 'Old', '0,1,2,3,4,5,6', '2024-01-01 00:00:00')"))
+            conn.execute(text("INSERT INTO routine_log (id, routine_id, date_str, completed) VALUES (1, 1, '2024-01-02', 1), (2, 1, '2024-01-03', 0)"))
+            conn.execute(text("INSERT INTO sub_task (id, routine_id, title, created_at) VALUES (1, 1, 'Sub', '2024-01-01 00:00:00')"))
+            conn.execute(text("INSERT INTO sub_task_log (id, subtask_id, date_str, completed) VALUES (1, 1, '2024-01-02', 1)"))
+
+        # アプリ起動時と同じ手順
+        db.create_all()
+        assert upgrade_schema() == [1, 2, 3]
+        assert upgrade_schema() == []
+
+        with db.engine.connect() as conn:
+            assert schema_version(conn) == 3
+            inspector = inspect(conn)
+            for model in (RoutineLog, SubTaskLog):
+                columns = {c['name'] for c in inspector.get_columns(model.__tablename__)}
+                assert 'log_date' in columns and 'date_str' not in columns and 'updated_seq' in columns
+                indexes = {i['name'] for i in inspector.get_indexes(model.__tablename__)}
+                assert {i.name for i in model.__table__.indexes} <= indexes
+            # 移行前からあるテーブルにも同期用・所有ユーザーの列が追加される
+            for table in ('routine', 'sub_task', 'routine_log', 'sub_task_log'):
+                assert {'updated_seq', 'user_id'} <= {c['name'] for c in inspector.get_columns(table)}
+
+        logs = RoutineLog.query.order_by(RoutineLog.id).all()
+        assert [(l.log_date, l.completed) for l in logs] == [(date(2024, 1, 2), True), (date(2024, 1, 3), False)]
+        assert SubTaskLog.query.one().log_date == date(2024, 1, 2)
+        # 移行前のデータは既定のユーザーのもの
+        assert {l.user_id for l in logs} == {DEFAULT_USER_ID}
+        assert Routine.query.one().user_id == DEFAULT_USER_ID
+
+    client = app.test_client()
+    data = client.get('/api/routines/1/history?year=2024').get_json()
+    assert data['completed_dates'] == ['2024-01-02']
+    # date で表せない年は 400
+    for year in (0, -1, 9999):
+        response = client.get(f'/api/routines/1/history?year={year}')
+        assert response.status_code == 400 and response.get_json()['error'] == 'Invalid year'
+    assert client.get('/api/routines/1/history?year=1').get_json()['completed_dates'] == []
+
+
+def seed_history():
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Plan'}).get_json()['id']
+    other_id = client.post('/api/routines', json={'title': 'Sub parent'}).get_json()['id']
+    sub_id = client.post(f'/api/routines/{other_id}/subtasks', json={'title': 'Sub'}).get_json()['id']
+    today = date.today()
+    for back in range(0, 400, 3):
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': (today - timedelta(days=back)).isoformat()})
+        client.post(f'/api/subtasks/{sub_id}/toggle', json={'date': (today - timedelta(days=back)).isoformat()})
+    return client, routine_id, sub_id
+
+
+# 各APIが発行した SELECT のうち、ログテーブルを読むものの実行計画を集める
+def capture_log_plans(client, routine_id, sub_id):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and '_log' in statement:
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        today = date.today().isoformat()
+        client.get('/api/routines?offset=0')
+        client.get('/api/routines?offset=-30')
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': today})
+        client.post(f'/api/subtasks/{sub_id}/toggle', json={'date': today})
+        client.get(f'/api/routines/{routine_id}/history?year={date.today().year}')
+        client.get(f'/api/analytics/routine/{routine_id}')
+        client.get('/api/analytics/overall')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            plans.append((statement, [row[-1] for row in rows]))
+    return plans
+
+
+def test_hot_queries_use_indexes():
+    reset_db()
+    client, routine_id, sub_id = seed_history()
+    plans = capture_log_plans(client, routine_id, sub_id)
+    assert plans
+    for statement, details in plans:
+        for detail in details:
+            if 'routine_log' in detail or 'sub_task_log' in detail:
+                # ログテーブルの全件スキャンではなく、インデックス (または主キー) の検索になっていること
+                assert detail.startswith('SEARCH') and ('INDEX' in detail or 'PRIMARY KEY' in detail), (statement, details)
+
+
+if __name__ == '__main__':
+    test_migrates_old_schema()
+    test_hot_queries_use_indexes()
+    print("\nALL SCHEMA TESTS PASSED!")
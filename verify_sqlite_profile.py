@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from app import app
+from testutil import reset_db
+from models import db, Routine
+from sqlite_profile import engine_options, install_sqlite_profile, is_locked_error, sqlite_pragmas, write_transaction, POOL_OPTIONS
+
+
+def file_engine(directory, pragmas):
+    engine = create_engine('sqlite:///' + os.path.join(directory, 'profile.db'))
+    install_sqlite_profile(engine, pragmas)
+    return engine
+
+
+def test_pragmas_and_engine_options():
+    assert engine_options('sqlite:///:memory:') == {}
+    assert engine_options('sqlite:////tmp/todos.db') == POOL_OPTIONS
+    try:
+        sqlite_pragmas('turbo')
+        assert False, 'unknown profile should be rejected'
+    except ValueError:
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = file_engine(tmp, sqlite_pragmas('production', {'synchronous': 'FULL'}))
+        with engine.connect() as conn:
+            values = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                      for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size')}
+        engine.dispose()
+    assert values == {'journal_mode': 'wal', 'synchronous': 2, 'busy_timeout': 5000, 'cache_size': -20000}, values
+
+
+def test_write_routes_begin_immediate():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'R'}).get_json()['id']
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': '2024-01-01'})
+        client.get(f'/api/routines/{routine_id}/history?year=2024')
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    begins = [s for s in statements if s.startswith('BEGIN')]
+    assert begins == ['BEGIN IMMEDIATE', 'BEGIN'], begins
+
+    # コミット後にレスポンスを作るための読み取りは書き込みロックを取らない
+    statements.clear()
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert client.post('/api/routines', json={'title': 'S'}).status_code == 201
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    begins = [s for s in statements if s.startswith('BEGIN')]
+    assert begins == ['BEGIN IMMEDIATE', 'BEGIN'], begins
+
+
+def test_retries_only_lock_errors():
+    calls = []
+
+    @write_transaction
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OperationalError('UPDATE', {}, sqlite3.OperationalError('database is locked'))
+        return 'done'
+
+    @write_transaction
+    def broken():
+        calls.append(1)
+        raise OperationalError('SELECT', {}, sqlite3.OperationalError('no such table: routine'))
+
+    with app.app_context():
+        assert flaky() == 'done' and len(calls) == 3
+        calls.clear()
+        try:
+            broken()
+            assert False, 'non-lock errors should not be retried'
+        except OperationalError:
+            pass
+        assert len(calls) == 1
+
+
+# コミットした後のロックエラーではやり直さない (同じ変更が2回適用されないように)
+def test_no_retry_after_commit():
+    reset_db()
+    calls = []
+
+    @write_transaction
+    def create_then_fail():
+        calls.append(1)
+        db.session.add(Routine(title='once', user_id=1))
+        db.session.commit()
+        raise OperationalError('SELECT', {}, sqlite3.OperationalError('database is locked'))
+
+    with app.app_context():
+        try:
+            create_then_fail()
+            assert False, 'errors after commit should be raised'
+        except OperationalError as error:
+            assert is_locked_error(error)
+        assert len(calls) == 1
+        assert Routine.query.filter_by(title='once').count() == 1
+
+
+def test_waits_for_real_writer():
+    with tempfile.TemporaryDirectory() as tmp:
+        pragmas = sqlite_pragmas('production', {'busy_timeout': 50})
+        engine = file_engine(tmp, pragmas)
+        with engine.begin() as conn:
+            conn.exec_driver_sql('CREATE TABLE counter (n INTEGER)')
+            conn.exec_driver_sql('INSERT INTO counter VALUES (0)')
+
+        # 別の接続が書き込みロックを持ったままにする
+        holder = sqlite3.connect(os.path.join(tmp, 'profile.db'), isolation_level=None, check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql('UPDATE counter SET n = n + 1')
+            assert False, 'write should fail while the lock is held'
+        except OperationalError as error:
+            assert is_locked_error(error)
+
+        # ロックが外れるまで再試行して成功する
+        threading.Timer(0.2, holder.rollback).start()
+
+        @write_transaction
+        def increment():
+            with engine.begin() as conn:
+                conn.exec_driver_sql('UPDATE counter SET n = n + 1')
+
+        with app.app_context():
+            started = time.time()
+            increment()
+            assert time.time() - started >= 0.15
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT n FROM counter').scalar() == 1
+        holder.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    test_pragmas_and_engine_options()
+    test_write_routes_begin_immediate()
+    test_retries_only_lock_errors()
+    test_no_retry_after_commit()
+    test_waits_for_real_writer()
+    print("\nALL SQLITE PROFILE TESTS PASSED!")
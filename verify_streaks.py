@@ -0,0 +1,135 @@
+import os
+import random
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from models import db, RoutineStreak
+from streaks import rebuild_streaks, _compute_states
+
+
+# 完了日の集合から (最新の完了日, 連続日数, 最長記録, 現在のストリーク) を素朴に求める
+def naive_state(done):
+    today = date.today()
+    last = max(done) if done else None
+    run = 0
+    while last and last - timedelta(days=run) in done:
+        run += 1
+    longest = 0
+    for d in done:
+        if d - timedelta(days=1) not in done:
+            length = 0
+            while d + timedelta(days=length) in done:
+                length += 1
+            longest = max(longest, length)
+    check = today if today in done else today - timedelta(days=1)
+    current = 0
+    while check - timedelta(days=current) in done:
+        current += 1
+    return last, run, longest, current
+
+
+def assert_state(client, routine_id, done):
+    last, run, longest, current = naive_state(done)
+    with app.app_context():
+        state = db.session.get(RoutineStreak, routine_id)
+        assert state.last_completed == last, (state.last_completed, last)
+        assert state.current_run == run, (state.current_run, run)
+        assert state.longest_streak == longest, (state.longest_streak, longest)
+    data = client.get(f'/api/analytics/routine/{routine_id}').get_json()
+    assert data['current_streak'] == current, (data['current_streak'], current)
+    assert data['longest_streak'] == longest
+
+
+def test_incremental_matches_naive():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Streak'}).get_json()['id']
+    today = date.today()
+    rng = random.Random(7)
+    done = set()
+    # 未来日も含めた範囲でランダムにトグルする
+    for _ in range(300):
+        d = today + timedelta(days=rng.randint(-25, 3))
+        r = client.post(f'/api/routines/{routine_id}/toggle', json={'date': d.isoformat()})
+        if r.get_json()['completed']:
+            done.add(d)
+        else:
+            done.discard(d)
+        assert_state(client, routine_id, done)
+
+
+def test_untoggle_middle_of_run():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Run'}).get_json()['id']
+    today = date.today()
+    done = set()
+    for back in range(10):
+        d = today - timedelta(days=back)
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': d.isoformat()})
+        done.add(d)
+    assert_state(client, routine_id, done)
+
+    # 連続の途中 (4日前) を取り消すと、現在の連続は4日、最長は5日になる
+    middle = today - timedelta(days=4)
+    client.post(f'/api/routines/{routine_id}/toggle', json={'date': middle.isoformat()})
+    done.discard(middle)
+    assert_state(client, routine_id, done)
+
+    client.post(f'/api/routines/{routine_id}/toggle', json={'date': middle.isoformat()})
+    done.add(middle)
+    assert_state(client, routine_id, done)
+
+
+def test_subtask_toggle_updates_streak():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Parent'}).get_json()['id']
+    sub_id = client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'Sub'}).get_json()['id']
+    today = date.today()
+    done = set()
+    for back in (0, 1, 2):
+        d = today - timedelta(days=back)
+        client.post(f'/api/subtasks/{sub_id}/toggle', json={'date': d.isoformat()})
+        done.add(d)
+    assert_state(client, routine_id, done)
+
+    d = today - timedelta(days=1)
+    client.post(f'/api/subtasks/{sub_id}/toggle', json={'date': d.isoformat()})
+    done.discard(d)
+    assert_state(client, routine_id, done)
+
+
+def test_rebuild_matches_incremental():
+    reset_db()
+    client = app.test_client()
+    routine_id = client.post('/api/routines', json={'title': 'Rebuild'}).get_json()['id']
+    rng = random.Random(11)
+    for _ in range(100):
+        d = date.today() - timedelta(days=rng.randint(0, 40))
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': d.isoformat()})
+    with app.app_context():
+        state = db.session.get(RoutineStreak, routine_id)
+        incremental = (state.last_completed, state.current_run, state.longest_streak)
+        rebuilt = _compute_states([routine_id])[routine_id]
+        assert incremental == (rebuilt.last_completed, rebuilt.current_run, rebuilt.longest_streak)
+
+        # 状態を壊してから rebuild_streaks で復元できること
+        state.current_run = 999
+        db.session.commit()
+        rebuild_streaks()
+        db.session.commit()
+        state = db.session.get(RoutineStreak, routine_id)
+        assert (state.last_completed, state.current_run, state.longest_streak) == incremental
+
+
+if __name__ == '__main__':
+    test_incremental_matches_naive()
+    test_untoggle_middle_of_run()
+    test_subtask_toggle_updates_streak()
+    test_rebuild_matches_incremental()
+    print("\nALL STREAK TESTS PASSED!")
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from models import db, SubTaskLog, SyncTombstone
+from sync import prune_tombstones
+
+TODAY = date.today()
+
+
+def sync(client, since):
+    response = client.get(f'/api/sync?since={since}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+# クライアント側のレプリカ: 削除を先に適用してから変更行を上書きする
+class Replica:
+    def __init__(self):
+        self.seq = 0
+        self.routines = {}
+        self.subtasks = {}
+        self.routine_logs = {}
+        self.subtask_logs = {}
+
+    def apply(self, payload):
+        if payload['full']:
+            self.__init__()
+        deleted = payload['deleted']
+        for routine_id in deleted['routines']:
+            self.routines.pop(routine_id, None)
+            for subtask_id in [sid for sid, row in self.subtasks.items() if row[1] == routine_id]:
+                self.drop_subtask(subtask_id)
+            self.routine_logs = {k: v for k, v in self.routine_logs.items() if k[0] != routine_id}
+        for subtask_id in deleted['subtasks']:
+            self.drop_subtask(subtask_id)
+        for routine_id, day in deleted['routine_logs']:
+            self.routine_logs.pop((routine_id, day), None)
+        for subtask_id, day in deleted['subtask_logs']:
+            self.subtask_logs.pop((subtask_id, day), None)
+
+        for row in payload['routines']:
+            self.routines[row[0]] = row
+        for row in payload['subtasks']:
+            self.subtasks[row[0]] = row
+        for routine_id, day, completed in payload['routine_logs']:
+            self.routine_logs[(routine_id, day)] = completed
+        for subtask_id, day, completed in payload['subtask_logs']:
+            self.subtask_logs[(subtask_id, day)] = completed
+        self.seq = payload['seq']
+
+    def drop_subtask(self, subtask_id):
+        self.subtasks.pop(subtask_id, None)
+        self.subtask_logs = {k: v for k, v in self.subtask_logs.items() if k[0] != subtask_id}
+
+    def state(self):
+        return self.routines, self.subtasks, self.routine_logs, self.subtask_logs
+
+
+def full_state(client):
+    replica = Replica()
+    replica.apply(sync(client, 0))
+    return replica.state()
+
+
+def test_incremental_sync_returns_only_changes():
+    reset_db()
+    client = app.test_client()
+    assert sync(client, 0) == dict(sync(client, 0), seq=0, full=True, routines=[])
+
+    a = client.post('/api/routines', json={'title': 'A'}).get_json()['id']
+    b = client.post('/api/routines', json={'title': 'B'}).get_json()['id']
+    sub = client.post(f'/api/routines/{b}/subtasks', json={'title': 'Sub'}).get_json()['id']
+    for back in range(10):
+        client.post(f'/api/routines/{a}/toggle', json={'date': (TODAY - timedelta(days=back)).isoformat()})
+    first = sync(client, 0)
+    # 書き込みトランザクションごとに連番が1つ進む
+    assert first['seq'] == 13 and first['full'] is True
+    assert len(first['routine_logs']) == 10
+
+    client.post(f'/api/subtasks/{sub}/toggle', json={'date': TODAY.isoformat()})
+    delta = sync(client, first['seq'])
+    assert delta['seq'] == first['seq'] + 1 and delta['full'] is False
+    # 変更されたのはサブタスクログと、サブタスクの状態で決まる親ルーチンのログだけ
+    assert delta['routines'] == [] and delta['subtasks'] == []
+    assert delta['subtask_logs'] == [[sub, TODAY.isoformat(), True]]
+    assert delta['routine_logs'] == [[b, TODAY.isoformat(), True]]
+    assert len(json.dumps(delta)) < len(json.dumps(first)) / 2
+
+    # 変更のない更新では連番も進まない
+    client.put(f'/api/routines/{a}', json={'title': 'A'})
+    client.post('/api/toggles/batch', json={'operations': [
+        {'kind': 'routine', 'id': a, 'date': TODAY.isoformat(), 'completed': True}
+    ]})
+    assert sync(client, delta['seq']) == dict(delta, seq=delta['seq'], routines=[], subtasks=[], routine_logs=[], subtask_logs=[])
+    print("Incremental sync: OK")
+
+
+def test_deletes_leave_tombstones():
+    reset_db()
+    client = app.test_client()
+    a = client.post('/api/routines', json={'title': 'A'}).get_json()['id']
+    b = client.post('/api/routines', json={'title': 'B'}).get_json()['id']
+    sub_a = client.post(f'/api/routines/{a}/subtasks', json={'title': 'SA'}).get_json()['id']
+    sub_b = client.post(f'/api/routines/{b}/subtasks', json={'title': 'SB'}).get_json()['id']
+    for sub in (sub_a, sub_b):
+        client.post(f'/api/subtasks/{sub}/toggle', json={'date': TODAY.isoformat()})
+    seq = sync(client, 0)['seq']
+
+    client.delete(f'/api/subtasks/{sub_a}')
+    client.delete(f'/api/routines/{b}')
+    delta = sync(client, seq)
+    # 一緒に消えたログやサブタスクは親の墓標だけで表す
+    assert delta['deleted'] == {'routines': [b], 'subtasks': [sub_a], 'routine_logs': [], 'subtask_logs': []}
+    with app.app_context():
+        assert SyncTombstone.query.count() == 2
+        # サブタスクのログもサブタスクと一緒に削除される
+        assert SubTaskLog.query.count() == 0
+    print("Tombstones: OK")
+
+
+def test_replica_converges():
+    reset_db()
+    client = app.test_client()
+    rng = random.Random(3)
+    replica = Replica()
+    routines = []
+    subtasks = {}
+    for step in range(150):
+        action = rng.random()
+        if action < 0.1 or not routines:
+            routine_id = client.post('/api/routines', json={'title': f'R{step}'}).get_json()['id']
+            routines.append(routine_id)
+        elif action < 0.2:
+            routine_id = rng.choice(routines)
+            sub = client.post(f'/api/routines/{routine_id}/subtasks', json={'title': f'S{step}'}).get_json()['id']
+            subtasks[sub] = routine_id
+        elif action < 0.25:
+            routine_id = routines.pop(rng.randrange(len(routines)))
+            client.delete(f'/api/routines/{routine_id}')
+            subtasks = {s: r for s, r in subtasks.items() if r != routine_id}
+        elif action < 0.3 and subtasks:
+            sub = rng.choice(list(subtasks))
+            client.delete(f'/api/subtasks/{sub}')
+            del subtasks[sub]
+        elif action < 0.35:
+            client.put(f'/api/routines/{rng.choice(routines)}', json={'title': f'T{step}'})
+        elif action < 0.65 and subtasks:
+            sub = rng.choice(list(subtasks))
+            client.post(f'/api/subtasks/{sub}/toggle', json={'date': (TODAY - timedelta(days=rng.randint(0, 5))).isoformat()})
+        else:
+            client.post(f'/api/routines/{rng.choice(routines)}/toggle', json={'date': (TODAY - timedelta(days=rng.randint(0, 5))).isoformat()})
+
+        if step % 7 == 0:
+            replica.apply(sync(client, replica.seq))
+            assert replica.state() == full_state(client), step
+    replica.apply(sync(client, replica.seq))
+    assert replica.state() == full_state(client)
+    print("Replica converges: OK")
+
+
+def test_full_sync_fallbacks():
+    reset_db()
+    client = app.test_client()
+    a = client.post('/api/routines', json={'title': 'A'}).get_json()['id']
+    sub = client.post(f'/api/routines/{a}/subtasks', json={'title': 'S'}).get_json()['id']
+    client.delete(f'/api/subtasks/{sub}')
+    seq = sync(client, 0)['seq']
+
+    assert client.get('/api/sync?since=-1').status_code == 400
+    # サーバーより新しい連番 (別のDB) は全件
+    assert sync(client, seq + 5)['full'] is True
+
+    # 墓標を整理すると、それより前からの同期は全件になる
+    with app.app_context():
+        SyncTombstone.query.update({'created_at': datetime.utcnow() - timedelta(days=60)})
+        assert prune_tombstones(30) == 1
+        db.session.commit()
+    assert sync(client, 1)['full'] is True
+    assert sync(client, seq)['full'] is False
+    print("Full sync fallbacks: OK")
+
+
+if __name__ == '__main__':
+    test_incremental_sync_returns_only_changes()
+    test_deletes_leave_tombstones()
+    test_replica_converges()
+    test_full_sync_fallbacks()
+    print("\nALL SYNC TESTS PASSED!")
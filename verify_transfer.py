@@ -0,0 +1,168 @@
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app
+from testutil import reset_db
+from models import db, ChangeEvent, Routine, RoutineLog, SubTaskLog
+from sync import sync_payload
+import transfer
+
+TODAY = date.today()
+
+
+def make_data(client):
+    a = client.post('/api/routines', json={'title': 'Morning "run", 5km'}).get_json()['id']
+    b = client.post('/api/routines', json={'title': '読書', 'target_days': '1,3,5'}).get_json()['id']
+    sub = client.post(f'/api/routines/{b}/subtasks', json={'title': 'Chapter'}).get_json()['id']
+    for back in range(5):
+        client.post(f'/api/routines/{a}/toggle', json={'date': (TODAY - timedelta(days=back)).isoformat()})
+    # 一度チェックして外した未完了ログも含める
+    client.post(f'/api/routines/{a}/toggle', json={'date': TODAY.isoformat()})
+    client.post(f'/api/subtasks/{sub}/toggle', json={'date': TODAY.isoformat()})
+    return a, b, sub
+
+
+# 同期の全件レスポンス (連番以外) でDBの内容を比べる
+def snapshot(client):
+    with app.app_context():
+        payload = sync_payload(0)
+    return {key: payload[key] for key in ('routines', 'subtasks', 'routine_logs', 'subtask_logs')}
+
+
+def test_ndjson_round_trip():
+    reset_db()
+    client = app.test_client()
+    a, _, _ = make_data(client)
+    before = snapshot(client)
+    board = client.get('/api/routines?offset=0').get_json()
+
+    response = client.get('/api/export')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    body = response.get_data(as_text=True)
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert [line['table'] for line in lines][:2] == ['routines', 'routines']
+    assert len(lines) == 2 + 1 + 6 + 1
+
+    reset_db()
+    result = client.post('/api/import', data=body.encode(), content_type='application/x-ndjson')
+    assert result.status_code == 200
+    assert result.get_json()['imported'] == {'routines': 2, 'subtasks': 1, 'routine_logs': 6, 'subtask_logs': 1}
+    assert snapshot(client) == before
+    # ストリーク・ボードも元どおりに復元される
+    restored = client.get('/api/routines?offset=0').get_json()
+    assert restored['routines'] == board['routines']
+    assert next(r for r in restored['routines'] if r['id'] == a)['current_streak'] == 4
+    with app.app_context():
+        assert ChangeEvent.query.filter_by(kind='reset').count() == 1
+    print("NDJSON round trip: OK")
+
+
+def test_csv_round_trip_and_upsert():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    before = snapshot(client)
+    files = {}
+    for table in transfer.TABLES:
+        response = client.get(f'/api/export?format=csv&table={table}')
+        assert response.status_code == 200 and response.mimetype == 'text/csv'
+        files[table] = response.get_data(as_text=True)
+    assert files['routine_logs'].splitlines()[0] == 'routine_id,date,completed'
+    assert client.get('/api/export?format=csv').status_code == 400
+
+    reset_db()
+    for table in transfer.TABLES:
+        result = client.post('/api/import?format=csv', data=files[table].encode(), content_type='text/csv')
+        assert result.status_code == 200, result.get_json()
+    assert snapshot(client) == before
+
+    # 同じファイルをもう一度取り込んでも行は増えず、変更された値だけ上書きされる
+    seq = client.get('/api/sync?since=0').get_json()['seq']
+    edited = files['routine_logs'].replace(',1\n', ',0\n', 1)
+    assert client.post('/api/import?format=csv', data=edited.encode(), content_type='text/csv').status_code == 200
+    with app.app_context():
+        assert RoutineLog.query.count() == len(before['routine_logs'])
+        assert RoutineLog.query.filter_by(completed=True).count() == sum(1 for row in before['routine_logs'] if row[2]) - 1
+    # 取り込み前の連番からの差分同期は全件にならず、取り込んだ行だけを返す
+    delta = client.get(f'/api/sync?since={seq}').get_json()
+    assert delta['full'] is False and delta['seq'] > seq
+    assert len(delta['routine_logs']) == len(before['routine_logs'])
+    assert sum(1 for row in delta['routine_logs'] if not row[2]) == sum(1 for row in before['routine_logs'] if not row[2]) + 1
+    assert delta['routines'] == [] and delta['deleted'] == {'routines': [], 'subtasks': [], 'routine_logs': [], 'subtask_logs': []}
+    print("CSV round trip and upsert: OK")
+
+
+def test_invalid_rows_are_reported():
+    reset_db()
+    client = app.test_client()
+    rows = [{'table': 'routines', 'id': i, 'title': f'R{i}'} for i in range(1, 5)]
+    body = ''.join(json.dumps(row) + '\n' for row in rows)
+    body += json.dumps({'table': 'routine_logs', 'routine_id': 1, 'date': 'yesterday', 'completed': True}) + '\n'
+
+    with app.app_context():
+        counts, error = transfer.import_lines(body.splitlines(), 'ndjson', chunk_size=3)
+    # エラーより前のまとまり (3件) は書き込み済み
+    assert error == "line 5: Invalid isoformat string: 'yesterday'"
+    assert counts['routines'] == 3
+    with app.app_context():
+        assert Routine.query.count() == 3
+
+    response = client.post('/api/import', data=b'{"table": "routines", "id": 9}\n', content_type='application/x-ndjson')
+    assert response.status_code == 400 and response.get_json()['error'] == "line 1: missing 'title'"
+    assert client.post('/api/import?format=csv', data=b'a,b\n1,2\n', content_type='text/csv').get_json()['error'] == 'line 1: unknown CSV header'
+    assert client.post('/api/import', data=b'{"table": "todos"}\n', content_type='application/json').status_code == 400
+    print("Invalid rows are reported: OK")
+
+
+def test_cli_commands():
+    reset_db()
+    client = app.test_client()
+    make_data(client)
+    before = snapshot(client)
+    runner = app.test_cli_runner()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'subtask_logs.csv')
+        assert runner.invoke(args=['export-data', '--format', 'csv', '--table', 'subtask_logs', '--output', path]).exit_code == 0
+        ndjson_path = os.path.join(tmp, 'todos.ndjson')
+        assert runner.invoke(args=['export-data', '--output', ndjson_path]).exit_code == 0
+
+        reset_db()
+        result = runner.invoke(args=['import-data', ndjson_path])
+        assert result.exit_code == 0 and "'routine_logs': 6" in result.output
+        with app.app_context():
+            SubTaskLog.query.delete()
+            db.session.commit()
+        assert runner.invoke(args=['import-data', path]).exit_code == 0
+    assert snapshot(client) == before
+    print("CLI export/import: OK")
+
+
+# 他のサイトのフォームから送れる Content-Type (text/plain など) では取り込まない
+def test_import_requires_content_type():
+    reset_db()
+    client = app.test_client()
+    body = b'{"table": "routines", "id": 1, "title": "R"}\n'
+    for content_type in (None, 'text/plain', 'application/x-www-form-urlencoded', 'multipart/form-data; boundary=x', 'text/csv'):
+        response = client.post('/api/import', data=body, content_type=content_type)
+        assert response.status_code == 415, content_type
+        assert response.get_json()['error'] == 'Content-Type must be application/x-ndjson or application/json'
+    assert client.post('/api/import?format=csv', data=b'id,title\n1,R\n', content_type='text/plain').status_code == 415
+    with app.app_context():
+        assert Routine.query.count() == 0
+    assert client.post('/api/import', data=body, content_type='application/x-ndjson; charset=utf-8').status_code == 200
+    print("Import requires a JSON or CSV Content-Type: OK")
+
+
+if __name__ == '__main__':
+    test_ndjson_round_trip()
+    test_csv_round_trip_and_upsert()
+    test_invalid_rows_are_reported()
+    test_cli_commands()
+    test_import_requires_content_type()
+    print("\nALL TRANSFER TESTS PASSED!")
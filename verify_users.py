@@ -0,0 +1,170 @@
+import json
+from datetime import date, timedelta
+
+from app import create_app
+from cache import bump_data_version, response_cache
+from events import events_after
+from models import db, User, DEFAULT_USER_ID
+from users import issue_token
+import testutil
+
+TODAY = date.today()
+
+# 複数ユーザーモードのアプリ (メモリ上のDB、起動時にテーブルと既定のユーザーを作る)
+cache_size = response_cache.max_entries
+app = create_app({'APP_ENV': 'testing', 'MULTI_USER': True})
+response_cache.max_entries = cache_size
+
+
+def reset_db():
+    testutil.reset_db(app)
+    with app.app_context():
+        db.session.add(User(id=DEFAULT_USER_ID, name='default'))
+        tokens = {name: issue_token(name)[1] for name in ('alice', 'bob')}
+        db.session.commit()
+    bump_data_version()
+    return tokens
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def make_data(client, headers):
+    routine_id = client.post('/api/routines', json={'title': 'Run'}, headers=headers).get_json()['id']
+    parent_id = client.post('/api/routines', json={'title': 'Read'}, headers=headers).get_json()['id']
+    subtask_id = client.post(f'/api/routines/{parent_id}/subtasks', json={'title': 'Chapter'}, headers=headers).get_json()['id']
+    for back in range(3):
+        client.post(f'/api/routines/{routine_id}/toggle', json={'date': (TODAY - timedelta(days=back)).isoformat()}, headers=headers)
+    client.post(f'/api/subtasks/{subtask_id}/toggle', json={'date': TODAY.isoformat()}, headers=headers)
+    return routine_id, parent_id, subtask_id
+
+
+def test_requests_require_a_user():
+    tokens = reset_db()
+    client = app.test_client()
+    for url in ('/api/routines?offset=0', '/api/sync', '/api/events', '/api/analytics/overall', '/api/export'):
+        assert client.get(url).status_code == 401, url
+        assert client.get(url, headers=auth('wrong')).status_code == 401, url
+    assert client.post('/api/routines', json={'title': 'X'}).status_code == 401
+    # 画面は認証なしで表示できる (画面側でトークンを入力する)
+    assert client.get('/').status_code == 200
+    assert client.get('/api/routines?offset=0', headers=auth(tokens['alice'])).status_code == 200
+    print("Requests require a user: OK")
+
+
+def test_users_only_see_their_own_data():
+    tokens = reset_db()
+    client = app.test_client()
+    alice, bob = auth(tokens['alice']), auth(tokens['bob'])
+    routine_id, parent_id, subtask_id = make_data(client, alice)
+    bob_routine = client.post('/api/routines', json={'title': 'Bob'}, headers=bob).get_json()['id']
+
+    board = client.get('/api/routines?offset=0', headers=alice).get_json()['routines']
+    assert sorted(r['id'] for r in board) == sorted([routine_id, parent_id])
+    assert next(r for r in board if r['id'] == parent_id)['week_logs'] != []
+    assert [r['id'] for r in client.get('/api/routines?offset=0', headers=bob).get_json()['routines']] == [bob_routine]
+
+    # 他のユーザーのルーチン・サブタスクは存在しないものとして扱う
+    day = {'date': TODAY.isoformat()}
+    assert client.post(f'/api/routines/{routine_id}/toggle', json=day, headers=bob).status_code == 404
+    assert client.post(f'/api/subtasks/{subtask_id}/toggle', json=day, headers=bob).status_code == 404
+    assert client.put(f'/api/routines/{routine_id}', json={'title': 'Mine'}, headers=bob).status_code == 404
+    assert client.delete(f'/api/routines/{routine_id}', headers=bob).status_code == 404
+    assert client.post(f'/api/routines/{routine_id}/subtasks', json={'title': 'S'}, headers=bob).status_code == 404
+    assert client.get(f'/api/routines/{routine_id}/history', headers=bob).status_code == 404
+    assert client.get(f'/api/analytics/routine/{routine_id}', headers=bob).status_code == 404
+    batch = {'operations': [{'kind': 'routine', 'id': routine_id, 'date': TODAY.isoformat(), 'completed': False}]}
+    response = client.post('/api/toggles/batch', json=batch, headers=bob)
+    assert response.status_code == 404 and response.get_json()['missing'] == [{'kind': 'routine', 'id': routine_id}]
+
+    # 読み取りAPIはリクエストのユーザーの行だけを集計する
+    assert len(client.get('/api/history/all', headers=alice).get_json()) == 4
+    assert client.get('/api/history/all', headers=bob).get_json() == []
+    alice_overall = client.get('/api/analytics/overall', headers=alice).get_json()
+    bob_overall = client.get('/api/analytics/overall', headers=bob).get_json()
+    assert sum(m['count'] for m in alice_overall['completion_history']) == 4
+    assert sum(m['count'] for m in bob_overall['completion_history']) == 0
+    sync = client.get('/api/sync', headers=bob).get_json()
+    assert [row[0] for row in sync['routines']] == [bob_routine] and sync['routine_logs'] == []
+    export = client.get('/api/export', headers=bob).get_data(as_text=True)
+    assert [json.loads(line)['id'] for line in export.splitlines()] == [bob_routine]
+
+    # 削除の墓標・変更イベントも所有ユーザーにだけ届く
+    seq = sync['seq']
+    client.delete(f'/api/subtasks/{subtask_id}', headers=alice)
+    assert client.get(f'/api/sync?since={seq}', headers=bob).get_json()['deleted']['subtasks'] == []
+    assert client.get(f'/api/sync?since={seq}', headers=alice).get_json()['deleted']['subtasks'] == [subtask_id]
+    with app.app_context():
+        users = {u.name: u.id for u in User.query}
+        assert {e.entity_id for e in events_after(0, users['bob'])} == {bob_routine}
+        assert subtask_id in {e.entity_id for e in events_after(0, users['alice']) if e.kind == 'subtask'}
+    print("Users only see their own data: OK")
+
+
+def test_session_login():
+    tokens = reset_db()
+    client = app.test_client()
+    assert client.post('/api/session', json={'token': 'wrong'}).status_code == 401
+    response = client.post('/api/session', json={'token': tokens['alice']})
+    assert response.status_code == 200 and response.get_json()['name'] == 'alice'
+    # 以降はセッション Cookie で認証される
+    assert client.post('/api/routines', json={'title': 'Cookie'}).status_code == 201
+    assert len(client.get('/api/routines?offset=0').get_json()['routines']) == 1
+    assert client.delete('/api/session').status_code == 200
+    assert client.get('/api/routines?offset=0').status_code == 401
+    print("Session login: OK")
+
+
+def test_import_cannot_touch_other_users():
+    tokens = reset_db()
+    client = app.test_client()
+    alice, bob = auth(tokens['alice']), auth(tokens['bob'])
+    routine_id, parent_id, subtask_id = make_data(client, alice)
+    bob_routine = client.post('/api/routines', json={'title': 'Bob'}, headers=bob).get_json()['id']
+
+    overwrite = json.dumps({'table': 'routines', 'id': routine_id, 'title': 'Taken'}) + '\n'
+    response = client.post('/api/import', data=overwrite.encode(), headers=bob, content_type='application/x-ndjson')
+    assert response.status_code == 400 and response.get_json()['error'] == f'routines: id {routine_id} does not belong to this user'
+    log = json.dumps({'table': 'routine_logs', 'routine_id': routine_id, 'date': TODAY.isoformat(), 'completed': False}) + '\n'
+    assert client.post('/api/import', data=log.encode(), headers=bob, content_type='application/x-ndjson').status_code == 400
+    # 他のユーザーのサブタスクを自分のルーチンの下へ移すこともできない
+    move = json.dumps({'table': 'subtasks', 'id': subtask_id, 'routine_id': bob_routine, 'title': 'Moved'}) + '\n'
+    response = client.post('/api/import', data=move.encode(), headers=bob, content_type='application/x-ndjson')
+    assert response.status_code == 400 and response.get_json()['error'] == f'subtasks: id {subtask_id} does not belong to this user'
+    board = client.get('/api/routines?offset=0', headers=alice).get_json()['routines']
+    assert [s['id'] for s in next(r for r in board if r['id'] == parent_id)['subtasks']] == [subtask_id]
+    board = client.get('/api/routines?offset=0', headers=alice).get_json()['routines']
+    assert next(r for r in board if r['id'] == routine_id)['title'] == 'Run'
+    assert next(r for r in board if r['id'] == routine_id)['current_streak'] == 3
+
+    # 自分のデータとしてなら取り込める (新しい id のルーチンとそのログ)
+    body = json.dumps({'table': 'routines', 'id': 100, 'title': 'Imported'}) + '\n'
+    body += json.dumps({'table': 'routine_logs', 'routine_id': 100, 'date': TODAY.isoformat(), 'completed': True}) + '\n'
+    assert client.post('/api/import', data=body.encode(), headers=bob, content_type='application/x-ndjson').status_code == 200
+    board = client.get('/api/routines?offset=0', headers=bob).get_json()['routines']
+    assert [(r['id'], r['current_streak']) for r in board] == [(100, 1), (bob_routine, 0)]
+    print("Import cannot touch other users: OK")
+
+
+def test_create_user_command():
+    reset_db()
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['create-user', 'carol'])
+    assert result.exit_code == 0
+    token = result.output.strip().rsplit(' ', 1)[-1]
+    client = app.test_client()
+    assert client.get('/api/routines?offset=0', headers=auth(token)).status_code == 200
+    # もう一度実行するとトークンが作り直され、古いトークンは使えなくなる
+    runner.invoke(args=['create-user', 'carol'])
+    assert client.get('/api/routines?offset=0', headers=auth(token)).status_code == 401
+    print("create-user command: OK")
+
+
+if __name__ == '__main__':
+    test_requests_require_a_user()
+    test_users_only_see_their_own_data()
+    test_session_login()
+    test_import_cannot_touch_other_users()
+    test_create_user_command()
+    print("\nALL USER TESTS PASSED!")
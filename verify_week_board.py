@@ -0,0 +1,156 @@
+import os
+from datetime import date, timedelta
+
+# 検証用にメモリ上のDBを使う (todos.db には触れない)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from sqlalchemy import event
+from app import app, get_week_dates
+from testutil import reset_db
+from cache import bump_data_version
+from models import db, Routine, RoutineLog, SubTask, SubTaskLog
+from streaks import rebuild_streaks
+
+
+def seed(routine_count, subtasks_per_routine):
+    today = date.today()
+    with app.app_context():
+        for i in range(routine_count):
+            routine = Routine(title=f'Routine {i}')
+            db.session.add(routine)
+            db.session.flush()
+            # 直近10日のうち数日を完了にしておく
+            for back in range(10):
+                if (i + back) % 3 != 0:
+                    d = today - timedelta(days=back)
+                    db.session.add(RoutineLog(routine_id=routine.id, log_date=d, completed=True))
+            for j in range(subtasks_per_routine):
+                st = SubTask(routine_id=routine.id, title=f'Sub {i}-{j}')
+                db.session.add(st)
+                db.session.flush()
+                db.session.add(SubTaskLog(subtask_id=st.id, log_date=today, completed=(j % 2 == 0)))
+        # 直接投入したログからストリーク状態を作成 (rebuild-streaks コマンドと同じ処理)
+        rebuild_streaks()
+        db.session.commit()
+
+
+def count_board_queries(client, url='/api/routines?offset=0'):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        r = client.get(url)
+        assert r.status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements), r.get_json()
+
+
+# 旧実装のストリーク計算: 今日 (未完了なら昨日) から1日ずつ遡る
+def naive_streak(routine_id):
+    check_date = date.today()
+    if not RoutineLog.query.filter_by(routine_id=routine_id, log_date=check_date, completed=True).first():
+        check_date = check_date - timedelta(days=1)
+    streak = 0
+    while RoutineLog.query.filter_by(routine_id=routine_id, log_date=check_date, completed=True).first():
+        streak += 1
+        check_date = check_date - timedelta(days=1)
+    return streak
+
+
+# 旧実装と同じ手順で組み立てたレスポンス (比較用)
+def naive_board(week_dates):
+    result = []
+    for routine in Routine.query.order_by(Routine.created_at.desc()).all():
+        week_logs = []
+        for d_str in week_dates:
+            log = RoutineLog.query.filter_by(routine_id=routine.id, log_date=date.fromisoformat(d_str)).first()
+            week_logs.append({'date': d_str, 'completed': log.completed if log else False})
+        subtasks_data = []
+        for st in SubTask.query.filter_by(routine_id=routine.id).all():
+            st_logs = []
+            for d_str in week_dates:
+                st_log = SubTaskLog.query.filter_by(subtask_id=st.id, log_date=date.fromisoformat(d_str)).first()
+                st_logs.append({'date': d_str, 'completed': st_log.completed if st_log else False})
+            subtasks_data.append({'id': st.id, 'title': st.title, 'week_logs': st_logs})
+        result.append({
+            'id': routine.id,
+            'title': routine.title,
+            'target_days': routine.target_days,
+            'week_logs': week_logs,
+            'subtasks': subtasks_data,
+            'current_streak': naive_streak(routine.id)
+        })
+    return result
+
+
+def test_query_count_is_constant():
+    client = app.test_client()
+    counts = []
+    for routine_count, subtasks_per_routine in [(2, 1), (10, 3), (50, 5)]:
+        reset_db()
+        seed(routine_count, subtasks_per_routine)
+        count, data = count_board_queries(client)
+        assert len(data['routines']) == routine_count
+        counts.append(count)
+    print(f"Statement counts: {counts}")
+    assert len(set(counts)) == 1, counts
+
+
+def test_response_matches_naive_loader():
+    reset_db()
+    seed(6, 3)
+    client = app.test_client()
+    data = client.get('/api/routines?offset=0').get_json()
+    with app.app_context():
+        week_dates = get_week_dates(0)
+        assert data['week_dates'] == week_dates
+        assert data['routines'] == naive_board(week_dates)
+
+
+# 期間指定のビット列は、同じ期間の週間ボードを並べたものと一致する
+def test_range_matches_week_boards():
+    reset_db()
+    seed(6, 3)
+    client = app.test_client()
+    data = client.get('/api/routines?weeks=3&offset=-2').get_json()
+    weeks = [client.get(f'/api/routines?offset={offset}').get_json() for offset in (-2, -1, 0)]
+    assert data['start'] == weeks[0]['week_dates'][0] and data['end'] == weeks[-1]['week_dates'][-1]
+    assert data['days'] == 21
+    for index, routine in enumerate(data['routines']):
+        logs = [log for week in weeks for log in week['routines'][index]['week_logs']]
+        assert routine['done'] == ''.join('1' if log['completed'] else '0' for log in logs)
+        assert routine['current_streak'] == weeks[0]['routines'][index]['current_streak']
+        for sub_index, st in enumerate(routine['subtasks']):
+            logs = [log for week in weeks for log in week['routines'][index]['subtasks'][sub_index]['week_logs']]
+            assert st['done'] == ''.join('1' if log['completed'] else '0' for log in logs)
+
+    # start/end は任意の期間 (週の途中から) を指定できる
+    today = date.today()
+    start = (today - timedelta(days=9)).isoformat()
+    month = client.get(f'/api/routines?start={start}&end={today.isoformat()}').get_json()
+    assert month['days'] == 10
+    with app.app_context():
+        for routine in month['routines']:
+            done = {log.log_date for log in RoutineLog.query.filter_by(routine_id=routine['id'], completed=True)}
+            assert routine['done'] == ''.join('1' if today - timedelta(days=9 - i) in done else '0' for i in range(10))
+
+    # 期間を広げてもクエリ数は変わらない
+    bump_data_version()
+    assert count_board_queries(client, '/api/routines?weeks=52&offset=-51')[0] == count_board_queries(client)[0]
+    for query in ('start=2024-01-10', 'start=2024-01-10&end=2024-01-01', 'start=x&end=2024-01-01',
+                  'weeks=0', 'start=2023-01-01&end=2024-12-31'):
+        assert client.get(f'/api/routines?{query}').status_code == 400, query
+    print("Range board matches week boards: OK")
+
+
+if __name__ == '__main__':
+    test_query_count_is_constant()
+    test_response_matches_naive_loader()
+    test_range_matches_week_boards()
+    print("\nALL WEEK BOARD TESTS PASSED!")